@@ -0,0 +1,364 @@
+"""
+MetVocab : Benchmark Suite
+==========================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Run from the root of the repository:
+
+    python benchmarks/bench.py [--quick] [--output FILE] [--check]
+
+The vocabulary data is served by the mock server in metvocab.mockserver
+from the files in tests/files, and from a generated group, so no calls
+are made to vocab.met.no. The results are printed as a table, or as
+JSON with --json, and compared against benchmarks/baseline.json. The
+timings depend on the machine, so the baseline is not part of the
+repository, and is made locally with --save-baseline.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import warnings
+import statistics
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+FILES_DIR = os.path.join(ROOT_DIR, "tests", "files")
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+sys.path.insert(0, ROOT_DIR)
+
+import metvocab  # noqa: E402
+
+from metvocab.cache import DataCache, clear_memory_cache  # noqa: E402
+from metvocab.cfstd import CFStandard  # noqa: E402
+from metvocab.mmdgroup import MMDGroup  # noqa: E402
+from metvocab.mockserver import MockServer  # noqa: E402
+
+
+class Benchmarks():
+
+    def __init__(self, work_dir, server, quick=False):
+        self._work_dir = work_dir
+        self._server = server
+        self._repeat = 3 if quick else 7
+        self._members = 100 if quick else 1000
+        self._lookups = 20000 if quick else 200000
+        self._n_cache = 0
+
+        server.add_fixtures(FILES_DIR, voc_id="mmd")
+        self._group_uri = server.add_synthetic(voc_id="mmd", groups=1, members=self._members)[0]
+        self._uris = [uri for uri in server.list_uris("mmd") if uri != self._group_uri][:200]
+
+        return
+
+    ##
+    #  Methods
+    ##
+
+    def run(self, selected=None):
+        """Run the benchmarks, or those with a name containing one of
+        the selected strings, and return the results.
+        """
+        benchmarks = [
+            ("cache_cold_files", self.bench_cache_cold, "files"),
+            ("cache_cold_sqlite", self.bench_cache_cold, "sqlite"),
+            ("cache_warm_files", self.bench_cache_warm, "files"),
+            ("cache_warm_sqlite", self.bench_cache_warm, "sqlite"),
+            ("cache_memory", self.bench_cache_memory, "files"),
+            ("cf_parse", self.bench_cf_parse, None),
+            ("cf_snapshot", self.bench_cf_snapshot, None),
+            ("cf_lookup", self.bench_cf_lookup, None),
+            ("group_search", self.bench_group_search, None),
+            ("group_init_cold", self.bench_group_init, True),
+            ("group_init_warm", self.bench_group_init, False),
+        ]
+        self._new_cache("files")
+        results = {}
+        for name, func, arg in benchmarks:
+            if selected and not any(s in name for s in selected):
+                continue
+            times = []
+            ops = 1
+            for _ in range(self._repeat):
+                ops, elapsed = func(arg)
+                times.append(elapsed)
+            results[name] = _summarise(ops, times)
+        return results
+
+    ##
+    #  Benchmarks
+    ##
+
+    def bench_cache_cold(self, backend):
+        """Fetch every entry through the mock server into an empty
+        cache.
+        """
+        self._new_cache(backend)
+        uris = self._uris
+        cache = DataCache()
+        start = time.perf_counter()
+        for uri in uris:
+            cache.get_vocab("mmd", uri)
+        return len(uris), time.perf_counter() - start
+
+    def bench_cache_warm(self, backend):
+        """Read every entry from a filled cache, bypassing the memory
+        cache.
+        """
+        self._new_cache(backend)
+        uris = self._uris
+        cache = DataCache()
+        for uri in uris:
+            cache.get_vocab("mmd", uri)
+        clear_memory_cache()
+        os.environ["METVOCAB_MEMCACHE_SIZE"] = "0"
+        try:
+            cache = DataCache()
+            start = time.perf_counter()
+            for uri in uris:
+                cache.get_vocab("mmd", uri)
+            elapsed = time.perf_counter() - start
+        finally:
+            del os.environ["METVOCAB_MEMCACHE_SIZE"]
+        return len(uris), elapsed
+
+    def bench_cache_memory(self, backend):
+        """Read every entry from the in-memory cache, many times."""
+        self._new_cache(backend)
+        uris = self._uris
+        cache = DataCache()
+        for uri in uris:
+            cache.get_vocab("mmd", uri)
+        rounds = max(self._lookups//len(uris)//10, 1)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for uri in uris:
+                cache.get_vocab("mmd", uri)
+        return rounds*len(uris), time.perf_counter() - start
+
+    def bench_cf_parse(self, _):
+        """Parse the CF Standard Names XML file."""
+        cf_std = CFStandard()
+        start = time.perf_counter()
+        cf_std.init_vocab(use_snapshot=False)
+        return 1, time.perf_counter() - start
+
+    def bench_cf_snapshot(self, _):
+        """Load the CF Standard Names from the snapshot."""
+        CFStandard().init_vocab()
+        cf_std = CFStandard()
+        start = time.perf_counter()
+        cf_std.init_vocab()
+        return 1, time.perf_counter() - start
+
+    def bench_cf_lookup(self, _):
+        """Check a mix of valid and invalid names."""
+        cf_std = CFStandard()
+        cf_std.init_vocab()
+        names = sorted(cf_std._standard_names)[:500] + [f"not_a_name_{i}" for i in range(500)]
+        rounds = max(self._lookups//len(names), 1)
+        check = cf_std.check_standard_name
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for name in names:
+                check(name)
+        return rounds*len(names), time.perf_counter() - start
+
+    def bench_group_search(self, _):
+        """Search the labels of an initialised synthetic group."""
+        self._new_cache("files")
+        group = MMDGroup("mmd", self._group_uri)
+        group.init_vocab()
+        labels = [
+            group._get_label(concept, "prefLabel") for concept in group._concepts.values()
+        ][::7] + ["MockSat"]
+        rounds = max(self._lookups//len(labels), 1)
+        search = group.search_lowercase
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for label in labels:
+                    search(label)
+            elapsed = time.perf_counter() - start
+        return rounds*len(labels), elapsed
+
+    def bench_group_init(self, cold):
+        """Initialise the synthetic group with all its members, from an
+        empty cache or from a filled cache. The time is per member.
+        """
+        self._new_cache("files")
+        if not cold:
+            MMDGroup("mmd", self._group_uri).init_vocab()
+            clear_memory_cache()
+        group = MMDGroup("mmd", self._group_uri)
+        start = time.perf_counter()
+        group.init_vocab()
+        elapsed = time.perf_counter() - start
+        assert len(group._concepts) == self._members
+        return self._members, elapsed
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _new_cache(self, backend):
+        """Point the cache to a new, empty folder."""
+        self._n_cache += 1
+        os.environ["METVOCAB_CACHEPATH"] = os.path.join(self._work_dir, f"cache{self._n_cache}")
+        os.environ["METVOCAB_BACKEND"] = backend
+        os.environ["METVOCAB_API_URL"] = self._server.url
+        clear_memory_cache()
+        return
+
+# END Class Benchmarks
+
+
+def compare(results, baseline, threshold):
+    """Compare the best time per operation against a baseline, and
+    return a dictionary of the ratio for each benchmark, and the list
+    of benchmarks slower than the threshold allows. The best time is
+    used as it is the least affected by other load on the machine.
+    """
+    ratios = {}
+    slower = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name, None)
+        if not base or not base.get("best_us"):
+            continue
+        ratio = result["best_us"]/base["best_us"]
+        ratios[name] = round(ratio, 3)
+        if ratio > 1.0 + threshold:
+            slower.append(name)
+    return ratios, slower
+
+
+def main(args=None):
+    """Run the benchmark suite, and return the exit code."""
+    parser = argparse.ArgumentParser(description="Run the metvocab benchmark suite")
+    parser.add_argument("--quick", action="store_true", help="Use fewer repeats and entries")
+    parser.add_argument("--filter", action="append", default=[], metavar="NAME",
+                        help="Only run the benchmarks with a name containing NAME")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument("--output", metavar="FILE", help="Also write the results to FILE")
+    parser.add_argument("--baseline", metavar="FILE", default=BASELINE_FILE,
+                        help="The baseline to compare against (default: benchmarks/baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Write the results to the baseline file")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="The allowed slowdown against the baseline (default: 0.25)")
+    parser.add_argument("--check", action="store_true",
+                        help="Exit with status 1 if any benchmark is slower than allowed")
+    opts = parser.parse_args(args)
+
+    has_baseline = bool(opts.baseline) and os.path.isfile(opts.baseline)
+    if opts.check and not (has_baseline or opts.save_baseline):
+        print(f"No baseline in {opts.baseline}, make one with --save-baseline", file=sys.stderr)
+        return 2
+
+    # The API calls are logged at info level
+    logger = logging.getLogger("metvocab")
+    saved_level = logger.level
+    logger.setLevel(logging.WARNING)
+
+    work_dir = tempfile.mkdtemp(prefix="metvocab-bench-")
+    saved_env = dict(os.environ)
+    try:
+        with MockServer() as server:
+            suite = Benchmarks(work_dir, server, quick=opts.quick)
+            results = suite.run(opts.filter)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_env)
+        logger.setLevel(saved_level)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "metvocab": metvocab.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": opts.quick,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "results": results,
+    }
+
+    slower = []
+    if has_baseline and not opts.save_baseline:
+        with open(opts.baseline, mode="r", encoding="utf-8") as infile:
+            baseline = json.load(infile)
+        report["ratios"], slower = compare(results, baseline, opts.threshold)
+        report["slower"] = slower
+
+    if opts.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_table(report)
+
+    out_files = [opts.output] if opts.output else []
+    if opts.save_baseline:
+        out_files.append(opts.baseline)
+    for out_file in out_files:
+        with open(out_file, mode="w", encoding="utf-8") as outfile:
+            json.dump(report, outfile, indent=2)
+            outfile.write("\n")
+
+    return 1 if opts.check and slower else 0
+
+
+##
+#  Internal Functions
+##
+
+def _summarise(ops, times):
+    """Return the best and median time per operation in microseconds,
+    and the operations per second at the median.
+    """
+    per_op = sorted(t/ops*1e6 for t in times)
+    median = statistics.median(per_op)
+    return {
+        "ops": ops,
+        "repeat": len(times),
+        "best_us": round(per_op[0], 3),
+        "median_us": round(median, 3),
+        "ops_per_s": round(1e6/median, 1) if median > 0 else None,
+    }
+
+
+def _print_table(report):
+    """Print the results as a table."""
+    ratios = report.get("ratios", {})
+    print(f"{'Benchmark':<20} {'Median us/op':>14} {'Best us/op':>14} {'Ops/s':>12} {'Ratio':>7}")
+    for name, result in report["results"].items():
+        ratio = ratios.get(name, None)
+        print(
+            f"{name:<20} {result['median_us']:>14.2f} {result['best_us']:>14.2f} "
+            f"{result['ops_per_s'] or 0.0:>12.1f} {'' if ratio is None else f'{ratio:.2f}':>7}"
+        )
+    if report.get("slower"):
+        print(f"Slower than the baseline: {', '.join(report['slower'])}")
+    return
+
+
+if __name__ == "__main__":
+    sys.exit(main())
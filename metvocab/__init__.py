@@ -26,8 +26,9 @@ import logging
 from metvocab.mmdvocab import MMDVocab
 from metvocab.mmdgroup import MMDGroup
 from metvocab.cfstd import CFStandard
+from metvocab.registry import get_vocab, get_group, get_cfstd
 
-__all__ = ["MMDVocab", "MMDGroup", "CFStandard"]
+__all__ = ["MMDVocab", "MMDGroup", "CFStandard", "get_vocab", "get_group", "get_cfstd"]
 
 CACHE_PATH = os.environ.get("METVOCAB_CACHEPATH", None)
 
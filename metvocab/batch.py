@@ -0,0 +1,112 @@
+"""
+MetVocab : Batch Lookup Functions
+=================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+def check_many(values, valid):
+    """Return a list of booleans telling if each value is in the valid
+    set. For a NumPy array, a boolean array of the same shape is
+    returned instead.
+    """
+    if _is_numpy(values):
+        return _numpy_mask(values, valid)
+
+    values = _as_list(values)
+    try:
+        if valid.issuperset(values):
+            return [True]*len(values)
+        return [value in valid for value in values]
+    except TypeError:
+        return [_contains(valid, value) for value in values]
+
+
+def filter_valid(values, valid):
+    """Return the values that are in the valid set, in their original
+    order. For a NumPy array, an array of the valid values is returned.
+    """
+    if _is_numpy(values):
+        return values[_numpy_mask(values, valid)]
+
+    values = _as_list(values)
+    try:
+        if valid.issuperset(values):
+            return list(values)
+        return [value for value in values if value in valid]
+    except TypeError:
+        return [value for value in values if _contains(valid, value)]
+
+
+def find_invalid(values, valid):
+    """Return the values that are not in the valid set, in their
+    original order. For a NumPy array, an array of the invalid values
+    is returned.
+    """
+    if _is_numpy(values):
+        return values[~_numpy_mask(values, valid)]
+
+    values = _as_list(values)
+    try:
+        invalid = set(values).difference(valid)
+        if not invalid:
+            return []
+        return [value for value in values if value in invalid]
+    except TypeError:
+        return [value for value in values if not _contains(valid, value)]
+
+
+##
+#  Internal Functions
+##
+
+def _as_list(values):
+    """Return the values as a list, unless already a list or tuple."""
+    if isinstance(values, (list, tuple)):
+        return values
+    return list(values)
+
+
+def _contains(valid, value):
+    """Check membership of a value that may not be hashable."""
+    try:
+        return value in valid
+    except TypeError:
+        return False
+
+
+def _is_numpy(values):
+    """Check if the values are a NumPy array without importing NumPy."""
+    return type(values).__module__ == "numpy" and hasattr(values, "dtype")
+
+
+def _numpy_mask(values, valid):
+    """Return a boolean array of the same shape as values telling if
+    each element is in the valid set.
+    """
+    import numpy as np
+
+    flat = values.ravel().tolist()
+    try:
+        if valid.issuperset(flat):
+            return np.ones(values.shape, dtype=bool)
+        mask = np.fromiter((value in valid for value in flat), dtype=bool, count=len(flat))
+    except TypeError:
+        mask = np.fromiter(
+            (_contains(valid, value) for value in flat), dtype=bool, count=len(flat)
+        )
+
+    return mask.reshape(values.shape)
@@ -0,0 +1,237 @@
+"""
+MetVocab : Offline Cache Bundles
+================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+
+from metvocab import __version__
+from metvocab.cache import DataCache, clear_memory_cache
+from metvocab.codec import EntryCodec
+from metvocab.storage import BundleStorage, SQLiteStorage, make_temp_file, uri_path
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FORMAT = "metvocab-bundle"
+BUNDLE_VERSION = 1
+
+
+def export_bundle(bundle_file, cache=None, compact=False):
+    """Export all entries of a cache into a single bundle file, and
+    return the number of entries. The bundle is an SQLite database with
+    the entries, and a manifest of their uris, fetch times and
+    checksums. With compact, the entries are stored with the JSON codec
+    and gzip, which can be read without any optional dependencies. The
+    bundle is written to a temporary file and then moved in place.
+    """
+    if cache is None:
+        cache = DataCache()
+    source = cache.storage
+    codec = EntryCodec(codec="json", compression="gzip") if compact else None
+
+    bundle_file = os.path.abspath(bundle_file)
+    fd, tmp_file = make_temp_file(bundle_file)
+    os.close(fd)
+
+    try:
+        target = SQLiteStorage(tmp_file, codec=codec)
+        count = 0
+        for voc_id, uri, fetched in list(source.entries()):
+            data = source.load(voc_id, uri)
+            if data is None:
+                continue
+            validators = source.load_validators(voc_id, uri)
+            if voc_id is None:
+                voc_id = _guess_voc_id(uri)
+            target.store(voc_id, uri, data, validators, fetched=fetched)
+            count += 1
+
+        conn = target._connect()
+        with conn:
+            conn.execute("CREATE TABLE bundle_info (key TEXT PRIMARY KEY, value TEXT)")
+            conn.executemany("INSERT INTO bundle_info (key, value) VALUES (?, ?)", [
+                ("format", BUNDLE_FORMAT),
+                ("version", str(BUNDLE_VERSION)),
+                ("created", str(time.time())),
+                ("metvocab", __version__),
+                ("entries", str(count)),
+            ])
+            conn.execute(
+                "CREATE TABLE manifest ("
+                "voc_id TEXT NOT NULL, "
+                "uri TEXT NOT NULL, "
+                "fetched REAL NOT NULL, "
+                "checksum TEXT NOT NULL, "
+                "PRIMARY KEY (voc_id, uri))"
+            )
+            rows = conn.execute("SELECT voc_id, uri, fetched, data FROM entries").fetchall()
+            conn.executemany(
+                "INSERT INTO manifest (voc_id, uri, fetched, checksum) VALUES (?, ?, ?, ?)",
+                [(voc_id, uri, fetched, _checksum(value)) for voc_id, uri, fetched, value in rows]
+            )
+
+        # A single file without a write-ahead log
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute("VACUUM")
+        target.close()
+        os.replace(tmp_file, bundle_file)
+
+    except BaseException:
+        for a_file in (tmp_file, tmp_file + "-wal", tmp_file + "-shm"):
+            if os.path.isfile(a_file):
+                os.unlink(a_file)
+        raise
+
+    logger.info("Exported %d entries to %s", count, bundle_file)
+
+    return count
+
+
+def import_bundle(bundle_file, cache=None, verify=True):
+    """Import all entries of a bundle file into a cache, and return the
+    number of entries. The checksums are verified before anything is
+    written, and a corrupt bundle raises a ValueError. Into an SQLite
+    cache, all entries are copied in a single transaction. The entries
+    keep the fetch times they had when exported.
+    """
+    if cache is None:
+        cache = DataCache()
+
+    bundle = BundleStorage(bundle_file)
+    try:
+        _check_info(bundle)
+        if verify:
+            corrupt = _find_corrupt(bundle)
+            if corrupt:
+                raise ValueError(
+                    f"The bundle has {len(corrupt)} corrupt entries, the first is {corrupt[0]}"
+                )
+
+        target = cache.storage
+        if isinstance(target, SQLiteStorage) and not isinstance(target, BundleStorage):
+            count = target.copy_from(bundle.location)
+        else:
+            count = 0
+            for voc_id, uri, fetched in list(bundle.entries()):
+                target.store(
+                    voc_id, uri, bundle.load(voc_id, uri), bundle.load_validators(voc_id, uri),
+                    fetched=fetched
+                )
+                count += 1
+    finally:
+        bundle.close()
+
+    clear_memory_cache()
+    logger.info("Imported %d entries from %s", count, bundle_file)
+
+    return count
+
+
+def read_manifest(bundle_file):
+    """Return the bundle information and the manifest of a bundle file.
+    The manifest is a list of dictionaries with the vocabulary id, uri,
+    fetch time and checksum of each entry.
+    """
+    bundle = BundleStorage(bundle_file)
+    try:
+        info = _check_info(bundle)
+        rows = bundle._connect().execute(
+            "SELECT voc_id, uri, fetched, checksum FROM manifest ORDER BY voc_id, uri"
+        ).fetchall()
+    finally:
+        bundle.close()
+
+    manifest = [
+        {"voc_id": voc_id, "uri": uri, "fetched": fetched, "checksum": checksum}
+        for voc_id, uri, fetched, checksum in rows
+    ]
+
+    return info, manifest
+
+
+def verify_bundle(bundle_file):
+    """Check the entries of a bundle file against its manifest, and
+    return the list of corrupt or missing uris.
+    """
+    bundle = BundleStorage(bundle_file)
+    try:
+        _check_info(bundle)
+        return _find_corrupt(bundle)
+    finally:
+        bundle.close()
+
+
+##
+#  Internal Functions
+##
+
+def _check_info(bundle):
+    """Read the bundle information, and raise a ValueError if the file
+    is not a bundle of a supported version.
+    """
+    try:
+        rows = bundle._connect().execute("SELECT key, value FROM bundle_info").fetchall()
+    except sqlite3.DatabaseError:
+        raise ValueError(f"Not a metvocab bundle: {bundle.location}") from None
+
+    info = dict(rows)
+    if info.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"Not a metvocab bundle: {bundle.location}")
+    if int(info.get("version", 0)) > BUNDLE_VERSION:
+        raise ValueError(f"The bundle version {info['version']} is not supported")
+
+    return info
+
+
+def _find_corrupt(bundle):
+    """Return the uris whose data does not match the manifest, or that
+    are missing from the entries or the manifest.
+    """
+    conn = bundle._connect()
+    rows = conn.execute(
+        "SELECT m.uri, m.checksum, e.data FROM manifest m "
+        "LEFT JOIN entries e ON e.voc_id = m.voc_id AND e.uri = m.uri"
+    )
+    corrupt = [uri for uri, checksum, value in rows if _checksum(value) != checksum]
+    rows = conn.execute(
+        "SELECT e.uri FROM entries e "
+        "LEFT JOIN manifest m ON m.voc_id = e.voc_id AND m.uri = e.uri "
+        "WHERE m.uri IS NULL"
+    )
+    corrupt.extend(uri for uri, in rows)
+    return corrupt
+
+
+def _checksum(value):
+    """Return the SHA-256 checksum of a stored data value."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return hashlib.sha256(value).hexdigest()
+
+
+def _guess_voc_id(uri):
+    """Return the vocabulary id of a uri in the vocab.met.no layout,
+    where it is the first element of the path.
+    """
+    path_list = uri_path(uri)
+    return path_list[2] if len(path_list) > 3 else ""
@@ -21,160 +21,570 @@ import os
 import sys
 import json
 import time
+import asyncio
 import logging
+import threading
 import urllib.parse
 import urllib.error
 import urllib.request
 
+from collections import OrderedDict
+
+from metvocab.codec import EntryCodec
+from metvocab.storage import open_bundle, open_storage
+from metvocab.transport import get_pool, get_breaker, get_retry_policy
+
 logger = logging.getLogger(__name__)
 
 API_ROOT_URL = "https://vocab.met.no/rest/v1"
 
 
-class DataCache():
+class MemoryCache():
 
     def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        return
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, max_age):
+        """Return the data stored under key if it was fetched less than
+        max_age seconds ago, otherwise None.
+        """
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return None
+            fetched, data = entry
+            if (time.time() - fetched) > max_age:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data, fetched, size):
+        """Store data under key, and evict the least recently used
+        entries so that at most size entries are kept.
+        """
+        with self._lock:
+            self._entries[key] = (fetched, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+        return
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+        return
+
+# END Class MemoryCache
+
+
+_memory_cache = MemoryCache()
+_known_paths = set()
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+_failed_uris = {}
+_failed_lock = threading.Lock()
+
+
+def clear_memory_cache():
+    """Clear the process-wide in-memory cache of vocabulary data."""
+    _memory_cache.clear()
+    return
+
+
+def clear_negative_cache():
+    """Forget all recently failed uris."""
+    with _failed_lock:
+        _failed_uris.clear()
+    return
+
+
+def get_api_status():
+    """Return the state of the API circuit breaker, and the uris that
+    recently failed with the time until they will be tried again.
+    """
+    now = time.time()
+    with _failed_lock:
+        failed = {}
+        for (_, _, uri), expires in _failed_uris.items():
+            if expires > now:
+                failed[uri] = max(failed.get(uri, 0.0), expires - now)
+    status = get_breaker().status
+    status["failed_uris"] = failed
+    return status
+
+
+def find_cache_path():
+    """Return the root folder of the cache from either environment
+    variable or by making guesses based on OS. The folder is not
+    created.
+    """
+    cache_path = os.environ.get("METVOCAB_CACHEPATH", None)
+
+    if cache_path is None:
+        # If no variable is set, try to pick one
+        path_tries = [
+            os.path.join("~", ".local", "share"),  # Linux
+            os.path.join("~", "Library", "Application Support"),  # macOS
+        ]
+
+        # Add a fallback path to the end of the list
+        path_tries.append("~")
+
+        for a_path in path_tries:
+            a_path = os.path.expanduser(a_path)
+            if os.path.isdir(a_path):
+                cache_path = a_path
+                break
+
+        if cache_path is None:
+            raise OSError(
+                "Could not find a location to save cache files. "
+                "Please set environment vaiable METVOCAB_CACHEPATH instead."
+            )
+
+        cache_path = os.path.join(cache_path, "metvocab")
+
+    return os.path.abspath(os.path.expanduser(cache_path))
+
+
+class DataCache():
+
+    def __init__(self, storage=None):
         self._cache_path = None
+        self._api_url = None
+        self._backend = None
+        self._codec = None
+        self._bundle_file = None
         self._max_age = None
+        self._mem_size = None
+        self._revalidate = False
+        self._max_stale = None
+        self._negative_ttl = None
         self._setup_cache_path()
+        if storage is None:
+            storage = open_storage(self._backend, self._cache_path, self._codec)
+        self._storage = storage
+        self._bundle = None
+        if self._bundle_file:
+            self._bundle = open_bundle(self._bundle_file)
         return
 
+    ##
+    #  Properties
+    ##
+
+    @property
+    def cache_path(self):
+        """Return the root folder of the cache."""
+        return self._cache_path
+
+    @property
+    def storage(self):
+        """Return the storage backend of the cache."""
+        return self._storage
+
+    @property
+    def bundle(self):
+        """Return the read-only bundle storage of the cache, or None."""
+        return self._bundle
+
+    ##
+    #  Methods
+    ##
+
     def get_vocab(self, voc_id, uri):
-        """Extract vcabulary data from the cache/API wrapper."""
+        """Extract vcabulary data from the cache/API wrapper. Recently
+        used data is kept in a process-wide in-memory cache, which is
+        shared between callers, so each caller gets its own copy.
+        """
+        key = (self._storage.location, voc_id, uri)
+        if self._mem_size > 0:
+            data = _memory_cache.get(key, self._max_age)
+            if data is not None:
+                return _copy_data(data)
+
         data = self._get_data(voc_id, uri)
-        return {} if data is None else data
+        if data is None:
+            return {}
+
+        if self._mem_size > 0:
+            fetched = self._storage.fetched(voc_id, uri)
+            if fetched is None and self._bundle is not None:
+                fetched = time.time()
+            if fetched is not None:
+                _memory_cache.put(key, data, fetched, self._mem_size)
+
+        # The stored data may share its context with other entries
+        return _copy_data(data)
+
+    def get_groups(self, voc_id):
+        """Return the uris of all concept groups of a vocabulary, as
+        listed by the API. The list is not cached. Returns None if the
+        API call fails.
+        """
+        status, data = self._api_request(f"{self._api_url}/{voc_id}/groups")
+        if not status:
+            return None
+        return [group["uri"] for group in data.get("groups", []) if "uri" in group]
+
+    def expire(self, max_age=None):
+        """Remove all cached entries older than max_age seconds, by
+        default the maximum staleness, and return the number of removed
+        entries.
+        """
+        if max_age is None:
+            max_age = self._max_stale
+        return self._storage.expire(max_age)
 
     ##
     #  Internal Functions
     ##
 
     def _get_data(self, voc_id, uri):
-        """Parses the uri to establish file path, checks if cache exists
-        and if it is below allowed caching age. Falls back to old cache
-        if API is unreachable. Returns None if API fails and no cache
-        exists.
-        """
-        urlbits = urllib.parse.urlparse(uri)
-        path_list = urlbits.path.split("/")
-        path_list.insert(0, urlbits.netloc.split(":")[0])
+        """Checks if the entry exists in the storage and if it is below
+        allowed caching age. Falls back to old cache if API is
+        unreachable. Returns None if API fails and no cache exists.
+
+        Only one process refreshes an entry at a time. If a stale entry
+        is already being refreshed, the stale data is returned, and if a
+        missing entry is being created, the caller waits for it.
 
-        if path_list[-1] == "":
-            raise ValueError("The provided uri is missing a path: '%s'", uri)
+        In stale-while-revalidate mode, stale data is returned at once
+        and refreshed in a background thread, unless it is older than
+        the maximum staleness.
 
-        json_path = os.path.join(self._cache_path, *path_list[:-1])
-        json_file = os.path.join(json_path, path_list[-1]+".json")
+        Entries missing from the storage are looked up in the bundle,
+        if there is one, before calling the API. Bundle entries are
+        never refreshed.
+        """
+        storage = self._storage
+        fetched = storage.fetched(voc_id, uri)
 
-        file_exists = False
+        if fetched is None and self._bundle is not None:
+            data = self._bundle.load(voc_id, uri)
+            if data is not None:
+                return data
 
-        if os.path.isfile(json_file):
-            file_exists = True
-            stale = self._check_timestamp(json_file, self._max_age)
+        if fetched is not None:
+            stale = self._check_timestamp(fetched, self._max_age)
             if stale:
-                self._create_cache(json_path, json_file, voc_id, uri)
+                if self._revalidate and not self._check_timestamp(fetched, self._max_stale):
+                    self._refresh_background(voc_id, uri)
+                else:
+                    self._refresh_entry(voc_id, uri)
         else:
-            file_exists = self._create_cache(json_path, json_file, voc_id, uri)
+            with storage.lock(voc_id, uri, blocking=True):
+                if storage.fetched(voc_id, uri) is None:
+                    self._create_cache(voc_id, uri)
+
+        data = storage.load(voc_id, uri)
+        if data is None and fetched is not None:
+            # The entry could not be decoded, so fetch it again in full
+            with storage.lock(voc_id, uri, blocking=True):
+                data = storage.load(voc_id, uri)
+                if data is None and self._create_cache(voc_id, uri, conditional=False):
+                    data = storage.load(voc_id, uri)
+
+        return data
+
+    def _refresh_entry(self, voc_id, uri):
+        """Refresh a stale cache entry, unless another caller is already
+        refreshing it.
+        """
+        with self._storage.lock(voc_id, uri, blocking=False) as locked:
+            if not locked:
+                logger.debug("Entry is being refreshed, using old cache: %s", uri)
+                return
+            fetched = self._storage.fetched(voc_id, uri)
+            if fetched is None or self._check_timestamp(fetched, self._max_age):
+                self._create_cache(voc_id, uri)
+        return
 
-        if file_exists:
-            with open(json_file, mode="r", encoding="utf-8") as infile:
-                data = json.load(infile)
-            return data
+    def _refresh_background(self, voc_id, uri):
+        """Start a background thread refreshing a stale cache entry, if
+        one is not already running for the entry.
+        """
+        key = (self._storage.location, voc_id, uri)
+        with _refreshing_lock:
+            if key in _refreshing:
+                return
+            _refreshing.add(key)
+
+        def refresh():
+            try:
+                self._refresh_entry(voc_id, uri)
+            except Exception as exc:
+                logger.error("Background refresh of %s failed: %s", uri, str(exc))
+            finally:
+                with _refreshing_lock:
+                    _refreshing.discard(key)
+
+        logger.debug("Refreshing in the background: %s", uri)
+        threading.Thread(target=refresh, daemon=True).start()
 
-        return None
+        return
 
-    def _create_cache(self, json_path, json_file, voc_id, uri):
-        """Sends a request to the api, and caches the data"""
-        status, data = self._retrieve_data(voc_id, uri)
+    def _create_cache(self, voc_id, uri, conditional=True):
+        """Sends a request to the api, and caches the data. If the entry
+        is already cached, the request is made conditional on the
+        stored validators, unless conditional is False, and a not
+        modified response only updates the fetch time of the entry.
+        """
+        if self._check_failed(voc_id, uri):
+            logger.debug("Recently failed, not calling API: %s", uri)
+            return False
+
+        validators = self._storage.load_validators(voc_id, uri) if conditional else {}
+        status, data = self._retrieve_data(voc_id, uri, validators)
+        if not status and data is not None:
+            # Only uris that were actually requested are negative cached
+            self._set_failed(voc_id, uri)
+        if status and data is None:
+            logger.debug("Not modified: %s", uri)
+            self._storage.touch(voc_id, uri)
+            return True
         if status:
-            os.makedirs(json_path, exist_ok=True)
-            with open(json_file, mode="w", encoding="utf-8") as outfile:
-                json.dump(data, outfile)
+            self._storage.store(voc_id, uri, data, validators)
             return True
         return False
 
-    def _check_timestamp(self, uri_file, max_age):
-        """Checks timestamp of file, if older than max_age seconds
-        returns True, if younger than max_age seconds returns False.
+    def _check_failed(self, voc_id, uri):
+        """Check if a uri failed less than the negative cache time ago.
+        Failures are keyed by api url, vocabulary and uri, so a failure
+        against one api or vocabulary does not block the others.
         """
-        file_age = os.path.getmtime(uri_file)
-        if (time.time() - file_age) > max_age:
+        key = (self._api_url, voc_id, uri)
+        with _failed_lock:
+            expires = _failed_uris.get(key, None)
+            if expires is None:
+                return False
+            if expires > time.time():
+                return True
+            del _failed_uris[key]
+        return False
+
+    def _set_failed(self, voc_id, uri):
+        """Remember that a request for a uri failed."""
+        if self._negative_ttl > 0:
+            with _failed_lock:
+                _failed_uris[(self._api_url, voc_id, uri)] = time.time() + self._negative_ttl
+        return
+
+    def _check_timestamp(self, fetched, max_age):
+        """Checks the fetch time of an entry, if older than max_age
+        seconds returns True, if younger than max_age seconds returns
+        False.
+        """
+        if (time.time() - fetched) > max_age:
             return True
         return False
 
-    def _retrieve_data(self, voc_id, uri):
+    def _retrieve_data(self, voc_id, uri, validators=None):
         """Make an API call and return the data as a dictionary.
         If the request is unsuccessful, return False and an empty
-        dictionary.
+        dictionary. If a validators dictionary is provided, the request
+        is conditional on its ETag and Last-Modified values, and the
+        dictionary is updated with the values of the response. If the
+        data is not modified, return True and None, and if the request
+        was not made as the API is unavailable, return False and None.
         """
         api_query = urllib.parse.urlencode({"uri": uri})
-        api_call = f"{API_ROOT_URL}/{voc_id}/data?{api_query}"
+        return self._api_request(f"{self._api_url}/{voc_id}/data?{api_query}", validators)
+
+    def _api_request(self, api_call, validators=None):
+        """Make an API call through the circuit breaker, and return the
+        status and the data as for _retrieve_data.
+        """
+        breaker = get_breaker()
+        if not breaker.allow():
+            logger.warning("API is unavailable, skipping call: %s", api_call)
+            return False, None
+
         logger.info("Making API call: %s", api_call)
 
         api_req = urllib.request.Request(api_call)
         api_req.add_header("user-agent", "Met-Vocab-Tools (Python script)")
         api_req.add_header("accept", "application/ld+json")
+        if validators:
+            if validators.get("etag"):
+                api_req.add_header("if-none-match", validators["etag"])
+            if validators.get("last_modified"):
+                api_req.add_header("if-modified-since", validators["last_modified"])
 
         api_resp = None
         try:
-            api_resp = urllib.request.urlopen(api_req)
+            api_resp = self._send_request(api_req)
         except urllib.error.HTTPError as err:
+            if err.code == 304:
+                breaker.record_success()
+                return True, None
+            if err.code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
             logger.error(str(err))
             return False, {}
         except urllib.error.URLError as err:
+            breaker.record_failure()
             logger.error(str(err))
             return False, {}
 
         if api_resp is None:
+            breaker.record_failure()
             logger.error("No response returned from API")
             return False, {}
 
+        breaker.record_success()
+
         ret_data = api_resp.read()
         ret_code = api_resp.status if sys.hexversion >= 0x030900f0 else api_resp.code
+        if ret_code == 304:
+            return True, None
 
         status = ret_code == 200
         data = json.loads(ret_data)
 
+        headers = getattr(api_resp, "headers", None)
+        if status and validators is not None and headers is not None:
+            validators.clear()
+            if headers.get("etag"):
+                validators["etag"] = headers.get("etag")
+            if headers.get("last-modified"):
+                validators["last_modified"] = headers.get("last-modified")
+
         return status, data
 
+    def _send_request(self, api_req):
+        """Send a request through the pooled transport, and retry it
+        according to the retry policy. The waits between retries are
+        shared with all other requests using the same policy.
+        """
+        policy = get_retry_policy()
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            if not policy.wait(start):
+                raise urllib.error.URLError("Retry deadline exceeded")
+            try:
+                return get_pool().urlopen(api_req)
+            except urllib.error.URLError as err:
+                delay = policy.next_delay(attempt, err, start)
+                if delay is None:
+                    raise
+                logger.warning("%s, retrying in %.2f seconds", str(err), delay)
+                policy.defer(delay)
+
     def _setup_cache_path(self):
         """Set up the cache folder location from either environment
         variable or by making guesses based on OS. Also parse the
         environment variable for maximum cache age.
         """
-        self._cache_path = os.environ.get("METVOCAB_CACHEPATH", None)
-
-        if self._cache_path is None:
-            # If no variable is set, try to pick one
-            path_tries = [
-                os.path.join("~", ".local", "share"),  # Linux
-                os.path.join("~", "Library", "Application Support"),  # macOS
-            ]
-
-            # Add a fallback path to the end of the list
-            path_tries.append("~")
-
-            for a_path in path_tries:
-                a_path = os.path.expanduser(a_path)
-                if os.path.isdir(a_path):
-                    self._cache_path = a_path
-                    break
-
-            if self._cache_path is None:
-                raise OSError(
-                    "Could not find a location to save cache files. "
-                    "Please set environment vaiable METVOCAB_CACHEPATH instead."
-                )
-
-            self._cache_path = os.path.join(self._cache_path, "metvocab")
+        self._cache_path = find_cache_path()
 
         # Set up the root cache folder
-        self._cache_path = os.path.abspath(os.path.expanduser(self._cache_path))
-        os.makedirs(self._cache_path, exist_ok=True)
-        logger.debug("Cache path is %s", self._cache_path)
+        if self._cache_path not in _known_paths:
+            os.makedirs(self._cache_path, exist_ok=True)
+            _known_paths.add(self._cache_path)
+            logger.debug("Cache path is %s", self._cache_path)
+
+        # Read the root url of the API, for instance of a local mock server
+        self._api_url = os.environ.get("METVOCAB_API_URL", API_ROOT_URL).rstrip("/")
+
+        # Read the storage backend and the entry encoding
+        self._backend = os.environ.get("METVOCAB_BACKEND", "files").lower()
+        encoding = os.environ.get("METVOCAB_ENCODING", "json").lower()
+        if encoding == "compact":
+            self._codec = EntryCodec(
+                codec=os.environ.get("METVOCAB_CODEC", "auto").lower(),
+                compression=os.environ.get("METVOCAB_COMPRESSION", "auto").lower(),
+            )
+        elif encoding == "json":
+            self._codec = None
+        else:
+            raise ValueError(f"Unknown cache encoding '{encoding}'")
+
+        # Read the path of a read-only bundle to use
+        self._bundle_file = os.environ.get("METVOCAB_BUNDLE", None)
 
         # Read max age and convert to seconds internally
         max_age = os.environ.get("METVOCAB_MAXAGE", "7")
         self._max_age = max(round(float(max_age)*86400), 3600)
 
+        # Read the stale-while-revalidate settings
+        revalidate = os.environ.get("METVOCAB_REVALIDATE", "0")
+        self._revalidate = revalidate.lower() in ("1", "yes", "true", "on")
+        max_stale = os.environ.get("METVOCAB_MAXSTALE", "30")
+        self._max_stale = max(round(float(max_stale)*86400), self._max_age)
+
+        # Read how long to wait before retrying a failed uri
+        self._negative_ttl = max(float(os.environ.get("METVOCAB_NEGATIVE_TTL", "60")), 0.0)
+
+        # Read the number of entries to keep in memory
+        self._mem_size = max(int(os.environ.get("METVOCAB_MEMCACHE_SIZE", "256")), 0)
+
         return
 
 # END Class DataCache
+
+
+class AsyncDataCache():
+
+    def __init__(self, cache=None, limit=None):
+        self._cache = DataCache() if cache is None else cache
+        if limit is None:
+            limit = os.environ.get("METVOCAB_FETCH_WORKERS", "8")
+        self._limit = max(int(limit), 1)
+        self._semaphore = None
+        self._loop = None
+        return
+
+    async def get_vocab(self, voc_id, uri):
+        """Extract vocabulary data from the cache/API wrapper without
+        blocking the event loop. At most limit requests are running at
+        the same time.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._get_semaphore(loop):
+            return await loop.run_in_executor(None, self._cache.get_vocab, voc_id, uri)
+
+    async def get_many(self, voc_id, uris):
+        """Extract the vocabulary data of several uris concurrently, and
+        return them as a list in the same order.
+        """
+        return await asyncio.gather(*[self.get_vocab(voc_id, uri) for uri in uris])
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _get_semaphore(self, loop):
+        """Return the concurrency limiter for the running loop."""
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self._limit)
+            self._loop = loop
+        return self._semaphore
+
+# END Class AsyncDataCache
+
+
+##
+#  Internal Functions
+##
+
+def _copy_data(data):
+    """Return a deep copy of JSON data. This is several times faster
+    than copy.deepcopy, as only dictionaries and lists are copied.
+    """
+    if isinstance(data, dict):
+        return {key: _copy_data(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_copy_data(value) for value in data]
+    return data
@@ -20,14 +20,54 @@ limitations under the License.
 import os
 import sys
 import time
+import json
+import hashlib
 import logging
 
+from functools import lru_cache
 from lxml import etree
 
+from metvocab import batch
+from metvocab.cache import find_cache_path
+from metvocab.search import SearchIndex, TokenIndex
+from metvocab.storage import make_temp_file
+
 logger = logging.getLogger(__name__)
 
 PKG_PATH = getattr(sys, "_MEIPASS", os.path.abspath(os.path.dirname(__file__)))
 
+# The snapshot is plain JSON, as the cache folder may be writable by others
+SNAPSHOT_FILE = "cf-standard-name-table.snapshot"
+SNAPSHOT_VERSION = 4
+
+# The number of recently read descriptions kept in memory
+DESCRIPTION_CACHE_SIZE = 256
+
+
+class CFEntry():
+
+    __slots__ = ("name", "canonical_units", "grib", "amip")
+
+    def __init__(self, name, canonical_units=None, grib=None, amip=None):
+        self.name = name
+        self.canonical_units = canonical_units
+        self.grib = grib
+        self.amip = amip
+        return
+
+    def __repr__(self):
+        return (
+            f"CFEntry(name={self.name!r}, canonical_units={self.canonical_units!r}, "
+            f"grib={self.grib!r}, amip={self.amip!r})"
+        )
+
+    @property
+    def grib_codes(self):
+        """Return the GRIB codes of the entry as a list."""
+        return self.grib.split() if self.grib else []
+
+# END Class CFEntry
+
 
 class CFStandard():
 
@@ -35,8 +75,20 @@ class CFStandard():
 
         self._standard_names = set()
         self._alias_names = set()
+        self._alias_map = {}
+        self._all_names = None
+        self._search_indexes = {}
+        self._token_indexes = {}
         self._is_initialised = False
 
+        # Rich Index
+        self._cf_file = None
+        self._entry_fields = {}
+        self._entries = {}
+        self._grib_index = {}
+        self._amip_index = {}
+        self._units_index = {}
+
         # Meta Data
         self._cf_version_number = "Unknown"
         self._cf_last_modified = "Unknown"
@@ -62,43 +114,69 @@ class CFStandard():
         """Return the modified date of the CF data."""
         return self._cf_last_modified
 
+    @property
+    def is_rich(self):
+        """Return True if the rich entry index is loaded."""
+        return bool(self._entries)
+
     ##
     #  Methods
     ##
 
-    def init_vocab(self):
+    def init_vocab(self, use_snapshot=True, rich=False):
         """Initialise vocabulary class by loading the data from vocab
         file. The vocab file is downloaded in XML format from:
         https://cfconventions.org/standard-names.html
-        """
-        self._standard_names = set()
-        self._alias_names = set()
-        self._is_initialised = False
 
+        The parsed data is saved as a snapshot in the cache folder, and
+        later calls load the snapshot instead as long as the checksum of
+        the vocab file is unchanged.
+
+        If rich is True, an index of the canonical units, GRIB and AMIP
+        codes of each entry is also built. The fields it needs are only
+        read, and saved in the snapshot, in that case.
+
+        The old name sets and indexes are only replaced once the new
+        ones are complete, so a shared instance is never seen empty.
+        """
+        self._entry_fields = {}
         start_time = time.time()
 
         cf_file = os.path.join(PKG_PATH, "data", "cf-standard-name-table.xml")
-        cf_xml = etree.parse(cf_file)
-        cf_root = cf_xml.getroot()
-        if cf_root.tag != "standard_name_table":
-            raise LookupError("The CF Standards file does not contain the correct root tag")
+        checksum = self._file_checksum(cf_file)
 
-        for cf_elem in cf_root:
-            if cf_elem.tag == "entry":
-                cf_id = cf_elem.attrib.get("id", None)
-                if cf_id is not None:
-                    self._standard_names.add(cf_id)
-            elif cf_elem.tag == "alias":
-                cf_id = cf_elem.attrib.get("id", None)
-                if cf_id is not None:
-                    self._alias_names.add(cf_id)
-            elif cf_elem.tag == "version_number":
-                self._cf_version_number = cf_elem.text
-            elif cf_elem.tag == "last_modified":
-                self._cf_last_modified = cf_elem.text
+        snap_file = None
+        if use_snapshot:
+            try:
+                snap_file = os.path.join(find_cache_path(), SNAPSHOT_FILE)
+            except OSError as exc:
+                logger.warning("Not using a CF Standards snapshot: %s", str(exc))
 
-        logger.debug("Parsing CF Standards file took %.3f ms", (time.time() - start_time)*1000)
+        if snap_file is not None and self._load_snapshot(snap_file, checksum, rich=rich):
+            logger.debug(
+                "Loading CF Standards snapshot took %.3f ms", (time.time() - start_time)*1000
+            )
+        else:
+            self._parse_file(cf_file, rich=rich)
+            logger.debug(
+                "Parsing CF Standards file took %.3f ms", (time.time() - start_time)*1000
+            )
+            if snap_file is not None:
+                self._save_snapshot(snap_file, checksum, rich=rich)
 
+        entries, grib_index, amip_index, units_index = self._build_index(
+            self._entry_fields if rich else {}
+        )
+        self._entries = entries
+        self._grib_index = grib_index
+        self._amip_index = amip_index
+        self._units_index = units_index
+        self._entry_fields = {}
+
+        self._all_names = None
+        self._search_indexes = {}
+        self._token_indexes = {}
+        self._cf_file = cf_file
         self._is_initialised = len(self._standard_names) > 0
 
         return
@@ -114,4 +192,345 @@ class CFStandard():
                 return True
         return False
 
+    def check_many(self, values, include_alias=False):
+        """Look up an iterable of values in the list of standard names,
+        and optionally in the alias list. Returns a list of booleans, or
+        a boolean array for a NumPy array.
+        """
+        return batch.check_many(values, self._get_valid_names(include_alias))
+
+    def filter_valid(self, values, include_alias=False):
+        """Return the values that are valid standard names, and
+        optionally aliases.
+        """
+        return batch.filter_valid(values, self._get_valid_names(include_alias))
+
+    def find_invalid(self, values, include_alias=False):
+        """Return the values that are not valid standard names, and
+        optionally not aliases.
+        """
+        return batch.find_invalid(values, self._get_valid_names(include_alias))
+
+    def resolve_standard_name(self, value):
+        """Return the current standard name of a value. A standard name
+        is returned as is, and an alias is replaced by the standard name
+        it refers to. Returns None if the value is neither.
+        """
+        if isinstance(value, str):
+            if value in self._standard_names:
+                return value
+            return self._alias_map.get(value, None)
+        return None
+
+    def get_entry(self, name):
+        """Return the CFEntry of a standard name or alias, or None if it
+        is unknown or the rich index is not loaded.
+        """
+        return self._entries.get(self.resolve_standard_name(name), None)
+
+    def get_canonical_units(self, name):
+        """Return the canonical units of a standard name or alias, or
+        None if it is unknown or the rich index is not loaded.
+        """
+        entry = self.get_entry(name)
+        return None if entry is None else entry.canonical_units
+
+    def find_by_grib(self, code):
+        """Return the set of standard names with a given GRIB code."""
+        return set(self._grib_index.get(str(code), ()))
+
+    def find_by_amip(self, code):
+        """Return the set of standard names with a given AMIP code."""
+        return set(self._amip_index.get(str(code), ()))
+
+    def find_by_units(self, units):
+        """Return the set of standard names with the given canonical
+        units.
+        """
+        return set(self._units_index.get(units, ()))
+
+    def get_description(self, name):
+        """Return the description of a standard name or alias. Only the
+        entry of the name is read from the vocab file, and the recently
+        read descriptions are kept in memory.
+        """
+        name = self.resolve_standard_name(name)
+        if name is None or self._cf_file is None:
+            return None
+        return _read_description(self._cf_file, name)
+
+    def resolve_many(self, values):
+        """Resolve an iterable of values to their current standard names
+        and return them as a list. Values that are neither a standard
+        name nor an alias are returned as None.
+        """
+        names = self._standard_names
+        alias_map = self._alias_map
+        resolved = []
+        for value in values:
+            if isinstance(value, str):
+                resolved.append(value if value in names else alias_map.get(value, None))
+            else:
+                resolved.append(None)
+        return resolved
+
+    def find_by_prefix(self, prefix, include_alias=False, limit=None):
+        """Return the standard names, and optionally aliases, starting
+        with prefix as a sorted list. The match ignores case, and spaces
+        in prefix match underscores.
+        """
+        index = self._get_search_index(include_alias)
+        return index.prefix(self._search_key(prefix), limit=limit)
+
+    def suggest_standard_name(self, value, max_distance=2, include_alias=False, limit=10):
+        """Return the standard names, and optionally aliases, within
+        max_distance edits of value, closest match first. The match
+        ignores case, and spaces in value match underscores.
+        """
+        index = self._get_search_index(include_alias)
+        return index.suggest(self._search_key(value), max_distance=max_distance, limit=limit)
+
+    def find_by_tokens(self, terms, match="all", include_alias=False):
+        """Return the sorted list of standard names, and optionally
+        aliases, containing all, or with match="any" any, of the terms.
+        The terms are a list of words, or a single string of space
+        separated words. A term like sea_water matches the words in that
+        order, so ["sea_water", "temperature"] finds all names of sea
+        water temperatures.
+        """
+        index = self._token_indexes.get(include_alias, None)
+        if index is None:
+            index = TokenIndex(self._get_valid_names(include_alias))
+            self._token_indexes[include_alias] = index
+        return index.query(terms, match=match)
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _parse_file(self, cf_file, rich=False):
+        """Parse the CF Standards XML file. The file is streamed, and
+        each top level element is cleared once it has been read, so the
+        description texts are never kept in memory. The fields of the
+        rich index are only collected if rich is True.
+        """
+        cf_tags = ("standard_name_table", "entry", "alias", "version_number", "last_modified")
+        context = etree.iterparse(cf_file, events=("start", "end"), tag=cf_tags)
+
+        standard_names = set()
+        alias_names = set()
+        alias_map = {}
+        entry_fields = {}
+        cf_version = self._cf_version_number
+        cf_modified = self._cf_last_modified
+
+        cf_root = None
+        for event, cf_elem in context:
+            if cf_root is None:
+                if event != "start" or cf_elem.tag != "standard_name_table":
+                    raise LookupError(
+                        "The CF Standards file does not contain the correct root tag"
+                    )
+                cf_root = cf_elem
+                continue
+
+            if event != "end" or cf_elem.getparent() is not cf_root:
+                continue
+
+            if cf_elem.tag == "entry":
+                cf_id = cf_elem.attrib.get("id", None)
+                if cf_id is not None:
+                    standard_names.add(cf_id)
+                    if rich:
+                        entry_fields[cf_id] = (
+                            cf_elem.findtext("canonical_units") or None,
+                            cf_elem.findtext("grib") or None,
+                            cf_elem.findtext("amip") or None,
+                        )
+            elif cf_elem.tag == "alias":
+                cf_id = cf_elem.attrib.get("id", None)
+                if cf_id is not None:
+                    alias_names.add(cf_id)
+                    entry_id = cf_elem.findtext("entry_id")
+                    if entry_id:
+                        alias_map[cf_id] = entry_id.strip()
+            elif cf_elem.tag == "version_number":
+                cf_version = cf_elem.text
+            elif cf_elem.tag == "last_modified":
+                cf_modified = cf_elem.text
+
+            # Free the element and everything read before it
+            cf_elem.clear()
+            while cf_elem.getprevious() is not None:
+                del cf_root[0]
+
+        if cf_root is None:
+            raise LookupError("The CF Standards file does not contain the correct root tag")
+
+        self._standard_names = standard_names
+        self._alias_names = alias_names
+        self._alias_map = alias_map
+        self._entry_fields = entry_fields
+        self._cf_version_number = cf_version
+        self._cf_last_modified = cf_modified
+
+        return
+
+    def _get_valid_names(self, include_alias):
+        """Return the set of standard names, optionally including the
+        aliases.
+        """
+        if not include_alias:
+            return self._standard_names
+        if self._all_names is None:
+            self._all_names = self._standard_names | self._alias_names
+        return self._all_names
+
+    def _get_search_index(self, include_alias):
+        """Return the prefix and fuzzy search index of the standard
+        names, optionally including the aliases. It is built on first
+        use.
+        """
+        index = self._search_indexes.get(include_alias, None)
+        if index is None:
+            names = self._get_valid_names(include_alias)
+            index = SearchIndex((name, name) for name in names)
+            self._search_indexes[include_alias] = index
+        return index
+
+    def _search_key(self, value):
+        """Return a search string with spaces replaced by underscores."""
+        return value.replace(" ", "_") if isinstance(value, str) else value
+
+    def _build_index(self, entry_fields):
+        """Build and return the entry records and the GRIB, AMIP and
+        units reverse indexes from the parsed entry fields.
+        """
+        entries = {}
+        grib_index = {}
+        amip_index = {}
+        units_index = {}
+        for cf_id, (units, grib, amip) in entry_fields.items():
+            entry = CFEntry(cf_id, units, grib, amip)
+            entries[cf_id] = entry
+            for code in entry.grib_codes:
+                grib_index.setdefault(code, set()).add(cf_id)
+            if amip is not None:
+                amip_index.setdefault(amip, set()).add(cf_id)
+            if units is not None:
+                units_index.setdefault(units, set()).add(cf_id)
+        return entries, grib_index, amip_index, units_index
+
+    def _file_checksum(self, cf_file):
+        """Return the checksum of the CF Standards XML file."""
+        with open(cf_file, mode="rb") as infile:
+            return hashlib.sha1(infile.read()).hexdigest()
+
+    def _load_snapshot(self, snap_file, checksum, rich=False):
+        """Load the vocabulary from a snapshot file. Returns False if the
+        snapshot is missing, unreadable, or was made from a different
+        version of the XML file, or if rich is True and the snapshot has
+        no entry fields.
+        """
+        try:
+            with open(snap_file, mode="r", encoding="utf-8") as infile:
+                snapshot = json.load(infile)
+            if not isinstance(snapshot, dict):
+                raise ValueError("The snapshot is not a JSON object")
+            if snapshot.get("version") != SNAPSHOT_VERSION or snapshot.get("checksum") != checksum:
+                return False
+            standard_names = set(_check_strings(snapshot["standard_names"]))
+            alias_names = set(_check_strings(snapshot["alias_names"]))
+            alias_map = dict(zip(
+                _check_strings(snapshot["alias_map"].keys()),
+                _check_strings(snapshot["alias_map"].values()),
+            ))
+            entry_fields = {}
+            if rich:
+                if snapshot["entry_fields"] is None:
+                    return False
+                for cf_id, fields in snapshot["entry_fields"].items():
+                    if not isinstance(fields, list) or len(fields) != 3:
+                        raise ValueError(f"Invalid entry fields for '{cf_id}'")
+                    entry_fields[cf_id] = tuple(_check_strings(fields, allow_none=True))
+            cf_version, cf_modified = _check_strings(
+                [snapshot["cf_version"], snapshot["cf_modified"]], allow_none=True
+            )
+        except FileNotFoundError:
+            return False
+        except Exception as exc:
+            logger.warning("Could not read CF Standards snapshot: %s", str(exc))
+            return False
+
+        self._standard_names = standard_names
+        self._alias_names = alias_names
+        self._alias_map = alias_map
+        self._entry_fields = entry_fields
+        self._cf_version_number = cf_version
+        self._cf_last_modified = cf_modified
+
+        return True
+
+    def _save_snapshot(self, snap_file, checksum, rich=False):
+        """Save the vocabulary to a snapshot file, with the entry fields
+        if rich is True. The file is written to a temporary file first,
+        and then moved in place.
+        """
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "checksum": checksum,
+            "standard_names": sorted(self._standard_names),
+            "alias_names": sorted(self._alias_names),
+            "alias_map": self._alias_map,
+            "entry_fields": self._entry_fields if rich else None,
+            "cf_version": self._cf_version_number,
+            "cf_modified": self._cf_last_modified,
+        }
+        try:
+            os.makedirs(os.path.dirname(snap_file), exist_ok=True)
+            fd, tmp_file = make_temp_file(snap_file)
+        except OSError as exc:
+            logger.warning("Could not save CF Standards snapshot: %s", str(exc))
+            return
+
+        try:
+            with os.fdopen(fd, mode="w", encoding="utf-8") as outfile:
+                json.dump(snapshot, outfile, separators=(",", ":"))
+            os.replace(tmp_file, snap_file)
+        except (OSError, ValueError) as exc:
+            logger.warning("Could not save CF Standards snapshot: %s", str(exc))
+            if os.path.isfile(tmp_file):
+                os.unlink(tmp_file)
+
+        return
+
 # END Class CFStandard
+
+
+##
+#  Internal Functions
+##
+
+@lru_cache(maxsize=DESCRIPTION_CACHE_SIZE)
+def _read_description(cf_file, name):
+    """Stream the vocab file until the entry of a standard name, and
+    return its description, or None if it is not found.
+    """
+    for _, cf_elem in etree.iterparse(cf_file, events=("end",), tag="entry"):
+        if cf_elem.attrib.get("id", None) == name:
+            return cf_elem.findtext("description")
+        cf_elem.clear()
+        while cf_elem.getprevious() is not None:
+            del cf_elem.getparent()[0]
+    return None
+
+
+def _check_strings(values, allow_none=False):
+    """Return a list of values, and raise a ValueError if any of them
+    is not a string, or None if allowed.
+    """
+    values = list(values)
+    for value in values:
+        if not (isinstance(value, str) or (allow_none and value is None)):
+            raise ValueError(f"Invalid value {value!r} in the snapshot")
+    return values
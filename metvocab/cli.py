@@ -0,0 +1,277 @@
+"""
+MetVocab : Command Line Interface
+=================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import json
+import argparse
+
+from itertools import chain
+
+from metvocab import __version__
+from metvocab.cfstd import CFStandard
+from metvocab.sync import sync
+from metvocab.bundle import export_bundle, import_bundle
+from metvocab.validate import find_files, validate_files
+from metvocab.mockserver import MockServer
+
+
+def main(args=None):
+    """Run the metvocab command, and return the exit code."""
+    parser = _build_parser()
+    opts = parser.parse_args(args)
+
+    if opts.command == "sync":
+        if not (opts.group or opts.all or opts.uri or opts.cf):
+            parser.error("Nothing to sync, use --group, --all, --uri or --cf")
+        return _cmd_sync(opts)
+    if opts.command == "export":
+        try:
+            count = export_bundle(opts.file, compact=opts.compact)
+        except (OSError, ValueError) as exc:
+            print(f"Export failed: {exc}")
+            return 1
+        print(f"Exported {count} entries to {opts.file}")
+        return 0
+    if opts.command == "import":
+        try:
+            count = import_bundle(opts.file, verify=not opts.no_verify)
+        except (OSError, ValueError) as exc:
+            print(f"Import failed: {exc}")
+            return 1
+        print(f"Imported {count} entries from {opts.file}")
+        return 0
+    if opts.command == "validate":
+        if not (opts.paths or opts.files_from):
+            parser.error("Nothing to validate, give a path or use --files-from")
+        return _cmd_validate(opts)
+    if opts.command == "mockserver":
+        return _cmd_mockserver(opts)
+
+    parser.print_help()
+    return 2
+
+
+##
+#  Internal Functions
+##
+
+def _build_parser():
+    """Build the argument parser with all sub commands."""
+    parser = argparse.ArgumentParser(
+        prog="metvocab", description="Toolbox for caching and interfacing with vocab.met.no"
+    )
+    parser.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
+    commands = parser.add_subparsers(dest="command")
+
+    p_sync = commands.add_parser(
+        "sync", help="Download vocabularies into the cache ahead of time",
+        description=(
+            "Download vocabulary entries and groups with all their members into the cache in "
+            "METVOCAB_CACHEPATH, and report the throughput."
+        )
+    )
+    p_sync.add_argument("--voc", default="mmd", help="The vocabulary id (default: mmd)")
+    p_sync.add_argument(
+        "--group", action="append", default=[], metavar="NAME",
+        help="A group to download with all its members, by name or uri (repeatable)"
+    )
+    p_sync.add_argument(
+        "--all", action="store_true", help="Download all groups of the vocabulary"
+    )
+    p_sync.add_argument(
+        "--uri", action="append", default=[], help="A single entry to download (repeatable)"
+    )
+    p_sync.add_argument(
+        "--workers", type=int, default=None,
+        help="The number of parallel downloads (default: METVOCAB_FETCH_WORKERS or 8)"
+    )
+    p_sync.add_argument(
+        "--cf", action="store_true", help="Also build the CF Standard Names snapshot"
+    )
+    p_sync.add_argument(
+        "--json", action="store_true", help="Print the report as JSON"
+    )
+
+    p_export = commands.add_parser(
+        "export", help="Export the cache into a single bundle file"
+    )
+    p_export.add_argument("file", help="The bundle file to write")
+    p_export.add_argument(
+        "--compact", action="store_true", help="Store the entries compressed"
+    )
+
+    p_import = commands.add_parser(
+        "import", help="Import a bundle file into the cache"
+    )
+    p_import.add_argument("file", help="The bundle file to read")
+    p_import.add_argument(
+        "--no-verify", action="store_true", help="Do not verify the checksums first"
+    )
+
+    p_validate = commands.add_parser(
+        "validate", help="Validate CF and MMD attributes in CDL or JSON attribute files",
+        description=(
+            "Check the standard_name attributes against the CF Standard Names, and the MMD "
+            "global attributes against the MMD vocabularies. Files ending in .json are read as "
+            "JSON attribute dumps, and other files as CDL text. Directories are searched for "
+            ".cdl and .json files."
+        )
+    )
+    p_validate.add_argument("paths", nargs="*", help="The files or directories to validate")
+    p_validate.add_argument(
+        "--files-from", metavar="FILE",
+        help="Read the paths to validate from a file, one per line, or from stdin with -"
+    )
+    p_validate.add_argument(
+        "--workers", type=int, default=None,
+        help="The number of worker processes (default: the number of CPUs)"
+    )
+    p_validate.add_argument(
+        "--no-mmd", action="store_true", help="Only check the CF standard names"
+    )
+    p_validate.add_argument(
+        "--json", action="store_true", help="Print the result of each file as a JSON line"
+    )
+
+    p_mock = commands.add_parser(
+        "mockserver", help="Run a local mock of the vocab.met.no API",
+        description=(
+            "Serve vocabulary data from fixture folders or synthetic groups on a local port, "
+            "for offline and load testing. Point the library to it with METVOCAB_API_URL."
+        )
+    )
+    p_mock.add_argument("--host", default="127.0.0.1", help="The address to listen on")
+    p_mock.add_argument("--port", type=int, default=8080, help="The port to listen on")
+    p_mock.add_argument("--voc", default="mmd", help="The vocabulary id (default: mmd)")
+    p_mock.add_argument(
+        "--fixtures", action="append", default=[], metavar="DIR",
+        help="A folder of JSON files to serve, named by their uri path (repeatable)"
+    )
+    p_mock.add_argument(
+        "--groups", type=int, default=0, help="The number of synthetic groups to generate"
+    )
+    p_mock.add_argument(
+        "--members", type=int, default=1000, help="The number of members per synthetic group"
+    )
+    p_mock.add_argument(
+        "--latency", type=float, default=0.0, help="The delay of each response in seconds"
+    )
+    p_mock.add_argument(
+        "--jitter", type=float, default=0.0, help="A random extra delay of up to this many seconds"
+    )
+    p_mock.add_argument(
+        "--error-rate", type=float, default=0.0, help="The fraction of requests that fail"
+    )
+    p_mock.add_argument(
+        "--rate-limit", type=float, default=None,
+        help="The number of requests per second before answering 429"
+    )
+    p_mock.add_argument("--seed", type=int, default=None, help="The random seed")
+
+    return parser
+
+
+def _cmd_sync(opts):
+    """Run the sync command."""
+    result = {}
+    failed = False
+
+    if opts.group or opts.all or opts.uri:
+        report = sync(
+            opts.voc, groups=opts.group, all_groups=opts.all, uris=opts.uri,
+            workers=opts.workers
+        )
+        result = report.as_dict()
+        failed = bool(report.failed)
+        if not opts.json:
+            print(str(report))
+
+    if opts.cf:
+        cf_std = CFStandard()
+        cf_std.init_vocab()
+        result["cf_snapshot"] = cf_std.is_initialised
+        failed = failed or not cf_std.is_initialised
+        if not opts.json:
+            print(f"CF Standard Names version {cf_std.cf_version} is ready")
+
+    if opts.json:
+        print(json.dumps(result))
+
+    return 1 if failed else 0
+
+
+def _cmd_validate(opts):
+    """Run the validate command."""
+    paths = opts.paths
+    if opts.files_from:
+        paths = chain(paths, _read_paths(opts.files_from))
+
+    total = 0
+    invalid = 0
+    mmd_fields = {} if opts.no_mmd else None
+    for result in validate_files(find_files(paths), workers=opts.workers, mmd_fields=mmd_fields):
+        total += 1
+        invalid += 0 if result.ok else 1
+        if opts.json:
+            print(json.dumps(result.as_dict()))
+        elif result.errors or result.warnings:
+            print(str(result))
+
+    if not opts.json:
+        print(f"Validated {total} files, {invalid} invalid")
+
+    return 1 if invalid else 0
+
+
+def _read_paths(path_file):
+    """Yield the non-empty lines of a file, or of stdin for "-"."""
+    if path_file == "-":
+        lines = sys.stdin
+    else:
+        lines = open(path_file, mode="r", encoding="utf-8")
+    try:
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield line
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+    return
+
+
+def _cmd_mockserver(opts):
+    """Run the mockserver command."""
+    server = MockServer(
+        host=opts.host, port=opts.port, latency=opts.latency, jitter=opts.jitter,
+        error_rate=opts.error_rate, rate_limit=opts.rate_limit, seed=opts.seed
+    )
+    count = 0
+    for directory in opts.fixtures:
+        count += server.add_fixtures(directory, voc_id=opts.voc)
+    if opts.groups > 0:
+        server.add_synthetic(voc_id=opts.voc, groups=opts.groups, members=opts.members)
+        count += opts.groups*(opts.members + 1)
+
+    server.start()
+    print(f"Serving {count} entries on {server.url}")
+    print(f"Use METVOCAB_API_URL={server.url}")
+    server.serve_forever()
+
+    return 0
@@ -0,0 +1,249 @@
+"""
+MetVocab : Cache Entry Encoding
+===============================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import gzip
+import json
+import hashlib
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"MVC1"
+NO_CONTEXT = "-"
+
+
+class JSONCodec():
+
+    name = "json"
+
+    def dumps(self, data):
+        return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def loads(self, blob):
+        return json.loads(blob)
+
+# END Class JSONCodec
+
+
+class OrjsonCodec():
+
+    name = "orjson"
+
+    def dumps(self, data):
+        return orjson.dumps(data)
+
+    def loads(self, blob):
+        return orjson.loads(blob)
+
+# END Class OrjsonCodec
+
+
+class MsgpackCodec():
+
+    name = "msgpack"
+
+    def dumps(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def loads(self, blob):
+        return msgpack.unpackb(blob, raw=False)
+
+# END Class MsgpackCodec
+
+
+class NoCompression():
+
+    name = "none"
+
+    def compress(self, blob):
+        return blob
+
+    def decompress(self, blob):
+        return blob
+
+# END Class NoCompression
+
+
+class GzipCompression():
+
+    name = "gzip"
+
+    def compress(self, blob):
+        return gzip.compress(blob, compresslevel=6, mtime=0)
+
+    def decompress(self, blob):
+        return gzip.decompress(blob)
+
+# END Class GzipCompression
+
+
+class ZstdCompression():
+
+    name = "zstd"
+
+    def compress(self, blob):
+        if zstd is not None:
+            return zstd.compress(blob, level=3)
+        return zstandard.ZstdCompressor(level=3).compress(blob)
+
+    def decompress(self, blob):
+        if zstd is not None:
+            return zstd.decompress(blob)
+        return zstandard.ZstdDecompressor().decompress(blob)
+
+# END Class ZstdCompression
+
+
+CODECS = {JSONCodec.name: JSONCodec()}
+if orjson is not None:
+    CODECS[OrjsonCodec.name] = OrjsonCodec()
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+COMPRESSIONS = {NoCompression.name: NoCompression(), GzipCompression.name: GzipCompression()}
+if zstd is not None or zstandard is not None:
+    COMPRESSIONS[ZstdCompression.name] = ZstdCompression()
+
+_contexts = {}
+_contexts_lock = threading.Lock()
+
+
+class EntryCodec():
+    """Encodes cache entries as a short header line followed by the
+    serialised and compressed data. The JSON-LD context of an entry is
+    split off and stored once under its hash, as it is the same for all
+    entries of a vocabulary.
+    """
+
+    def __init__(self, codec="auto", compression="auto", shared_context=True):
+        if codec == "auto":
+            codec = next(name for name in ("orjson", "msgpack", "json") if name in CODECS)
+        if compression == "auto":
+            compression = "zstd" if "zstd" in COMPRESSIONS else "gzip"
+        if codec not in CODECS:
+            raise ValueError(f"The '{codec}' codec is not available")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"The '{compression}' compression is not available")
+
+        self._codec = CODECS[codec]
+        self._compression = COMPRESSIONS[compression]
+        self._shared_context = shared_context
+
+        return
+
+    @property
+    def spec(self):
+        """Return the codec, compression and context setting."""
+        return (self._codec.name, self._compression.name, self._shared_context)
+
+    def encode(self, data):
+        """Encode data. Returns the encoded entry, and the hash and
+        encoded value of the split off context, or None.
+        """
+        if not (self._shared_context and isinstance(data, dict) and "@context" in data):
+            return self._pack(data, NO_CONTEXT), None
+
+        context = data["@context"]
+        ctx_hash = context_hash(context)
+        body = {key: value for key, value in data.items() if key != "@context"}
+        with _contexts_lock:
+            _contexts.setdefault(ctx_hash, context)
+
+        return self._pack(body, ctx_hash), (ctx_hash, self._pack(context, NO_CONTEXT))
+
+    def _pack(self, data, ctx_hash):
+        """Build the header line and the payload."""
+        header = b" ".join([
+            MAGIC,
+            self._codec.name.encode("ascii"),
+            self._compression.name.encode("ascii"),
+            ctx_hash.encode("ascii"),
+        ])
+        return header + b"\n" + self._compression.compress(self._codec.dumps(data))
+
+# END Class EntryCodec
+
+
+def is_encoded(blob):
+    """Check if a stored value was made by an EntryCodec."""
+    return isinstance(blob, bytes) and blob.startswith(MAGIC + b" ")
+
+
+def decode_entry(blob, load_context):
+    """Decode an entry made by an EntryCodec with any settings. A split
+    off context is looked up by calling load_context with its hash, and
+    kept in memory and shared between the entries using it, so it must
+    not be modified. Raises a ValueError if the entry cannot be decoded.
+    """
+    header, _, payload = blob.partition(b"\n")
+    try:
+        _, codec, compression, ctx_hash = header.decode("ascii").split(" ")
+    except ValueError:
+        raise ValueError("Not a valid cache entry") from None
+
+    if codec not in CODECS and codec == OrjsonCodec.name:
+        codec = JSONCodec.name
+    if codec not in CODECS or compression not in COMPRESSIONS:
+        raise ValueError(f"Cannot decode a cache entry in {codec} format with {compression}")
+
+    try:
+        data = CODECS[codec].loads(COMPRESSIONS[compression].decompress(payload))
+    except Exception as exc:
+        # Each codec and compression raises its own errors on bad data
+        raise ValueError(f"Cannot decode a cache entry: {exc}") from exc
+    if ctx_hash == NO_CONTEXT:
+        return data
+
+    context = _contexts.get(ctx_hash, None)
+    if context is None:
+        ctx_blob = load_context(ctx_hash)
+        if ctx_blob is None:
+            raise ValueError(f"The shared context {ctx_hash} is missing")
+        context = decode_entry(ctx_blob, load_context)
+        with _contexts_lock:
+            context = _contexts.setdefault(ctx_hash, context)
+
+    entry = {"@context": context}
+    entry.update(data)
+
+    return entry
+
+
+def context_hash(context):
+    """Return the hash of a context, independent of key order."""
+    text = json.dumps(context, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
@@ -16,20 +16,33 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import os
 import warnings
 
-from metvocab.cache import DataCache
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from metvocab.cache import DataCache, AsyncDataCache
+from metvocab.search import SearchIndex
 
 
 class MMDGroup():
 
-    def __init__(self, voc_id, uri):
+    def __init__(self, voc_id, uri, workers=None):
 
         self._voc_id = voc_id
         self._uri = uri
 
+        if workers is None:
+            workers = os.environ.get("METVOCAB_FETCH_WORKERS", "8")
+        self._workers = max(int(workers), 1)
+
         self._is_initialised = False
         self._concepts = {}
+        self._label_index = {}
+        self._label_index_lower = {}
+        self._search_index = SearchIndex()
+        self._warned = False
 
         return
 
@@ -48,23 +61,40 @@ class MMDGroup():
 
     def init_vocab(self):
         """Populate _concepts with dictionary uri: data for members of
-        the given group
+        the given group. The members are fetched concurrently using up
+        to the configured number of worker threads.
         """
-        root_cache = DataCache()
-        data = root_cache.get_vocab(self._voc_id, self._uri)
-        self._concepts = {}
+        cache = DataCache()
+        data = cache.get_vocab(self._voc_id, self._uri)
+        members = self._get_members(data)
+
+        fetch_member = partial(self._fetch_member, cache)
+        if self._workers > 1 and len(members) > 1:
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                concepts = list(executor.map(fetch_member, members))
+        else:
+            concepts = [fetch_member(uri) for uri in members]
 
-        for graph in data.get("graph", []):
-            for member in graph.get("skos:member", []):
-                if member.get("uri", None) is not None:
-                    uri = member.get("uri")
-                    tmp_cache = DataCache()
-                    data = tmp_cache.get_vocab(self._voc_id, uri)
-                    data = self._get_concept_dictionary(data, uri)
+        self._set_concepts(members, concepts)
+
+        return
+
+    async def init_vocab_async(self, cache=None):
+        """Populate _concepts without blocking the event loop. The
+        members are fetched concurrently, limited by the worker count or
+        by the AsyncDataCache passed in.
+        """
+        if cache is None:
+            cache = AsyncDataCache(limit=self._workers)
 
-                    self._concepts.update({member.get("uri"): data})
+        data = await cache.get_vocab(self._voc_id, self._uri)
+        members = self._get_members(data)
 
-        self._is_initialised = bool(self._concepts)
+        member_data = await cache.get_many(self._voc_id, members)
+        concepts = [
+            self._get_concept_dictionary(member, uri) for uri, member in zip(members, member_data)
+        ]
+        self._set_concepts(members, concepts)
 
         return
 
@@ -73,23 +103,11 @@ class MMDGroup():
         for match with given name, returns both if any match, and
         resource if resource is present
         """
-        found = False
-        for concept in self._concepts.values():
-            found |= name == self._get_label(concept, "altLabel")
-            found |= name == self._get_label(concept, "prefLabel")
-            if found is True:
-                return {
-                    "Short_Name": self._get_label(concept, "prefLabel"),
-                    "short_name": self._get_label(concept, "prefLabel"),
-                    "Long_Name": self._get_label(concept, "altLabel"),
-                    "long_name": self._get_label(concept, "altLabel"),
-                    "Resource": self._get_resource(concept, "uri"),
-                    "resource": self._get_resource(concept, "uri")
-                }
-
-        warnings.warn("Short_Name, Long_Name and Resource dict keys "
-                      "are deprecated, and will be removed in v2.0 of"
-                      " met-vocab-tools.")
+        result = self._label_index.get(name, None) if isinstance(name, str) else None
+        if result is not None:
+            return dict(result)
+
+        self._warn_deprecated()
 
         return {}
 
@@ -99,30 +117,108 @@ class MMDGroup():
         returns both prefLabel and altLabel if any is found, and resource
         if resource is present
         """
-        name = name.lower()
-        found = False
-        for concept in self._concepts.values():
-            found |= name == self._get_label_lowercase(concept, "altLabel")
-            found |= name == self._get_label_lowercase(concept, "prefLabel")
-            if found is True:
-                return {
-                    "Short_Name": self._get_label(concept, "prefLabel"),
-                    "short_name": self._get_label(concept, "prefLabel"),
-                    "Long_Name": self._get_label(concept, "altLabel"),
-                    "long_name": self._get_label(concept, "altLabel"),
-                    "Resource": self._get_resource(concept, "uri"),
-                    "resource": self._get_resource(concept, "uri")
-                }
-
-        warnings.warn("Short_Name, Long_Name and Resource dict keys "
-                      "are deprecated, and will be removed in v2.0 of"
-                      " met-vocab-tools.")
+        result = self._label_index_lower.get(name.lower(), None)
+        if result is not None:
+            return dict(result)
+
+        self._warn_deprecated()
 
         return {}
+
+    def search_prefix(self, prefix, limit=None):
+        """Returns the concepts with a prefLabel or altLabel starting
+        with prefix, ignoring case, as a list of the same dictionaries as
+        returned by search, ordered by label.
+        """
+        return [dict(result) for result in self._search_index.prefix(prefix, limit=limit)]
+
+    def suggest(self, name, max_distance=2, limit=10):
+        """Returns the concepts with a prefLabel or altLabel within
+        max_distance edits of name, ignoring case, as a list of the same
+        dictionaries as returned by search, closest match first.
+        """
+        return [
+            dict(result) for result in
+            self._search_index.suggest(name, max_distance=max_distance, limit=limit)
+        ]
+
     ##
     #  Internal Functions
     ##
 
+    def _get_members(self, data):
+        """Return the list of member uris of the group data."""
+        members = []
+        for graph in data.get("graph", []):
+            for member in graph.get("skos:member", []):
+                if member.get("uri", None) is not None:
+                    members.append(member.get("uri"))
+        return members
+
+    def _set_concepts(self, members, concepts):
+        """Populate _concepts from matching lists of member uris and
+        concept dictionaries. The new lookup tables are built before
+        they replace the old ones, so an instance shared between threads
+        is never seen empty while it is initialised again.
+        """
+        new_concepts = {}
+        for uri, concept in zip(members, concepts):
+            new_concepts.update({uri: concept})
+
+        label_index, label_index_lower, search_index = self._build_index(new_concepts)
+        self._label_index = label_index
+        self._label_index_lower = label_index_lower
+        self._search_index = search_index
+        self._concepts = new_concepts
+        self._is_initialised = bool(new_concepts)
+
+        return
+
+    def _build_index(self, concepts):
+        """Build and return the exact and lowercase label lookup tables,
+        and the prefix and fuzzy search index, of a dictionary of
+        concepts. The first concept with a matching prefLabel or
+        altLabel takes precedence.
+        """
+        label_index = {}
+        label_index_lower = {}
+        labels = []
+        for concept in concepts.values():
+            result = {
+                "Short_Name": self._get_label(concept, "prefLabel"),
+                "short_name": self._get_label(concept, "prefLabel"),
+                "Long_Name": self._get_label(concept, "altLabel"),
+                "long_name": self._get_label(concept, "altLabel"),
+                "Resource": self._get_resource(concept, "uri"),
+                "resource": self._get_resource(concept, "uri")
+            }
+            for label in ("altLabel", "prefLabel"):
+                value = self._get_label(concept, label)
+                if isinstance(value, str):
+                    label_index.setdefault(value, result)
+                    label_index_lower.setdefault(value.lower(), result)
+                    labels.append((value, result))
+
+        return label_index, label_index_lower, SearchIndex(labels)
+
+    def _warn_deprecated(self):
+        """Emit the deprecation warning for the capitalised result keys,
+        but only once per instance.
+        """
+        if not self._warned:
+            self._warned = True
+            warnings.warn("Short_Name, Long_Name and Resource dict keys "
+                          "are deprecated, and will be removed in v2.0 of"
+                          " met-vocab-tools.")
+        return
+
+    def _fetch_member(self, cache, uri):
+        """Retrieve the data of a single group member and return the
+        concept dictionary.
+        """
+        data = cache.get_vocab(self._voc_id, uri)
+        return self._get_concept_dictionary(data, uri)
+
     def _get_concept_dictionary(self, data, uri):
         """Returns dictionary matching the concept itself, without
         headers
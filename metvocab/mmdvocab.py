@@ -17,7 +17,8 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from metvocab.cache import DataCache
+from metvocab import batch
+from metvocab.cache import DataCache, AsyncDataCache
 
 
 class MMDVocab():
@@ -52,18 +53,18 @@ class MMDVocab():
         cache class.
         """
         self._data = self._cache.get_vocab(self._voc_id, self._uri)
+        self._parse_data()
+        return
 
-        self._concept_values = set()
-        for graph in self._data.get("graph", []):
-            if self._check_is_concept(graph.get("type", None)):
-                prefLabel = graph.get("prefLabel", None)
-                if prefLabel is not None:
-                    value = prefLabel.get("value", None)
-                    if value is not None:
-                        self._concept_values.add(value)
-
-        self._is_initialised = len(self._concept_values) > 0
-
+    async def init_vocab_async(self, cache=None):
+        """Initialise vocabulary class without blocking the event loop.
+        An AsyncDataCache can be passed in to share its concurrency
+        limit between several vocabularies.
+        """
+        if cache is None:
+            cache = AsyncDataCache(cache=self._cache)
+        self._data = await cache.get_vocab(self._voc_id, self._uri)
+        self._parse_data()
         return
 
     def check_concept_value(self, value):
@@ -74,10 +75,45 @@ class MMDVocab():
             raise ValueError("Attribute 'value' must be a string")
         return value in self._concept_values
 
+    def check_many(self, values):
+        """Lookup an iterable of values in the concept value set and
+        return a list of booleans, or a boolean array for a NumPy array.
+        Values that are not strings are not valid.
+        """
+        return batch.check_many(values, self._concept_values)
+
+    def filter_valid(self, values):
+        """Return the values that are defined in the concept value set."""
+        return batch.filter_valid(values, self._concept_values)
+
+    def find_invalid(self, values):
+        """Return the values that are not defined in the concept value
+        set.
+        """
+        return batch.find_invalid(values, self._concept_values)
+
     ##
     #  Internal Functions
     ##
 
+    def _parse_data(self):
+        """Build the concept value set from the vocabulary data. The new
+        set replaces the old one when it is complete.
+        """
+        concept_values = set()
+        for graph in self._data.get("graph", []):
+            if self._check_is_concept(graph.get("type", None)):
+                prefLabel = graph.get("prefLabel", None)
+                if prefLabel is not None:
+                    value = prefLabel.get("value", None)
+                    if value is not None:
+                        concept_values.add(value)
+
+        self._concept_values = concept_values
+        self._is_initialised = len(concept_values) > 0
+
+        return
+
     def _check_is_concept(self, value):
         """Checks that a value that can be either a list or a string
         contains the type definition of a concept dictionary object.
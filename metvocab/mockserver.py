@@ -0,0 +1,397 @@
+"""
+MetVocab : Mock Vocabulary Server
+=================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+import urllib.parse
+
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+VOCAB_ROOT_URL = "https://vocab.met.no"
+
+CONTEXT = {
+    "skos": "http://www.w3.org/2004/02/skos/core#",
+    "isothes": "http://purl.org/iso25964/skos-thes#",
+    "rdfs": "http://www.w3.org/2000/01/rdf-schema#",
+    "owl": "http://www.w3.org/2002/07/owl#",
+    "dct": "http://purl.org/dc/terms/",
+    "dc11": "http://purl.org/dc/elements/1.1/",
+    "uri": "@id",
+    "type": "@type",
+    "lang": "@language",
+    "value": "@value",
+    "graph": "@graph",
+    "label": "rdfs:label",
+    "prefLabel": "skos:prefLabel",
+    "altLabel": "skos:altLabel",
+    "hiddenLabel": "skos:hiddenLabel",
+    "broader": "skos:broader",
+    "narrower": "skos:narrower",
+    "related": "skos:related",
+    "inScheme": "skos:inScheme",
+}
+
+
+class MockServer():
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_codes=(500, 503), rate_limit=None, seed=None):
+        """A local stand-in for the vocab.met.no API, serving the data
+        and groups endpoints from memory in a thread per connection.
+
+        Every response is delayed by latency seconds plus a random part
+        of up to jitter seconds. A fraction error_rate of the requests
+        fail with one of error_codes. With rate_limit, requests beyond
+        that many per second are answered with 429 and a Retry-After
+        header. The settings can be changed while the server runs.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.rate_limit = rate_limit
+
+        self._host = host
+        self._port = port
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._groups = {}
+        self._stats = {}
+        self._tokens = None
+        self._token_time = time.monotonic()
+        self._server = None
+        self._thread = None
+
+        return
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+        return
+
+    ##
+    #  Properties
+    ##
+
+    @property
+    def url(self):
+        """Return the root url of the API, to use as METVOCAB_API_URL."""
+        if self._server is None:
+            return None
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/rest/v1"
+
+    @property
+    def stats(self):
+        """Return the number of requests, and the number of responses
+        with each status code.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    ##
+    #  Methods
+    ##
+
+    def start(self):
+        """Start serving in a background thread."""
+        if self._server is not None:
+            return
+        handler = type("Handler", (_Handler,), {"mock": self})
+        self._server = ThreadingHTTPServer((self._host, self._port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info("Mock server listening on %s", self.url)
+        return
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+        return
+
+    def serve_forever(self):
+        """Start serving, and block until interrupted."""
+        self.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+        return
+
+    def add_entry(self, voc_id, uri, data):
+        """Add or replace the data of an entry, given as a dictionary or
+        as JSON bytes. The ETag and Last-Modified headers change whenever
+        the data changes.
+        """
+        body = data if isinstance(data, bytes) else json.dumps(data).encode("utf-8")
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        modified = formatdate(time.time(), usegmt=True)
+        with self._lock:
+            old = self._entries.get((voc_id, uri), None)
+            if old is not None and old[1] == etag:
+                modified = old[2]
+            self._entries[(voc_id, uri)] = (body, etag, modified)
+        return
+
+    def remove_entry(self, voc_id, uri):
+        """Remove an entry, so that it returns 404."""
+        with self._lock:
+            self._entries.pop((voc_id, uri), None)
+            self._groups.get(voc_id, {}).pop(uri, None)
+        return
+
+    def list_uris(self, voc_id):
+        """Return the sorted uris of all entries of a vocabulary."""
+        with self._lock:
+            return sorted(uri for v_id, uri in self._entries if v_id == voc_id)
+
+    def add_group(self, voc_id, uri, label):
+        """List a group uri by the groups endpoint."""
+        with self._lock:
+            self._groups.setdefault(voc_id, {})[uri] = label
+        return
+
+    def add_fixtures(self, directory, voc_id="mmd"):
+        """Add all JSON files in a directory tree as entries. The uri of
+        each file is its path below the directory, without the suffix,
+        in the vocabulary, so Instrument/MODIS.json in the mmd
+        vocabulary is https://vocab.met.no/mmd/Instrument/MODIS.
+        Returns the number of entries added.
+        """
+        count = 0
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                rel_path = os.path.relpath(path, directory)[:-5].replace(os.sep, "/")
+                uri = f"{VOCAB_ROOT_URL}/{voc_id}/{rel_path}"
+                with open(path, mode="rb") as infile:
+                    body = infile.read()
+                self.add_entry(voc_id, uri, body)
+                if _is_group(json.loads(body), uri):
+                    self.add_group(voc_id, uri, rel_path)
+                count += 1
+        return count
+
+    def add_synthetic(self, voc_id="mmd", groups=1, members=1000, prefix="Synthetic"):
+        """Add generated groups with the given number of member
+        concepts each, and return the list of group uris. Member n of
+        group g has the prefLabel {prefix}{g}-{n:05d} and the altLabel
+        {prefix} {g} concept {n}.
+        """
+        group_uris = []
+        for g in range(1, groups + 1):
+            name = f"{prefix}{g}"
+            group_uri = f"{VOCAB_ROOT_URL}/{voc_id}/{name}"
+            member_uris = [f"{group_uri}/C{n:05d}" for n in range(1, members + 1)]
+            group_stub = {"uri": group_uri, "type": ["isothes:ConceptGroup", "skos:Collection"]}
+
+            for n, uri in enumerate(member_uris, 1):
+                self.add_entry(voc_id, uri, {
+                    "@context": CONTEXT,
+                    "graph": [
+                        dict(group_stub, **{"skos:member": {"uri": uri}}),
+                        {
+                            "uri": uri,
+                            "type": ["skos:Concept"],
+                            "inScheme": {"uri": f"{VOCAB_ROOT_URL}/{voc_id}"},
+                            "prefLabel": {"lang": "en", "value": f"{name}-{n:05d}"},
+                            "altLabel": {"lang": "en", "value": f"{prefix} {g} concept {n}"},
+                        },
+                    ],
+                })
+
+            self.add_entry(voc_id, group_uri, {
+                "@context": CONTEXT,
+                "graph": [
+                    dict(group_stub, **{
+                        "prefLabel": {"lang": "en", "value": name},
+                        "skos:member": [{"uri": uri} for uri in member_uris],
+                    }),
+                ] + [{"uri": uri, "type": ["skos:Concept"]} for uri in member_uris],
+            })
+            self.add_group(voc_id, group_uri, name)
+            group_uris.append(group_uri)
+
+        return group_uris
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _get_entry(self, voc_id, uri):
+        """Return the body, ETag and Last-Modified of an entry, or None."""
+        with self._lock:
+            return self._entries.get((voc_id, uri), None)
+
+    def _get_groups(self, voc_id):
+        """Return the body of the groups endpoint, or None."""
+        with self._lock:
+            groups = dict(self._groups.get(voc_id, {}))
+        if not groups:
+            return None
+        return json.dumps({
+            "@context": CONTEXT,
+            "uri": "",
+            "groups": [
+                {"uri": uri, "prefLabel": label, "hasMembers": True}
+                for uri, label in sorted(groups.items())
+            ],
+        }).encode("utf-8")
+
+    def _next_fault(self):
+        """Decide if a request is rate limited or fails, and return the
+        status code and the delay before responding.
+        """
+        with self._lock:
+            delay = self.latency + (self._random.random()*self.jitter if self.jitter else 0.0)
+            if self.rate_limit:
+                now = time.monotonic()
+                burst = max(float(self.rate_limit), 1.0)
+                if self._tokens is None:
+                    self._tokens = burst
+                self._tokens = min(
+                    self._tokens + (now - self._token_time)*self.rate_limit, burst
+                )
+                self._token_time = now
+                if self._tokens < 1.0:
+                    return 429, delay
+                self._tokens -= 1.0
+            if self.error_rate and self._random.random() < self.error_rate:
+                return self._random.choice(self.error_codes), delay
+        return None, delay
+
+    def _count(self, status):
+        """Count a request and its status code."""
+        with self._lock:
+            self._stats["requests"] = self._stats.get("requests", 0) + 1
+            self._stats[status] = self._stats.get(status, 0) + 1
+        return
+
+# END Class MockServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    # Keep-alive, like the real API, without Nagle delays between the
+    # headers and the body
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    mock = None
+
+    def do_GET(self):
+        """Serve /rest/v1/{voc_id}/data?uri= and /rest/v1/{voc_id}/groups."""
+        url = urllib.parse.urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+
+        status, delay = self.mock._next_fault()
+        if delay > 0.0:
+            time.sleep(delay)
+        if status is not None:
+            headers = {"Retry-After": "1"} if status == 429 else {}
+            self._respond(status, b"", headers)
+            return
+
+        if len(parts) != 4 or parts[:2] != ["rest", "v1"]:
+            self._respond(404, b"")
+            return
+
+        voc_id = parts[2]
+        if parts[3] == "groups":
+            body = self.mock._get_groups(voc_id)
+            if body is None:
+                self._respond(404, b"")
+            else:
+                self._respond(200, body)
+            return
+        if parts[3] != "data":
+            self._respond(404, b"")
+            return
+
+        uri = urllib.parse.parse_qs(url.query).get("uri", [""])[0]
+        entry = self.mock._get_entry(voc_id, uri)
+        if entry is None:
+            self._respond(404, b"")
+            return
+
+        body, etag, modified = entry
+        headers = {"ETag": etag, "Last-Modified": modified}
+        if_none_match = self.headers.get("If-None-Match", None)
+        if_modified_since = self.headers.get("If-Modified-Since", None)
+        if if_none_match is not None:
+            not_modified = etag in [tag.strip() for tag in if_none_match.split(",")]
+        else:
+            not_modified = if_modified_since == modified
+        if not_modified:
+            self._respond(304, b"", headers)
+        else:
+            self._respond(200, body, headers)
+
+        return
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+        return
+
+    def _respond(self, status, body, headers=None):
+        """Send a response with a body and extra headers."""
+        self.mock._count(status)
+        self.send_response(status)
+        if status != 304:
+            self.send_header("Content-Type", "application/ld+json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body and status != 304:
+            self.wfile.write(body)
+        return
+
+# END Class _Handler
+
+
+def _is_group(data, uri):
+    """Check if the data of an entry is a group with members."""
+    for graph in data.get("graph", []) if isinstance(data, dict) else []:
+        if graph.get("uri", None) == uri and "skos:member" in graph:
+            return True
+    return False
@@ -0,0 +1,173 @@
+"""
+MetVocab : Vocabulary Registry
+==============================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+import logging
+import threading
+
+from metvocab.cache import DataCache
+from metvocab.cfstd import CFStandard
+from metvocab.mmdgroup import MMDGroup
+from metvocab.mmdvocab import MMDVocab
+
+logger = logging.getLogger(__name__)
+
+
+class VocabRegistry():
+
+    def __init__(self, max_age=None):
+
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._key_locks = {}
+        self._refreshing = {}
+
+        return
+
+    ##
+    #  Methods
+    ##
+
+    def get_vocab(self, voc_id, uri):
+        """Return a shared, initialised MMDVocab instance."""
+        return self._get(("MMDVocab", voc_id, uri), lambda: MMDVocab(voc_id, uri), True)
+
+    def get_group(self, voc_id, uri):
+        """Return a shared, initialised MMDGroup instance."""
+        return self._get(("MMDGroup", voc_id, uri), lambda: MMDGroup(voc_id, uri), True)
+
+    def get_cfstd(self):
+        """Return a shared, initialised CFStandard instance. The CF data
+        is bundled with the package, so it is never refreshed.
+        """
+        return self._get(("CFStandard",), CFStandard, False)
+
+    def clear(self):
+        """Remove all shared instances."""
+        with self._lock:
+            self._entries = {}
+            self._key_locks = {}
+        return
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _get(self, key, factory, expires):
+        """Return the shared instance for key, creating it on first use,
+        and start a background refresh if it has expired. An instance
+        that could not be initialised is refreshed on the next lookup.
+        """
+        entry = self._entries.get(key, None)
+        if entry is None:
+            with self._lock:
+                key_lock = self._key_locks.setdefault(key, threading.Lock())
+            with key_lock:
+                entry = self._entries.get(key, None)
+                if entry is None:
+                    instance = self._create(factory)
+                    entry = (self._timestamp(key, instance), instance)
+                    with self._lock:
+                        self._entries[key] = entry
+            return entry[1]
+
+        loaded, instance = entry
+        if expires:
+            expired = (time.time() - loaded) > self._get_max_age()
+        else:
+            expired = loaded == 0.0
+        if expired:
+            with self._lock:
+                if key not in self._refreshing:
+                    thread = threading.Thread(
+                        target=self._refresh, args=(key, factory), daemon=True
+                    )
+                    self._refreshing[key] = thread
+                    thread.start()
+
+        return instance
+
+    def _create(self, factory):
+        """Create and initialise a new instance."""
+        instance = factory()
+        instance.init_vocab()
+        return instance
+
+    def _refresh(self, key, factory):
+        """Replace the shared instance for key with a new one. The old
+        instance is kept if the new one could not be initialised, but
+        only if the old one was.
+        """
+        try:
+            instance = self._create(factory)
+            with self._lock:
+                old = self._entries.get(key, (0.0, None))[1]
+                if not instance.is_initialised and old is not None and old.is_initialised:
+                    logger.warning("Could not refresh %s, keeping the old data", key[0])
+                    self._entries[key] = (time.time(), old)
+                else:
+                    self._entries[key] = (self._timestamp(key, instance), instance)
+        except Exception as exc:
+            logger.error("Refreshing %s failed: %s", key[0], str(exc))
+        finally:
+            with self._lock:
+                self._refreshing.pop(key, None)
+        return
+
+    def _timestamp(self, key, instance):
+        """Return the load time to store with an instance. An instance
+        that could not be initialised gets 0, so it is retried.
+        """
+        if instance.is_initialised:
+            return time.time()
+        logger.warning("Could not initialise %s, retrying on the next lookup", key[0])
+        return 0.0
+
+    def _get_max_age(self):
+        """Return the maximum age of a shared instance in seconds."""
+        if self._max_age is None:
+            self._max_age = DataCache()._max_age
+        return self._max_age
+
+# END Class VocabRegistry
+
+
+_registry = VocabRegistry()
+
+
+def get_vocab(voc_id, uri):
+    """Return a shared, initialised MMDVocab instance from the
+    process-wide registry. The instance must not be modified.
+    """
+    return _registry.get_vocab(voc_id, uri)
+
+
+def get_group(voc_id, uri):
+    """Return a shared, initialised MMDGroup instance from the
+    process-wide registry. The instance must not be modified.
+    """
+    return _registry.get_group(voc_id, uri)
+
+
+def get_cfstd():
+    """Return a shared, initialised CFStandard instance from the
+    process-wide registry. The instance must not be modified.
+    """
+    return _registry.get_cfstd()
@@ -0,0 +1,257 @@
+"""
+MetVocab : Label Search Index
+=============================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bisect import bisect_left
+
+# Sorts after any character that can follow a prefix
+MAX_CHAR = chr(0x10ffff)
+
+
+class SearchIndex():
+
+    __slots__ = ("_keys", "_values")
+
+    def __init__(self, items=()):
+        """Build a case-insensitive index from an iterable of label and
+        value pairs. A value can be indexed under several labels.
+        """
+        pairs = sorted(
+            ((label.lower(), value) for label, value in items if isinstance(label, str)),
+            key=lambda pair: pair[0]
+        )
+        self._keys = [key for key, _ in pairs]
+        self._values = [value for _, value in pairs]
+        return
+
+    def __len__(self):
+        return len(self._keys)
+
+    ##
+    #  Methods
+    ##
+
+    def prefix(self, text, limit=None):
+        """Return the values with a label starting with text, ordered by
+        label. Each value is only returned once.
+        """
+        if not isinstance(text, str):
+            return []
+
+        text = text.lower()
+        first = bisect_left(self._keys, text)
+        last = bisect_left(self._keys, text + MAX_CHAR, first)
+
+        return _unique(self._values[first:last], limit)
+
+    def suggest(self, text, max_distance=2, limit=10):
+        """Return the values with a label within max_distance edits of
+        text, ordered by the edit distance and then the label. Each
+        value is only returned once.
+
+        The sorted labels are walked as a trie. The edit distance rows
+        of the prefix shared with the previous label are reused, and
+        all labels with a prefix that is already too far from text are
+        skipped with a bisection.
+        """
+        if not isinstance(text, str):
+            return []
+
+        text = text.lower()
+        keys = self._keys
+        rows = [list(range(len(text) + 1))]
+        found = []
+        prev = ""
+        idx = 0
+        while idx < len(keys):
+            key = keys[idx]
+            common = min(_common_prefix(prev, key), len(rows) - 1)
+            del rows[common + 1:]
+            prev = key
+
+            pruned = False
+            for depth in range(common, len(key)):
+                row = _next_row(rows[depth], key[depth], text)
+                rows.append(row)
+                if min(row) > max_distance:
+                    idx = bisect_left(keys, key[:depth + 1] + MAX_CHAR, idx)
+                    pruned = True
+                    break
+
+            if not pruned:
+                distance = rows[len(key)][-1]
+                if distance <= max_distance:
+                    found.append((distance, idx))
+                idx += 1
+
+        found.sort()
+
+        return _unique([self._values[idx] for _, idx in found], limit)
+
+# END Class SearchIndex
+
+
+class TokenIndex():
+
+    __slots__ = ("_names", "_postings", "_separator")
+
+    def __init__(self, names=(), separator="_"):
+        """Build an inverted index from the tokens of each name to the
+        sorted list of ids of the names containing it. The names are
+        split into tokens on separator.
+        """
+        self._names = sorted(name for name in set(names) if isinstance(name, str))
+        self._postings = {}
+        self._separator = separator
+        for name_id, name in enumerate(self._names):
+            for token in set(name.lower().split(separator)):
+                self._postings.setdefault(token, []).append(name_id)
+        return
+
+    def __len__(self):
+        return len(self._names)
+
+    ##
+    #  Methods
+    ##
+
+    def query(self, terms, match="all"):
+        """Return the sorted list of names containing all, or any, of
+        the terms. The terms are a list of strings, or a single string of
+        space separated terms. A term of several tokens, like sea_water,
+        must match a run of consecutive tokens.
+        """
+        if match not in ("all", "any"):
+            raise ValueError(f"Unknown match '{match}', expected 'all' or 'any'")
+        if isinstance(terms, str):
+            terms = terms.split()
+
+        results = [self._query_term(term) for term in terms if isinstance(term, str)]
+        if not results:
+            return []
+        if match == "all":
+            ids = intersect(results)
+        else:
+            ids = sorted(set().union(*results))
+
+        return [self._names[name_id] for name_id in ids]
+
+    def count(self, token):
+        """Return the number of names containing a token."""
+        return len(self._postings.get(token.lower(), ()))
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _query_term(self, term):
+        """Return the sorted ids of the names matching a single term."""
+        sep = self._separator
+        tokens = [token for token in term.lower().split(sep) if token]
+        if not tokens:
+            return []
+
+        ids = intersect([self._postings.get(token, []) for token in tokens])
+        if len(tokens) > 1:
+            phrase = sep + sep.join(tokens) + sep
+            ids = [i for i in ids if phrase in sep + self._names[i].lower() + sep]
+
+        return ids
+
+# END Class TokenIndex
+
+
+def intersect(postings):
+    """Return the intersection of sorted posting lists. The lists are
+    intersected from the shortest up, and each id of the running result
+    is looked up in the next list with a bisection that starts where the
+    previous one ended.
+    """
+    if not postings:
+        return []
+
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    for posting in postings[1:]:
+        if not result:
+            break
+        found = []
+        lo = 0
+        n = len(posting)
+        for name_id in result:
+            lo = bisect_left(posting, name_id, lo)
+            if lo == n:
+                break
+            if posting[lo] == name_id:
+                found.append(name_id)
+        result = found
+
+    return list(result)
+
+
+##
+#  Internal Functions
+##
+
+def _next_row(row, char, text):
+    """Return the next row of the Levenshtein distance table when char
+    is appended to the label.
+    """
+    new = [row[0] + 1]
+    for j, t_char in enumerate(text, 1):
+        new.append(min(new[j - 1] + 1, row[j] + 1, row[j - 1] + (t_char != char)))
+    return new
+
+
+def _common_prefix(a, b):
+    """Return the length of the common prefix of two strings."""
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _unique(values, limit):
+    """Return the values without duplicates, in their original order,
+    and at most limit of them. Values are compared by equality, and
+    dictionaries by their items.
+    """
+    seen = set()
+    result = []
+    for value in values:
+        key = _value_key(value)
+        if key not in seen:
+            seen.add(key)
+            result.append(value)
+            if limit is not None and len(result) >= limit:
+                break
+    return result
+
+
+def _value_key(value):
+    """Return a hashable key of a value, which is equal for equal
+    values. Values that cannot be hashed are compared by identity.
+    """
+    if isinstance(value, dict):
+        value = tuple(sorted(value.items()))
+    try:
+        hash(value)
+    except TypeError:
+        return ("id", id(value))
+    return value
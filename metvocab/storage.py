@@ -0,0 +1,755 @@
+"""
+MetVocab : Cache Storage Backends
+=================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+import contextlib
+import urllib.parse
+
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from metvocab.codec import decode_entry, is_encoded
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SQLITE_FILE = "metvocab.sqlite"
+BUNDLE_MMAP_SIZE = 256*1024*1024
+
+# The umask assumed where the umask of the process cannot be read
+DEFAULT_UMASK = 0o022
+
+_umask = None
+
+
+class CacheStorage(ABC):
+    """The interface of a cache storage backend. Entries are keyed by
+    vocabulary id and uri, and hold the data, the time it was fetched,
+    and the response validators. If the storage has an EntryCodec, the
+    data is stored encoded, and the shared contexts are stored once.
+    Backends without codec support need not implement the context
+    methods.
+    """
+
+    name = None
+    codec = None
+
+    @property
+    @abstractmethod
+    def location(self):
+        """Return the path of the storage."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def fetched(self, voc_id, uri):
+        """Return the time an entry was fetched, or None if it does not
+        exist.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def load(self, voc_id, uri):
+        """Return the data of an entry, or None if it does not exist."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_validators(self, voc_id, uri):
+        """Return the response validators of an entry as a dictionary."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def store(self, voc_id, uri, data, validators, fetched=None):
+        """Store the data and validators of an entry, and set its fetch
+        time to fetched, or to now.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def touch(self, voc_id, uri):
+        """Set the fetch time of an existing entry to now."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def entries(self):
+        """Iterate over the vocabulary id, uri and fetch time of all
+        entries.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def expire(self, max_age):
+        """Remove all entries fetched more than max_age seconds ago, and
+        return the number of removed entries.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release any resources held by the storage."""
+        return
+
+    @contextlib.contextmanager
+    def lock(self, voc_id, uri, blocking=True):
+        """Hold an exclusive lock on an entry, shared between processes
+        through a lock file. Yields False if the lock is taken and
+        blocking is False, or if the lock file cannot be made, as in a
+        read-only cache, and the caller then runs unlocked. Without
+        fcntl, no locking is done.
+        """
+        if fcntl is None:
+            yield True
+            return
+
+        lock_fd = self._open_lock(self._lock_file(voc_id, uri), blocking)
+        if lock_fd is None:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            lock_fd.close()
+
+        return
+
+    @abstractmethod
+    def _lock_file(self, voc_id, uri):
+        """Return the path of the lock file of an entry."""
+        raise NotImplementedError
+
+    def _open_lock(self, lock_file, blocking):
+        """Open and lock a lock file, and return it, or None if the lock
+        is taken and blocking is False, or the file cannot be made. If
+        the file was removed by expire while waiting for the lock, the
+        new file is locked instead.
+        """
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        while True:
+            try:
+                os.makedirs(os.path.dirname(lock_file), exist_ok=True)
+                lock_fd = open(lock_file, mode="a")
+            except OSError as exc:
+                logger.debug("Could not open lock file %s: %s", lock_file, str(exc))
+                return None
+            try:
+                fcntl.flock(lock_fd, flags)
+                same = os.path.samestat(os.fstat(lock_fd.fileno()), os.stat(lock_file))
+            except FileNotFoundError:
+                same = False
+            except OSError:
+                lock_fd.close()
+                return None
+            if same:
+                return lock_fd
+            lock_fd.close()
+
+    def _remove_locks(self, lock_files):
+        """Remove the lock files that are not held by anyone, and return
+        the number of removed files.
+        """
+        if fcntl is None:
+            return 0
+        removed = 0
+        for lock_file in lock_files:
+            try:
+                with open(lock_file, mode="a") as lock_fd:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.unlink(lock_file)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def _load_context(self, ctx_hash):
+        """Return an encoded shared context, or None if it is missing."""
+        raise NotImplementedError
+
+    def _store_context(self, ctx_hash, blob):
+        """Store an encoded shared context."""
+        raise NotImplementedError
+
+    def _encode(self, data):
+        """Encode data with the codec of the storage, and store its
+        shared context.
+        """
+        blob, context = self.codec.encode(data)
+        if context is not None:
+            self._store_context(*context)
+        return blob
+
+    def _decode(self, blob):
+        """Decode an entry made by any codec."""
+        return decode_entry(blob, self._load_context)
+
+# END Class CacheStorage
+
+
+class FileStorage(CacheStorage):
+    """Stores each entry as a JSON file in a folder tree mirroring the
+    uri, with the validators in a meta file next to it. The vocabulary
+    id is not part of the key. With a codec, the entry files are encoded
+    and have the .mvc extension, and the shared contexts are stored in
+    the .contexts folder.
+    """
+
+    name = "files"
+
+    def __init__(self, cache_path, codec=None):
+        self._cache_path = cache_path
+        self._suffix = ".json" if codec is None else ".mvc"
+        self.codec = codec
+        return
+
+    @property
+    def location(self):
+        """Return the root folder of the storage."""
+        return self._cache_path
+
+    def fetched(self, voc_id, uri):
+        """Return the modification time of the entry file."""
+        try:
+            return os.path.getmtime(self._entry_path(uri)[1])
+        except OSError:
+            return None
+
+    def load(self, voc_id, uri):
+        """Read the entry file."""
+        try:
+            if self.codec is None:
+                with open(self._entry_path(uri)[1], mode="r", encoding="utf-8") as infile:
+                    return json.load(infile)
+            with open(self._entry_path(uri)[1], mode="rb") as infile:
+                return self._decode(infile.read())
+        except FileNotFoundError:
+            return None
+        except ValueError as exc:
+            logger.warning("Could not read the cache entry of %s: %s", uri, str(exc))
+            return None
+
+    def load_validators(self, voc_id, uri):
+        """Read the meta file of an existing entry."""
+        json_file = self._entry_path(uri)[1]
+        if not os.path.isfile(json_file):
+            return {}
+        try:
+            with open(json_file + ".meta", mode="r", encoding="utf-8") as infile:
+                return json.load(infile)
+        except (OSError, ValueError):
+            return {}
+
+    def store(self, voc_id, uri, data, validators, fetched=None):
+        """Write the entry file and its meta file, or remove the old meta
+        file if there are no validators.
+        """
+        json_path, json_file = self._entry_path(uri)
+        meta_file = json_file + ".meta"
+        os.makedirs(json_path, exist_ok=True)
+        if self.codec is None:
+            self._write_json(json_file, data)
+        else:
+            self._write_bytes(json_file, self._encode(data))
+        if validators:
+            self._write_json(meta_file, validators)
+        elif os.path.isfile(meta_file):
+            os.unlink(meta_file)
+        if fetched is not None:
+            os.utime(json_file, (fetched, fetched))
+        return
+
+    def touch(self, voc_id, uri):
+        """Update the modification time of the entry file."""
+        os.utime(self._entry_path(uri)[1])
+        return
+
+    def entries(self):
+        """Walk the folder tree. The vocabulary id is not stored, so it
+        is always None, and the uri scheme is assumed to be https.
+        """
+        for path, dirs, files in os.walk(self._cache_path):
+            dirs[:] = sorted(name for name in dirs if not name.startswith("."))
+            for name in sorted(files):
+                if not name.endswith(self._suffix):
+                    continue
+                json_file = os.path.join(path, name)
+                try:
+                    fetched = os.path.getmtime(json_file)
+                except OSError:
+                    continue
+                rel_path = os.path.relpath(json_file, self._cache_path)[:-len(self._suffix)]
+                yield None, "https://" + rel_path.replace(os.sep, "/"), fetched
+        return
+
+    def expire(self, max_age):
+        """Remove the entry files and meta files older than max_age, and
+        the lock files without an entry file that are not in use.
+        """
+        cutoff = time.time() - max_age
+        removed = 0
+        for _, uri, fetched in list(self.entries()):
+            if fetched >= cutoff:
+                continue
+            json_file = self._entry_path(uri)[1]
+            for a_file in (json_file, json_file + ".meta"):
+                if os.path.isfile(a_file):
+                    os.unlink(a_file)
+            removed += 1
+
+        orphans = []
+        for path, dirs, files in os.walk(self._cache_path):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            names = set(files)
+            for name in files:
+                if name.endswith(self._suffix + ".lock") and name[:-5] not in names:
+                    orphans.append(os.path.join(path, name))
+        self._remove_locks(orphans)
+
+        return removed
+
+    def _entry_path(self, uri):
+        """Return the cache folder and cache file path of a uri."""
+        path_list = uri_path(uri)
+        json_path = os.path.join(self._cache_path, *path_list[:-1])
+        json_file = os.path.join(json_path, path_list[-1]+self._suffix)
+        return json_path, json_file
+
+    def _lock_file(self, voc_id, uri):
+        """Return the path of the lock file next to the entry file."""
+        return self._entry_path(uri)[1] + ".lock"
+
+    def _load_context(self, ctx_hash):
+        """Read a shared context file."""
+        try:
+            with open(self._context_file(ctx_hash), mode="rb") as infile:
+                return infile.read()
+        except FileNotFoundError:
+            return None
+
+    def _store_context(self, ctx_hash, blob):
+        """Write a shared context file, unless it already exists."""
+        ctx_file = self._context_file(ctx_hash)
+        if not os.path.isfile(ctx_file):
+            os.makedirs(os.path.dirname(ctx_file), exist_ok=True)
+            self._write_bytes(ctx_file, blob)
+        return
+
+    def _context_file(self, ctx_hash):
+        """Return the path of a shared context file."""
+        return os.path.join(self._cache_path, ".contexts", ctx_hash + ".mvc")
+
+    def _write_json(self, json_file, data):
+        """Write data to a temporary file in the same folder, and then
+        move it in place, so that readers never see a partial file.
+        """
+        fd, tmp_file = make_temp_file(json_file)
+        try:
+            with os.fdopen(fd, mode="w", encoding="utf-8") as outfile:
+                json.dump(data, outfile)
+            os.replace(tmp_file, json_file)
+        except BaseException:
+            if os.path.isfile(tmp_file):
+                os.unlink(tmp_file)
+            raise
+        return
+
+    def _write_bytes(self, a_file, blob):
+        """Write bytes atomically, like _write_json."""
+        fd, tmp_file = make_temp_file(a_file)
+        try:
+            with os.fdopen(fd, mode="wb") as outfile:
+                outfile.write(blob)
+            os.replace(tmp_file, a_file)
+        except BaseException:
+            if os.path.isfile(tmp_file):
+                os.unlink(tmp_file)
+            raise
+        return
+
+# END Class FileStorage
+
+
+class SQLiteStorage(CacheStorage):
+    """Stores all entries in a single SQLite database. The database is
+    in WAL mode, so readers are not blocked by a writer. Each thread
+    uses its own connection. With a codec, the data column holds the
+    encoded entries, and the shared contexts are in their own table.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, db_file, codec=None):
+        self._db_file = db_file
+        self._local = threading.local()
+        self.codec = codec
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        self._create_schema(self._connect())
+        return
+
+    def _create_schema(self, conn):
+        """Create the tables and indexes, unless they exist."""
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "voc_id TEXT NOT NULL, "
+                "uri TEXT NOT NULL, "
+                "fetched REAL NOT NULL, "
+                "validators TEXT, "
+                "data TEXT NOT NULL, "
+                "PRIMARY KEY (voc_id, uri))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_fetched ON entries (fetched)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS contexts ("
+                "hash TEXT PRIMARY KEY, "
+                "data BLOB NOT NULL)"
+            )
+        return
+
+    @property
+    def location(self):
+        """Return the path of the database file."""
+        return self._db_file
+
+    def fetched(self, voc_id, uri):
+        """Return the fetch time column of an entry."""
+        uri_path(uri)
+        row = self._connect().execute(
+            "SELECT fetched FROM entries WHERE voc_id = ? AND uri = ?", (voc_id, uri)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def load(self, voc_id, uri):
+        """Return the data column of an entry, which may be plain JSON
+        or encoded by any codec.
+        """
+        row = self._connect().execute(
+            "SELECT data FROM entries WHERE voc_id = ? AND uri = ?", (voc_id, uri)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            if is_encoded(row[0]):
+                return self._decode(row[0])
+            return json.loads(row[0])
+        except ValueError as exc:
+            logger.warning("Could not read the cache entry of %s: %s", uri, str(exc))
+            return None
+
+    def load_validators(self, voc_id, uri):
+        """Return the validators column of an entry."""
+        row = self._connect().execute(
+            "SELECT validators FROM entries WHERE voc_id = ? AND uri = ?", (voc_id, uri)
+        ).fetchone()
+        if row is None or not row[0]:
+            return {}
+        return json.loads(row[0])
+
+    def store(self, voc_id, uri, data, validators, fetched=None):
+        """Insert or replace an entry."""
+        uri_path(uri)
+        value = json.dumps(data) if self.codec is None else self._encode(data)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (voc_id, uri, fetched, validators, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (voc_id, uri, time.time() if fetched is None else fetched,
+                 json.dumps(validators) if validators else None, value)
+            )
+        return
+
+    def touch(self, voc_id, uri):
+        """Update the fetch time column of an entry."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE entries SET fetched = ? WHERE voc_id = ? AND uri = ?",
+                (time.time(), voc_id, uri)
+            )
+        return
+
+    def entries(self):
+        """Query all entries ordered by vocabulary id and uri."""
+        cursor = self._connect().execute(
+            "SELECT voc_id, uri, fetched FROM entries ORDER BY voc_id, uri"
+        )
+        yield from cursor
+        return
+
+    def copy_from(self, db_file):
+        """Copy all entries and contexts from another database with the
+        same tables, replacing existing entries, in a single
+        transaction.
+        """
+        conn = self._connect()
+        conn.execute("ATTACH DATABASE ? AS source", (db_file,))
+        try:
+            with conn:
+                cursor = conn.execute(
+                    "INSERT OR REPLACE INTO entries (voc_id, uri, fetched, validators, data) "
+                    "SELECT voc_id, uri, fetched, validators, data FROM source.entries"
+                )
+                conn.execute(
+                    "INSERT OR IGNORE INTO contexts (hash, data) "
+                    "SELECT hash, data FROM source.contexts"
+                )
+        finally:
+            conn.execute("DETACH DATABASE source")
+        return cursor.rowcount
+
+    def expire(self, max_age):
+        """Delete all old entries in a single query, and remove the lock
+        files of missing entries that are not in use.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "DELETE FROM entries WHERE fetched < ?", (time.time() - max_age,)
+            )
+
+        lock_path = self._db_file + ".locks"
+        if os.path.isdir(lock_path):
+            keep = {self._lock_file(voc_id, uri) for voc_id, uri, _ in self.entries()}
+            lock_files = [os.path.join(lock_path, name) for name in os.listdir(lock_path)]
+            self._remove_locks(
+                lock_file for lock_file in lock_files
+                if lock_file.endswith(".lock") and lock_file not in keep
+            )
+
+        return cursor.rowcount
+
+    def close(self):
+        """Close the connection of the calling thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+            self._local.file_id = None
+        return
+
+    def _connect(self):
+        """Return the connection of the calling thread, and open it if
+        needed. The connection is reopened if the database file has been
+        removed or replaced since it was opened, as it would otherwise
+        still point to the old file.
+        """
+        file_id = _file_id(self._db_file)
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and file_id != self._local.file_id:
+            logger.debug("The database %s has been replaced, reconnecting", self._db_file)
+            conn.close()
+            conn = None
+        if conn is None:
+            if file_id is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self._db_file)), exist_ok=True)
+            conn = sqlite3.connect(self._db_file, timeout=30.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if file_id is None:
+                self._create_schema(conn)
+            self._local.conn = conn
+            self._local.file_id = _file_id(self._db_file)
+        return conn
+
+    def _load_context(self, ctx_hash):
+        """Query a shared context."""
+        row = self._connect().execute(
+            "SELECT data FROM contexts WHERE hash = ?", (ctx_hash,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def _store_context(self, ctx_hash, blob):
+        """Insert a shared context, unless it already exists."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO contexts (hash, data) VALUES (?, ?)", (ctx_hash, blob)
+            )
+        return
+
+    def _lock_file(self, voc_id, uri):
+        """Return the path of a lock file named by a hash of the key."""
+        key = hashlib.sha1(f"{voc_id}\n{uri}".encode("utf-8")).hexdigest()
+        return os.path.join(self._db_file + ".locks", key + ".lock")
+
+# END Class SQLiteStorage
+
+
+class BundleStorage(SQLiteStorage):
+    """Reads entries from a bundle file made by metvocab.bundle. The
+    file is opened read-only and immutable, so it can be on a read-only
+    filesystem, and is memory-mapped by SQLite.
+    """
+
+    name = "bundle"
+
+    def __init__(self, bundle_file, mmap_size=BUNDLE_MMAP_SIZE):
+        self._db_file = os.path.abspath(bundle_file)
+        self._mmap_size = int(mmap_size)
+        self._local = threading.local()
+        self.codec = None
+        if not os.path.isfile(self._db_file):
+            raise OSError(f"No bundle file found at {self._db_file}")
+        return
+
+    def store(self, voc_id, uri, data, validators, fetched=None):
+        raise OSError("The bundle is read-only")
+
+    def touch(self, voc_id, uri):
+        raise OSError("The bundle is read-only")
+
+    def expire(self, max_age):
+        raise OSError("The bundle is read-only")
+
+    @contextlib.contextmanager
+    def lock(self, voc_id, uri, blocking=True):
+        """The bundle never changes, so no locking is needed."""
+        yield True
+        return
+
+    def _connect(self):
+        """Return the read-only connection of the calling thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            db_uri = Path(self._db_file).as_uri() + "?mode=ro&immutable=1"
+            conn = sqlite3.connect(db_uri, uri=True)
+            conn.execute(f"PRAGMA mmap_size={self._mmap_size}")
+            self._local.conn = conn
+        return conn
+
+# END Class BundleStorage
+
+
+BACKENDS = {
+    FileStorage.name: FileStorage,
+    SQLiteStorage.name: SQLiteStorage,
+}
+
+_storages = {}
+_storages_lock = threading.Lock()
+_bundles = {}
+
+
+def uri_path(uri):
+    """Split a uri into its host name and path elements. Raises a
+    ValueError if the uri has no path.
+    """
+    urlbits = urllib.parse.urlparse(uri)
+    path_list = urlbits.path.split("/")
+    path_list.insert(0, urlbits.netloc.split(":")[0])
+
+    if path_list[-1] == "":
+        raise ValueError("The provided uri is missing a path: '%s'", uri)
+
+    return path_list
+
+
+def make_temp_file(path):
+    """Create a temporary file in the folder of path, to be moved in
+    place of it, and return its descriptor and path. The file gets the
+    permissions of a file made with open(), as mkstemp makes it only
+    readable by the owner, and the cache may be shared.
+    """
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        os.chmod(tmp_file, 0o666 & ~_get_umask())
+    except OSError:
+        os.close(fd)
+        os.unlink(tmp_file)
+        raise
+    return fd, tmp_file
+
+
+def open_storage(backend, cache_path, codec=None):
+    """Return the shared storage of a backend in a cache folder, using
+    an optional EntryCodec. A new storage is opened if the old one has
+    been removed.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown cache backend '{backend}'")
+
+    key = (backend, cache_path, None if codec is None else codec.spec)
+    with _storages_lock:
+        storage = _storages.get(key, None)
+        if storage is None or not os.path.exists(storage.location):
+            if backend == SQLiteStorage.name:
+                storage = SQLiteStorage(os.path.join(cache_path, SQLITE_FILE), codec=codec)
+            else:
+                storage = FileStorage(cache_path, codec=codec)
+            _storages[key] = storage
+            logger.debug("Using the %s cache backend in %s", backend, cache_path)
+
+    return storage
+
+
+def open_bundle(bundle_file):
+    """Return the shared read-only storage of a bundle file. A new
+    storage is opened if the file has been replaced.
+    """
+    bundle_file = os.path.abspath(bundle_file)
+    stat = os.stat(bundle_file)
+    key = (bundle_file, stat.st_mtime_ns, stat.st_size)
+    with _storages_lock:
+        bundle = _bundles.get(key, None)
+        if bundle is None:
+            bundle = BundleStorage(bundle_file)
+            _bundles[key] = bundle
+            logger.debug("Reading from the bundle %s", bundle_file)
+    return bundle
+
+
+##
+#  Internal Functions
+##
+
+def _get_umask():
+    """Return the umask of the process, read once. It is read from
+    /proc where available, as os.umask can only read it by changing it
+    for all threads, and otherwise DEFAULT_UMASK is assumed.
+    """
+    global _umask
+    if _umask is None:
+        umask = DEFAULT_UMASK
+        try:
+            with open("/proc/self/status", mode="r", encoding="utf-8") as infile:
+                for line in infile:
+                    if line.startswith("Umask:"):
+                        umask = int(line.split()[1], 8)
+                        break
+        except (OSError, ValueError, IndexError):
+            pass
+        _umask = umask
+    return _umask
+
+
+def _file_id(path):
+    """Return the device and inode of a file, or None if it does not
+    exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
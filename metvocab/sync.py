@@ -0,0 +1,181 @@
+"""
+MetVocab : Cache Synchronisation
+================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import logging
+
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from metvocab.cache import DataCache
+from metvocab.mmdgroup import MMDGroup
+
+logger = logging.getLogger(__name__)
+
+VOCAB_ROOT_URL = "https://vocab.met.no"
+
+
+class SyncReport():
+
+    def __init__(self):
+        self.downloaded = 0
+        self.cached = 0
+        self.failed = []
+        self.elapsed = 0.0
+        return
+
+    def __str__(self):
+        return (
+            f"Synced {self.total} entries ({self.downloaded} downloaded, {self.cached} cached, "
+            f"{len(self.failed)} failed) in {self.elapsed:.2f} s, {self.rate:.1f} entries/s"
+        )
+
+    ##
+    #  Properties
+    ##
+
+    @property
+    def total(self):
+        """Return the number of entries handled."""
+        return self.downloaded + self.cached + len(self.failed)
+
+    @property
+    def rate(self):
+        """Return the number of entries handled per second."""
+        return self.total/self.elapsed if self.elapsed > 0.0 else 0.0
+
+    ##
+    #  Methods
+    ##
+
+    def add(self, uri, state):
+        """Count an entry as downloaded, cached or failed."""
+        if state == "downloaded":
+            self.downloaded += 1
+        elif state == "cached":
+            self.cached += 1
+        else:
+            self.failed.append(uri)
+        return
+
+    def as_dict(self):
+        """Return the report as a dictionary."""
+        return {
+            "total": self.total,
+            "downloaded": self.downloaded,
+            "cached": self.cached,
+            "failed": list(self.failed),
+            "elapsed": round(self.elapsed, 3),
+            "rate": round(self.rate, 1),
+        }
+
+# END Class SyncReport
+
+
+def sync(voc_id, groups=None, all_groups=False, uris=None, workers=None, cache=None):
+    """Download vocabulary entries and groups with all their members
+    into the cache, using a pool of worker threads. Groups are given by
+    name or uri, and all groups of the vocabulary are added if
+    all_groups is True. Stale entries are always refreshed before the
+    call returns. Returns a SyncReport.
+    """
+    if cache is None:
+        cache = DataCache()
+        cache._revalidate = False
+    if workers is None:
+        workers = os.environ.get("METVOCAB_FETCH_WORKERS", "8")
+    workers = max(int(workers), 1)
+
+    report = SyncReport()
+    start = time.monotonic()
+
+    group_uris = [group_uri(voc_id, group) for group in (groups or [])]
+    if all_groups:
+        found = cache.get_groups(voc_id)
+        if found is None:
+            logger.error("Could not list the groups of vocabulary '%s'", voc_id)
+            report.failed.append(voc_id)
+        else:
+            group_uris.extend(found)
+
+    group_uris = _unique(group_uris)
+    entry_uris = _unique(uris or [], exclude=group_uris)
+
+    fetch = partial(_fetch_entry, cache, voc_id)
+    parser = MMDGroup(voc_id, None)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        members = []
+        for uri, (state, data) in zip(group_uris, executor.map(fetch, group_uris)):
+            report.add(uri, state)
+            members.extend(parser._get_members(data))
+
+        members = _unique(members, exclude=group_uris)
+        entry_uris = entry_uris + [uri for uri in members if uri not in entry_uris]
+        for uri, (state, _) in zip(entry_uris, executor.map(fetch, entry_uris)):
+            report.add(uri, state)
+
+    report.elapsed = time.monotonic() - start
+    logger.info(str(report))
+
+    return report
+
+
+def group_uri(voc_id, group):
+    """Return the uri of a group given by name or uri."""
+    if "://" in group:
+        return group
+    return f"{VOCAB_ROOT_URL}/{voc_id}/{group}"
+
+
+##
+#  Internal Functions
+##
+
+def _fetch_entry(cache, voc_id, uri):
+    """Fetch an entry through the cache, and return whether it was
+    downloaded, already cached, or failed, together with its data.
+    """
+    before = cache.storage.fetched(voc_id, uri)
+    fresh = before is not None and not cache._check_timestamp(before, cache._max_age)
+
+    data = cache.get_vocab(voc_id, uri)
+    if not data:
+        return "failed", {}
+    if fresh:
+        return "cached", data
+
+    after = cache.storage.fetched(voc_id, uri)
+    if after is None or (before is not None and after <= before):
+        return "failed", data
+
+    return "downloaded", data
+
+
+def _unique(uris, exclude=()):
+    """Return the uris without duplicates or excluded uris, in their
+    original order.
+    """
+    seen = set(exclude)
+    result = []
+    for uri in uris:
+        if uri not in seen:
+            seen.add(uri)
+            result.append(uri)
+    return result
@@ -0,0 +1,586 @@
+"""
+MetVocab : HTTP Transport
+=========================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import io
+import os
+import time
+import base64
+import random
+import logging
+import threading
+import http.client
+import email.utils
+import urllib.error
+import urllib.parse
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+RETRY_CODES = (429, 500, 502, 503, 504)
+
+
+class PoolResponse():
+
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.code = status
+        self.reason = reason
+        self.headers = headers
+        self._body = body
+        return
+
+    def read(self):
+        """Return the response body."""
+        return self._body
+
+    def getheader(self, name, default=None):
+        """Return a response header value."""
+        return self.headers.get(name, default)
+
+# END Class PoolResponse
+
+
+class HTTPPool():
+
+    def __init__(self, size=None, timeout=None, connect_timeout=None):
+
+        if size is None:
+            size = os.environ.get("METVOCAB_POOL_SIZE", "8")
+        if timeout is None:
+            timeout = os.environ.get("METVOCAB_TIMEOUT", "30")
+        if connect_timeout is None:
+            connect_timeout = os.environ.get("METVOCAB_CONNECT_TIMEOUT", "10")
+
+        self._size = max(int(size), 1)
+        self._timeout = float(timeout)
+        self._connect_timeout = float(connect_timeout)
+
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._opened = 0
+        self._reused = 0
+
+        return
+
+    ##
+    #  Properties
+    ##
+
+    @property
+    def size(self):
+        """Return the maximum number of idle connections per host."""
+        return self._size
+
+    @property
+    def timeout(self):
+        """Return the default read timeout in seconds."""
+        return self._timeout
+
+    @property
+    def connect_timeout(self):
+        """Return the connect timeout in seconds."""
+        return self._connect_timeout
+
+    @property
+    def stats(self):
+        """Return the number of connections opened, the number of
+        requests sent on a reused connection, and the number of idle
+        connections currently in the pool.
+        """
+        self._check_fork()
+        with self._lock:
+            return {
+                "opened": self._opened,
+                "reused": self._reused,
+                "idle": sum(len(conns) for conns in self._idle.values()),
+            }
+
+    ##
+    #  Methods
+    ##
+
+    def urlopen(self, request, timeout=None):
+        """Send a urllib.request.Request over a pooled keep-alive
+        connection. Like urllib.request.urlopen, an HTTPError is raised
+        for error status codes and a URLError for connection errors, and
+        the proxies set in the environment are used. The timeout applies
+        to reading the response.
+        """
+        if timeout is None:
+            timeout = self._timeout
+
+        url = request.full_url
+        method = request.get_method()
+        headers = dict(request.header_items())
+
+        for _ in range(MAX_REDIRECTS + 1):
+            status, reason, resp_headers, body = self._send(method, url, headers, timeout)
+            location = resp_headers.get("location", None)
+            if status in REDIRECT_CODES and location:
+                url = urllib.parse.urljoin(url, location)
+                logger.debug("Following redirect to: %s", url)
+                continue
+            break
+
+        if status >= 400:
+            raise urllib.error.HTTPError(url, status, reason, resp_headers, io.BytesIO(body))
+
+        return PoolResponse(url, status, reason, resp_headers, body)
+
+    def clear(self):
+        """Close all idle connections."""
+        self._check_fork()
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle = {}
+        return
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _send(self, method, url, headers, timeout):
+        """Send a single request and read the full response. A reused
+        connection that was closed by the server is retried once on a
+        new connection.
+        """
+        urlbits = urllib.parse.urlsplit(url)
+        proxy = self._get_proxy(urlbits)
+        key = (urlbits.scheme, urlbits.hostname, urlbits.port, proxy)
+        path = urlbits.path or "/"
+        if urlbits.query:
+            path += "?" + urlbits.query
+        if proxy is not None and urlbits.scheme == "http":
+            # A forwarding proxy takes the full url, and https is tunnelled
+            path = f"http://{urlbits.netloc}{path}"
+            headers = dict(headers, **_proxy_headers(proxy))
+
+        for attempt in range(2):
+            conn, reused = self._acquire(key, timeout, fresh=attempt > 0)
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                    conn.sock.settimeout(timeout)
+                conn.request(method, path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+            except (http.client.HTTPException, OSError) as err:
+                conn.close()
+                stale = isinstance(err, (ConnectionError, http.client.BadStatusLine))
+                if reused and stale:
+                    logger.debug("Pooled connection was closed, reconnecting")
+                    continue
+                raise urllib.error.URLError(err)
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+
+            return resp.status, resp.reason, resp.msg, body
+
+        raise urllib.error.URLError("Could not send request to %s" % url)
+
+    def _acquire(self, key, timeout, fresh=False):
+        """Return an idle connection for the host, or open a new one."""
+        scheme, host, port, proxy = key
+        self._check_fork()
+        with self._lock:
+            conns = self._idle.get(key, [])
+            if conns and not fresh:
+                self._reused += 1
+                conn = conns.pop()
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+            self._opened += 1
+
+        if scheme not in ("http", "https"):
+            raise urllib.error.URLError("Unknown url type: %s" % scheme)
+
+        if proxy is not None:
+            proxybits = urllib.parse.urlsplit(proxy)
+            conn_host = proxybits.hostname
+            conn_port = proxybits.port or (443 if proxybits.scheme == "https" else 80)
+            secure = scheme == "https" or proxybits.scheme == "https"
+        else:
+            conn_host, conn_port = host, port
+            secure = scheme == "https"
+
+        if secure:
+            conn = http.client.HTTPSConnection(
+                conn_host, conn_port, timeout=self._connect_timeout
+            )
+        else:
+            conn = http.client.HTTPConnection(conn_host, conn_port, timeout=self._connect_timeout)
+        if proxy is not None and scheme == "https":
+            conn.set_tunnel(host, port, headers=_proxy_headers(proxy))
+
+        return conn, False
+
+    def _check_fork(self):
+        """Forget the idle connections and the lock inherited from the
+        parent process after a fork. The sockets are shared with the
+        parent, so they must not be used by both processes.
+        """
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._lock = threading.Lock()
+            self._idle = {}
+            logger.debug("Process was forked, dropping the pooled connections")
+        return
+
+    def _get_proxy(self, urlbits):
+        """Return the proxy url for a request, from the environment as
+        urllib does, or None if there is no proxy or it is bypassed.
+        """
+        proxy = urllib.request.getproxies().get(urlbits.scheme, None)
+        if not proxy or urllib.request.proxy_bypass(urlbits.netloc):
+            return None
+        if "://" not in proxy:
+            proxy = "http://" + proxy
+        return proxy
+
+    def _release(self, key, conn):
+        """Return a connection to the pool, or close it if the pool for
+        the host is full.
+        """
+        self._check_fork()
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self._size:
+                conns.append(conn)
+                return
+        conn.close()
+        return
+
+# END Class HTTPPool
+
+
+class CircuitBreaker():
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold=None, reset_timeout=None):
+
+        if threshold is None:
+            threshold = os.environ.get("METVOCAB_BREAKER_THRESHOLD", "5")
+        if reset_timeout is None:
+            reset_timeout = os.environ.get("METVOCAB_BREAKER_RESET", "60")
+
+        self._threshold = max(int(threshold), 1)
+        self._reset_timeout = float(reset_timeout)
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+        return
+
+    ##
+    #  Properties
+    ##
+
+    @property
+    def state(self):
+        """Return the current state of the circuit."""
+        with self._lock:
+            return self._current_state()
+
+    @property
+    def status(self):
+        """Return the state of the circuit, the number of consecutive
+        failures, and the time when a new request will be allowed.
+        """
+        with self._lock:
+            state = self._current_state()
+            retry_at = None
+            if self._opened_at is not None and state == self.OPEN:
+                retry_at = self._opened_at + self._reset_timeout
+            return {
+                "state": state,
+                "failures": self._failures,
+                "threshold": self._threshold,
+                "retry_at": retry_at,
+            }
+
+    ##
+    #  Methods
+    ##
+
+    def allow(self):
+        """Check if a request may be sent. When the circuit is open, no
+        requests are allowed until the reset timeout has passed, after
+        which a single trial request is let through.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        """Close the circuit after a successful request."""
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("API is reachable again, closing circuit")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+        return
+
+    def record_failure(self):
+        """Count a failed request, and open the circuit when the number
+        of consecutive failures reaches the threshold.
+        """
+        with self._lock:
+            self._failures += 1
+            self._trial = False
+            if self._state != self.CLOSED or self._failures >= self._threshold:
+                if self._state == self.CLOSED:
+                    logger.warning(
+                        "API failed %d times in a row, opening circuit for %.0f seconds",
+                        self._failures, self._reset_timeout
+                    )
+                self._state = self.OPEN
+                self._opened_at = time.time()
+        return
+
+    def reset(self):
+        """Reset the circuit to closed."""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+        return
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _current_state(self):
+        """Return the state, moving from open to half-open when the
+        reset timeout has passed. Must be called with the lock held.
+        """
+        if self._state == self.OPEN and time.time() - self._opened_at >= self._reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial = False
+        return self._state
+
+# END Class CircuitBreaker
+
+
+class RetryPolicy():
+
+    def __init__(self, attempts=None, backoff=None, max_backoff=None, deadline=None):
+
+        if attempts is None:
+            attempts = os.environ.get("METVOCAB_RETRIES", "3")
+        if backoff is None:
+            backoff = os.environ.get("METVOCAB_RETRY_BACKOFF", "0.5")
+        if max_backoff is None:
+            max_backoff = os.environ.get("METVOCAB_RETRY_MAXBACKOFF", "30")
+        if deadline is None:
+            deadline = os.environ.get("METVOCAB_RETRY_DEADLINE", "60")
+
+        self._attempts = max(int(attempts), 1)
+        self._backoff = max(float(backoff), 0.0)
+        self._max_backoff = max(float(max_backoff), 0.0)
+        self._deadline = max(float(deadline), 0.0)
+
+        self._lock = threading.Lock()
+        self._not_before = 0.0
+
+        return
+
+    ##
+    #  Properties
+    ##
+
+    @property
+    def attempts(self):
+        """Return the maximum number of attempts per request."""
+        return self._attempts
+
+    @property
+    def deadline(self):
+        """Return the maximum total time in seconds spent on a request,
+        including the waits between attempts.
+        """
+        return self._deadline
+
+    ##
+    #  Methods
+    ##
+
+    def next_delay(self, attempt, err, start):
+        """Return the number of seconds to wait before the next attempt
+        after a failed attempt, or None if the request should not be
+        retried. The attempt counter starts at 1, and start is the
+        time.monotonic() value of the first attempt.
+        """
+        if attempt >= self._attempts or not self.is_retryable(err):
+            return None
+
+        delay = random.uniform(0.0, min(self._max_backoff, self._backoff * 2**(attempt - 1)))
+        retry_after = self._retry_after(err)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+
+        if time.monotonic() - start + delay > self._deadline:
+            return None
+
+        return delay
+
+    def defer(self, delay):
+        """Hold back all requests using this policy for delay seconds."""
+        with self._lock:
+            self._not_before = max(self._not_before, time.monotonic() + delay)
+        return
+
+    def wait(self, start):
+        """Wait until requests are allowed again. Returns False if that
+        is beyond the deadline of a request started at start.
+        """
+        with self._lock:
+            delay = self._not_before - time.monotonic()
+        if delay <= 0.0:
+            return True
+        if time.monotonic() - start + delay > self._deadline:
+            return False
+        time.sleep(delay)
+        return True
+
+    def is_retryable(self, err):
+        """Check if an error is worth retrying. Connection errors and
+        rate limit or server errors are.
+        """
+        if isinstance(err, urllib.error.HTTPError):
+            return err.code in RETRY_CODES
+        return isinstance(err, urllib.error.URLError)
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _retry_after(self, err):
+        """Return the number of seconds in a Retry-After header."""
+        headers = getattr(err, "headers", None)
+        if headers is None:
+            return None
+
+        value = headers.get("Retry-After", None) or headers.get("retry-after", None)
+        if value is None:
+            return None
+
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when is None:
+            return None
+
+        return max(when.timestamp() - time.time(), 0.0)
+
+# END Class RetryPolicy
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_breaker = CircuitBreaker()
+_retry_policy = RetryPolicy()
+
+
+def get_pool():
+    """Return the process-wide transport, creating the default
+    HTTPPool on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HTTPPool()
+        return _pool
+
+
+def set_pool(pool):
+    """Replace the process-wide transport. Any object with a urlopen
+    method taking a urllib.request.Request and a timeout can be used.
+    Passing None resets to the default HTTPPool on next use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool is not pool and hasattr(_pool, "clear"):
+            _pool.clear()
+        _pool = pool
+    return
+
+
+def get_breaker():
+    """Return the process-wide circuit breaker for API calls."""
+    return _breaker
+
+
+def get_retry_policy():
+    """Return the process-wide retry policy for API calls."""
+    return _retry_policy
+
+
+def set_retry_policy(policy):
+    """Replace the process-wide retry policy."""
+    global _retry_policy
+    _retry_policy = policy
+    return
+
+
+##
+#  Internal Functions
+##
+
+def _proxy_headers(proxy):
+    """Return the basic authentication header for the credentials in a
+    proxy url, if any.
+    """
+    proxybits = urllib.parse.urlsplit(proxy)
+    if proxybits.username is None:
+        return {}
+    credentials = "%s:%s" % (
+        urllib.parse.unquote(proxybits.username), urllib.parse.unquote(proxybits.password or "")
+    )
+    token = base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+    return {"Proxy-Authorization": f"Basic {token}"}
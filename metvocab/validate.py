@@ -0,0 +1,308 @@
+"""
+MetVocab : Bulk Attribute Validation
+====================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import re
+import json
+import logging
+import multiprocessing
+
+from functools import lru_cache
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from metvocab.registry import get_cfstd, get_vocab
+
+logger = logging.getLogger(__name__)
+
+# Global attributes checked against MMD vocabularies by default
+MMD_FIELDS = {
+    "access_constraint": "https://vocab.met.no/mmd/Access_Constraint",
+    "activity_type": "https://vocab.met.no/mmd/Activity_Type",
+    "iso_topic_category": "https://vocab.met.no/mmd/ISO_Topic_Category",
+    "operational_status": "https://vocab.met.no/mmd/Operational_Status",
+}
+
+FILE_SUFFIXES = (".cdl", ".json")
+
+CDL_ATTRIBUTE = re.compile(
+    r'^[ \t]*(?P<var>[^\s:"]*):(?P<name>[\w.\-+@]+)[ \t]*=[ \t]*'
+    r'(?P<value>(?:"(?:[^"\\]|\\.)*"[\s,]*)+|[^;"]*?)[ \t]*;',
+    re.MULTILINE
+)
+CDL_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"')
+CDL_ESCAPE = re.compile(r"\\(.)")
+CDL_ESCAPES = {"n": "\n", "t": "\t"}
+
+
+class FileResult():
+
+    def __init__(self, path):
+        self.path = path
+        self.checked = 0
+        self.errors = []
+        self.warnings = []
+        return
+
+    def __str__(self):
+        lines = [f"{self.path}: {'OK' if self.ok else 'INVALID'}"]
+        lines.extend(f"  error: {msg}" for msg in self.errors)
+        lines.extend(f"  warning: {msg}" for msg in self.warnings)
+        return "\n".join(lines)
+
+    ##
+    #  Properties
+    ##
+
+    @property
+    def ok(self):
+        """Return True if no errors were found."""
+        return not self.errors
+
+    ##
+    #  Methods
+    ##
+
+    def as_dict(self):
+        """Return the result as a dictionary."""
+        return {
+            "path": self.path,
+            "ok": self.ok,
+            "checked": self.checked,
+            "errors": list(self.errors),
+            "warnings": list(self.warnings),
+        }
+
+# END Class FileResult
+
+
+def validate_files(paths, workers=None, mmd_fields=None, chunksize=16):
+    """Validate an iterable of CDL or JSON attribute files, and yield a
+    FileResult for each of them in the same order. The paths are read
+    lazily and sent to a pool of worker processes in chunks, and only a
+    few chunks per worker are in flight at a time. The vocabularies are
+    loaded once in each worker, and the CF Standard Names from the
+    snapshot in the cache folder. The workers are spawned rather than
+    forked, so they do not share the sockets and locks of this process.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(int(workers), 1)
+    if mmd_fields is None:
+        mmd_fields = MMD_FIELDS
+
+    # Build the CF snapshot and fill the cache once, before the workers
+    _init_worker(mmd_fields)
+
+    chunks = _chunks(paths, max(int(chunksize), 1))
+    if workers == 1:
+        for chunk in chunks:
+            yield from _validate_chunk(chunk, mmd_fields)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker, initargs=(mmd_fields,)
+    ) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_validate_chunk, chunk, mmd_fields))
+            if len(pending) >= 2*workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+    return
+
+
+def validate_file(path, mmd_fields=None):
+    """Validate a single CDL or JSON attribute file, and return a
+    FileResult. Files ending in .json are read as JSON attribute dumps,
+    and all other files as CDL text.
+    """
+    result = FileResult(path)
+    try:
+        with open(path, mode="r", encoding="utf-8") as infile:
+            text = infile.read()
+        if path.lower().endswith(".json"):
+            global_attrs, variables = parse_json(json.loads(text))
+        else:
+            global_attrs, variables = parse_cdl(text)
+    except (OSError, UnicodeDecodeError, ValueError) as exc:
+        result.errors.append(f"could not read the file: {exc}")
+        return result
+
+    check_attributes(
+        global_attrs, variables, result, MMD_FIELDS if mmd_fields is None else mmd_fields
+    )
+
+    return result
+
+
+def check_attributes(global_attrs, variables, result, mmd_fields):
+    """Check the standard_name attribute of each variable, and the
+    global attributes in mmd_fields, and add the errors and warnings to
+    result.
+    """
+    cf_std = get_cfstd()
+    for var_name, attrs in variables.items():
+        value = attrs.get("standard_name", None)
+        if value is None:
+            continue
+        result.checked += 1
+        if not isinstance(value, str):
+            result.errors.append(f"{var_name}: standard_name is not a string")
+            continue
+        # The name may be followed by a standard name modifier
+        name = value.split()[0] if value.strip() else value
+        if cf_std.check_standard_name(name):
+            continue
+        current = cf_std.resolve_standard_name(name)
+        if current is not None:
+            result.warnings.append(
+                f"{var_name}: standard_name '{name}' is an alias of '{current}'"
+            )
+            continue
+        message = f"{var_name}: invalid standard_name '{name}'"
+        suggestion = _suggest_standard_name(name)
+        if suggestion is not None:
+            message += f", did you mean '{suggestion}'?"
+        result.errors.append(message)
+
+    for attr, uri in mmd_fields.items():
+        value = global_attrs.get(attr, None)
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            result.errors.append(f"{attr}: the value is not a string")
+            result.checked += 1
+            continue
+        vocab = get_vocab("mmd", uri)
+        if not vocab.is_initialised:
+            result.warnings.append(f"{attr}: the vocabulary {uri} could not be loaded")
+            continue
+        values = [v.strip() for v in value.split(",") if v.strip()]
+        for invalid in vocab.find_invalid(values):
+            result.errors.append(f"{attr}: invalid value '{invalid}'")
+        result.checked += 1
+
+    return result
+
+
+def parse_cdl(text):
+    """Parse the attributes of a CDL text, as written by ncdump -h, and
+    return the global attributes and a dictionary of the attributes of
+    each variable. Strings split over several lines are joined, and
+    other values are kept as they are written.
+    """
+    global_attrs = {}
+    variables = {}
+    for match in CDL_ATTRIBUTE.finditer(text):
+        value = match.group("value")
+        if value.startswith('"'):
+            value = "".join(
+                CDL_ESCAPE.sub(lambda m: CDL_ESCAPES.get(m.group(1), m.group(1)), part)
+                for part in CDL_STRING.findall(value)
+            )
+        var_name = match.group("var")
+        attrs = variables.setdefault(var_name, {}) if var_name else global_attrs
+        attrs[match.group("name")] = value
+
+    return global_attrs, variables
+
+
+def parse_json(data):
+    """Parse a JSON attribute dump, and return the global attributes
+    and a dictionary of the attributes of each variable. The dump has
+    the global attributes under "attributes", and each variable under
+    "variables", either as a dictionary of attributes or with them
+    under "attributes".
+    """
+    if not isinstance(data, dict):
+        raise ValueError("The attribute dump is not a JSON object")
+
+    global_attrs = data.get("attributes", {})
+    if not isinstance(global_attrs, dict):
+        raise ValueError("The global attributes are not a JSON object")
+    var_list = data.get("variables", {})
+    if not isinstance(var_list, dict):
+        raise ValueError("The variables are not a JSON object")
+
+    variables = {}
+    for var_name, var_data in var_list.items():
+        if isinstance(var_data, dict):
+            attrs = var_data.get("attributes", var_data)
+            variables[var_name] = attrs if isinstance(attrs, dict) else {}
+
+    return global_attrs, variables
+
+
+def find_files(paths):
+    """Yield the file paths, and the .cdl and .json files found in any
+    directories, recursively and in sorted order.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(FILE_SUFFIXES):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+    return
+
+
+##
+#  Internal Functions
+##
+
+def _init_worker(mmd_fields):
+    """Load the shared vocabulary instances of the process."""
+    get_cfstd()
+    for uri in mmd_fields.values():
+        get_vocab("mmd", uri)
+    return
+
+
+@lru_cache(maxsize=4096)
+def _suggest_standard_name(name):
+    """Return the closest standard name to an invalid name, or None.
+    The same invalid names tend to repeat across many files.
+    """
+    suggestions = get_cfstd().suggest_standard_name(name, limit=1)
+    return suggestions[0] if suggestions else None
+
+
+def _validate_chunk(paths, mmd_fields):
+    """Validate a list of files, and return the list of results."""
+    return [validate_file(path, mmd_fields) for path in paths]
+
+
+def _chunks(paths, size):
+    """Yield lists of up to size paths from an iterable."""
+    chunk = []
+    for path in paths:
+        chunk.append(path)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+    return
@@ -26,6 +26,32 @@ import pytest
 sys.path.insert(1, os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
 
 
+##
+#  State Fixtures
+##
+
+@pytest.fixture(scope="function", autouse=True)
+def cleanState(monkeypatch):
+    """Reset the process-wide caches, registry and circuit breaker
+    before and after each test, and do not retry failed requests.
+    """
+    import metvocab.transport
+    from metvocab.cache import clear_memory_cache, clear_negative_cache
+    from metvocab.registry import _registry
+    from metvocab.transport import RetryPolicy, get_breaker
+
+    def reset():
+        clear_memory_cache()
+        clear_negative_cache()
+        get_breaker().reset()
+        _registry.clear()
+
+    reset()
+    monkeypatch.setattr(metvocab.transport, "_retry_policy", RetryPolicy(attempts=1))
+    yield
+    reset()
+
+
 ##
 #  Directory Fixtures
 ##
@@ -0,0 +1,89 @@
+"""
+MetVocab : Batch Lookup Tests
+=============================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import pytest
+
+from metvocab import batch
+
+VALID = {"Open", "Closed", "Restricted"}
+
+
+@pytest.mark.core
+def testCoreBatch_Lists():
+    """Test the batch functions on plain Python iterables."""
+    values = ["Open", "Nope", "Closed", "Open", 42, None]
+
+    assert batch.check_many(values, VALID) == [True, False, True, True, False, False]
+    assert batch.filter_valid(values, VALID) == ["Open", "Closed", "Open"]
+    assert batch.find_invalid(values, VALID) == ["Nope", 42, None]
+
+    # All valid fast path
+    values = ["Open", "Closed", "Open"]
+    assert batch.check_many(values, VALID) == [True, True, True]
+    assert batch.filter_valid(values, VALID) == values
+    assert batch.filter_valid(values, VALID) is not values
+    assert batch.find_invalid(values, VALID) == []
+
+    # Generators and tuples
+    assert batch.check_many((v for v in ["Open", "x"]), VALID) == [True, False]
+    assert batch.filter_valid(("Open", "x"), VALID) == ["Open"]
+    assert batch.find_invalid(iter(["Open", "x"]), VALID) == ["x"]
+
+    # Unhashable values are invalid
+    values = ["Open", ["Open"], {"a": 1}]
+    assert batch.check_many(values, VALID) == [True, False, False]
+    assert batch.filter_valid(values, VALID) == ["Open"]
+    assert batch.find_invalid(values, VALID) == [["Open"], {"a": 1}]
+
+    # Empty
+    assert batch.check_many([], VALID) == []
+    assert batch.filter_valid([], VALID) == []
+    assert batch.find_invalid([], VALID) == []
+
+# END Test testCoreBatch_Lists
+
+
+@pytest.mark.core
+def testCoreBatch_NumPy():
+    """Test the batch functions on NumPy arrays."""
+    np = pytest.importorskip("numpy")
+
+    values = np.array(["Open", "Nope", "Closed", "Open"])
+    mask = batch.check_many(values, VALID)
+    assert isinstance(mask, np.ndarray)
+    assert mask.dtype == bool
+    assert mask.tolist() == [True, False, True, True]
+    assert batch.filter_valid(values, VALID).tolist() == ["Open", "Closed", "Open"]
+    assert batch.find_invalid(values, VALID).tolist() == ["Nope"]
+
+    # Shape is kept
+    values = np.array([["Open", "Nope"], ["Closed", "Open"]])
+    assert batch.check_many(values, VALID).tolist() == [[True, False], [True, True]]
+
+    # All valid
+    values = np.array(["Open", "Closed"])
+    assert batch.check_many(values, VALID).tolist() == [True, True]
+    assert batch.find_invalid(values, VALID).tolist() == []
+
+    # Object arrays with unhashable values
+    values = np.empty(3, dtype=object)
+    values[:] = ["Open", ["Open"], None]
+    assert batch.check_many(values, VALID).tolist() == [True, False, False]
+
+# END Test testCoreBatch_NumPy
@@ -0,0 +1,95 @@
+"""
+MetVocab : Benchmark Suite Tests
+================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import json
+import pytest
+import logging
+
+
+@pytest.fixture(scope="module")
+def bench(rootDir):
+    """Import the benchmark script."""
+    sys.path.insert(0, os.path.join(rootDir, "benchmarks"))
+    import bench
+    yield bench
+    sys.path.remove(os.path.join(rootDir, "benchmarks"))
+
+
+@pytest.mark.core
+def testCoreBench_Compare(bench):
+    """Test comparing results against a baseline."""
+    baseline = {"results": {"a": {"best_us": 10.0}, "b": {"best_us": 10.0}, "c": {}}}
+    results = {
+        "a": {"best_us": 11.0}, "b": {"best_us": 20.0}, "c": {"best_us": 1.0},
+        "d": {"best_us": 1.0},
+    }
+    ratios, slower = bench.compare(results, baseline, 0.25)
+    assert ratios == {"a": 1.1, "b": 2.0}
+    assert slower == ["b"]
+    assert bench.compare(results, {}, 0.25) == ({}, [])
+
+# END Test testCoreBench_Compare
+
+
+@pytest.mark.bench
+def testBenchSuite_Run(bench, fncDir, capsys):
+    """Test a short benchmark run against the mock server."""
+    outFile = os.path.join(fncDir, "results.json")
+    baseFile = os.path.join(fncDir, "baseline.json")
+    environ = dict(os.environ)
+    logger = logging.getLogger("metvocab")
+    level = logger.level
+
+    args = ["--quick", "--filter", "group_search", "--filter", "cf_lookup", "--json"]
+    assert bench.main(args + ["--baseline", baseFile, "--save-baseline"]) == 0
+    assert dict(os.environ) == environ
+    assert logger.level == level
+
+    report = json.loads(capsys.readouterr().out)
+    assert sorted(report["results"]) == ["cf_lookup", "group_search"]
+    assert report["meta"]["quick"] is True
+    assert report["results"]["group_search"]["ops"] > 1000
+    assert report["results"]["group_search"]["repeat"] == 3
+    assert "ratios" not in report
+
+    # Compare against the saved baseline
+    assert bench.main(args + ["--baseline", baseFile, "--output", outFile]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert sorted(report["ratios"]) == ["cf_lookup", "group_search"]
+    with open(outFile, mode="r", encoding="utf-8") as infile:
+        assert json.load(infile)["results"].keys() == report["results"].keys()
+
+    # A baseline that cannot be met
+    with open(baseFile, mode="r", encoding="utf-8") as infile:
+        baseline = json.load(infile)
+    baseline["results"]["cf_lookup"]["best_us"] /= 100.0
+    with open(baseFile, mode="w", encoding="utf-8") as outfile:
+        json.dump(baseline, outfile)
+    assert bench.main(["--quick", "--filter", "cf_lookup", "--baseline", baseFile]) == 0
+    assert bench.main(["--quick", "--filter", "cf_lookup", "--baseline", baseFile, "--check"]) == 1
+    assert "Slower than the baseline: cf_lookup" in capsys.readouterr().out
+
+    # Checking needs a baseline
+    os.unlink(baseFile)
+    assert bench.main(["--quick", "--baseline", baseFile, "--check"]) == 2
+    assert "No baseline" in capsys.readouterr().err
+
+# END Test testBenchSuite_Run
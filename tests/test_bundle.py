@@ -0,0 +1,177 @@
+"""
+MetVocab : Offline Cache Bundle Tests
+=====================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import pytest
+import sqlite3
+
+import metvocab.storage
+
+from tools import readJson, writeFile
+
+from metvocab.cli import main
+from metvocab.cache import DataCache
+from metvocab.bundle import export_bundle, import_bundle, read_manifest, verify_bundle
+from metvocab.storage import BundleStorage
+
+URI_A = "https://vocab.met.no/mmd/Access_Constraint"
+URI_B = "https://vocab.met.no/mmd/Instrument/OLCI"
+
+
+@pytest.fixture(scope="function")
+def srcCache(fncDir, filesDir, monkeypatch):
+    """A file cache with two entries."""
+    monkeypatch.setenv("METVOCAB_CACHEPATH", os.path.join(fncDir, "src"))
+    monkeypatch.delenv("METVOCAB_BACKEND", raising=False)
+    cache = DataCache()
+    cache.storage.store(
+        "mmd", URI_A, readJson(os.path.join(filesDir, "Access_Constraint.json")),
+        {"etag": "\"abc\""}, fetched=1000.0
+    )
+    cache.storage.store(
+        "mmd", URI_B, readJson(os.path.join(filesDir, "Instrument", "OLCI.json")), {}
+    )
+    return cache
+
+
+def newCache(fncDir, monkeypatch, name, backend="files"):
+    """Return a data cache in a new folder."""
+    monkeypatch.setenv("METVOCAB_CACHEPATH", os.path.join(fncDir, name))
+    monkeypatch.setenv("METVOCAB_BACKEND", backend)
+    return DataCache()
+
+
+@pytest.mark.core
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("backend", ["files", "sqlite"])
+def testCoreBundle_ExportImport(srcCache, fncDir, filesDir, monkeypatch, compact, backend):
+    """Test exporting a cache and importing it into another."""
+    bundleFile = os.path.join(fncDir, "cache.bundle")
+    assert export_bundle(bundleFile, cache=srcCache, compact=compact) == 2
+    assert sorted(os.listdir(fncDir)) == ["cache.bundle", "src"]
+    assert os.stat(bundleFile).st_mode & 0o777 == 0o666 & ~metvocab.storage._get_umask()
+
+    info, manifest = read_manifest(bundleFile)
+    assert info["format"] == "metvocab-bundle"
+    assert info["entries"] == "2"
+    assert [(m["voc_id"], m["uri"]) for m in manifest] == [("mmd", URI_A), ("mmd", URI_B)]
+    assert manifest[0]["fetched"] == 1000.0
+    assert len(manifest[0]["checksum"]) == 64
+    assert verify_bundle(bundleFile) == []
+
+    dstCache = newCache(fncDir, monkeypatch, "dst", backend)
+    assert import_bundle(bundleFile, cache=dstCache) == 2
+    storage = dstCache.storage
+    assert storage.load("mmd", URI_A) == srcCache.storage.load("mmd", URI_A)
+    assert storage.load("mmd", URI_B) == srcCache.storage.load("mmd", URI_B)
+    assert storage.load_validators("mmd", URI_A) == {"etag": "\"abc\""}
+    assert storage.fetched("mmd", URI_A) == 1000.0
+
+# END Test testCoreBundle_ExportImport
+
+
+@pytest.mark.core
+def testCoreBundle_Corrupt(srcCache, fncDir, monkeypatch):
+    """Test that a corrupt bundle is not imported."""
+    bundleFile = os.path.join(fncDir, "cache.bundle")
+    export_bundle(bundleFile, cache=srcCache)
+
+    conn = sqlite3.connect(bundleFile)
+    with conn:
+        conn.execute("UPDATE entries SET data = '{}' WHERE uri = ?", (URI_B,))
+        conn.execute(
+            "INSERT INTO entries (voc_id, uri, fetched, data) VALUES ('mmd', 'x', 0, '{}')"
+        )
+    conn.close()
+    assert verify_bundle(bundleFile) == [URI_B, "x"]
+
+    dstCache = newCache(fncDir, monkeypatch, "dst", "sqlite")
+    with pytest.raises(ValueError):
+        import_bundle(bundleFile, cache=dstCache)
+    assert list(dstCache.storage.entries()) == []
+
+    # Not a bundle
+    otherFile = os.path.join(fncDir, "other.bundle")
+    writeFile(otherFile, "Hello")
+    with pytest.raises(ValueError):
+        read_manifest(otherFile)
+    with pytest.raises(ValueError):
+        import_bundle(dstCache.storage.location, cache=dstCache)
+    with pytest.raises(OSError):
+        BundleStorage(os.path.join(fncDir, "missing.bundle"))
+
+# END Test testCoreBundle_Corrupt
+
+
+@pytest.mark.core
+def testCoreBundle_ReadOnly(srcCache, fncDir, monkeypatch):
+    """Test reading directly from a read-only bundle."""
+    bundleFile = os.path.join(fncDir, "cache.bundle")
+    export_bundle(bundleFile, cache=srcCache, compact=True)
+    os.chmod(bundleFile, 0o444)
+
+    calls = []
+    monkeypatch.setenv("METVOCAB_BUNDLE", bundleFile)
+    dtCache = newCache(fncDir, monkeypatch, "dst")
+    monkeypatch.setattr(dtCache, "_retrieve_data", lambda *a: calls.append(a) or (False, {}))
+    assert isinstance(dtCache.bundle, BundleStorage)
+
+    # Old bundle entries are served without calling the API
+    assert dtCache.get_vocab("mmd", URI_A) == srcCache.storage.load("mmd", URI_A)
+    assert dtCache.get_vocab("mmd", URI_B) == srcCache.storage.load("mmd", URI_B)
+    assert dtCache.get_vocab("mmd", "https://vocab.met.no/mmd/Platform") == {}
+    assert len(calls) == 1
+
+    # The bundle is memory-mapped and cannot be written
+    bundle = dtCache.bundle
+    assert bundle._connect().execute("PRAGMA mmap_size").fetchone()[0] > 0
+    with pytest.raises(OSError):
+        bundle.store("mmd", URI_A, {}, {})
+    with pytest.raises(OSError):
+        bundle.touch("mmd", URI_A)
+    with pytest.raises(OSError):
+        bundle.expire(0)
+    with bundle.lock("mmd", URI_A) as locked:
+        assert locked is True
+
+    # Entries in the storage take precedence
+    dtCache.storage.store("mmd", URI_A, {"new": "data"}, {})
+    assert dtCache._get_data("mmd", URI_A) == {"new": "data"}
+
+    os.chmod(bundleFile, 0o644)
+
+# END Test testCoreBundle_ReadOnly
+
+
+@pytest.mark.core
+def testCoreBundle_Cli(srcCache, fncDir, monkeypatch, capsys):
+    """Test the export and import commands."""
+    bundleFile = os.path.join(fncDir, "cache.bundle")
+    assert main(["export", bundleFile, "--compact"]) == 0
+    assert "Exported 2 entries" in capsys.readouterr().out
+    assert main(["export", os.path.join(fncDir, "missing", "cache.bundle")]) == 1
+    assert "Export failed" in capsys.readouterr().out
+
+    newCache(fncDir, monkeypatch, "dst")
+    assert main(["import", bundleFile]) == 0
+    assert "Imported 2 entries" in capsys.readouterr().out
+    assert main(["import", os.path.join(fncDir, "missing.bundle"), "--no-verify"]) == 1
+    assert "Import failed" in capsys.readouterr().out
+
+# END Test testCoreBundle_Cli
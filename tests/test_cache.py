@@ -19,19 +19,27 @@ limitations under the License.
 
 import os
 import json
+import time
 import pytest
+import asyncio
+import threading
 import urllib.error
-import urllib.request
+
+import metvocab.cache
+import metvocab.transport
 
 from tools import writeFile
 
-from metvocab.cache import DataCache
+from metvocab.cache import (
+    DataCache, AsyncDataCache, clear_memory_cache, clear_negative_cache, get_api_status
+)
+from metvocab.transport import HTTPPool, RetryPolicy, get_breaker, set_retry_policy
 
 
 @pytest.fixture(scope="function")
-def tstCache(fncDir):
+def tstCache(fncDir, monkeypatch):
     """A mock instance of DataCache that redirects the config path to
-    a temporary folder.
+    a temporary folder. Requests are not retried.
     """
     os.environ["METVOCAB_CACHEPATH"] = fncDir
     os.environ["METVOCAB_MAXAGE"] = "7"
@@ -43,10 +51,11 @@ def tstCache(fncDir):
 class MockResponse():
     """Mock response object to return from urlopen."""
 
-    def __init__(self, status=200, data="{}"):
+    def __init__(self, status=200, data="{}", headers=None):
         self.status = status
         self.code = status
         self.data = data
+        self.headers = {} if headers is None else headers
 
     def read(self):
         return self.data
@@ -103,7 +112,7 @@ def testCoreCache_RetrieveData(tstCache, monkeypatch, caplog):
         def mockUrlopen(*a):
             raise urllib.error.HTTPError("url", 400, "oops!", "", "")
 
-        mp.setattr(urllib.request, "urlopen", mockUrlopen)
+        mp.setattr(HTTPPool, "urlopen", mockUrlopen)
         caplog.clear()
         status, data = tstCache._retrieve_data("mmd", testUri)
         assert status is False
@@ -115,7 +124,7 @@ def testCoreCache_RetrieveData(tstCache, monkeypatch, caplog):
         def mockUrlopen(*a):
             raise urllib.error.URLError("oops!")
 
-        mp.setattr(urllib.request, "urlopen", mockUrlopen)
+        mp.setattr(HTTPPool, "urlopen", mockUrlopen)
         caplog.clear()
         status, data = tstCache._retrieve_data("mmd", testUri)
         assert status is False
@@ -124,7 +133,7 @@ def testCoreCache_RetrieveData(tstCache, monkeypatch, caplog):
 
     # No response
     with monkeypatch.context() as mp:
-        mp.setattr(urllib.request, "urlopen", lambda *a: None)
+        mp.setattr(HTTPPool, "urlopen", lambda *a: None)
         caplog.clear()
         status, data = tstCache._retrieve_data("mmd", testUri)
         assert status is False
@@ -138,7 +147,7 @@ def testCoreCache_RetrieveData(tstCache, monkeypatch, caplog):
         def mockUrlopen(*a):
             return MockResponse(200, json.dumps(m_data))
 
-        mp.setattr(urllib.request, "urlopen", mockUrlopen)
+        mp.setattr(HTTPPool, "urlopen", mockUrlopen)
         status, data = tstCache._retrieve_data("mmd", testUri)
         assert status is True
         assert data == m_data
@@ -167,7 +176,7 @@ def testCoreCache_GetData(tstCache, monkeypatch, fncDir):
     """Test the data caching when data retrieval succeds, fails and
     tests for cases where cache exists, both when old and not old
     """
-    def mock_retrieve_data_succ(voc_id, uri):
+    def mock_retrieve_data_succ(voc_id, uri, validators=None):
         return True, {voc_id: uri}
 
     with pytest.raises(ValueError):
@@ -229,28 +238,28 @@ def testCoreCache_CreateCache(tstCache, monkeypatch, fncDir):
     """Tests the creation of cache, and behavior when data retrieval
     fails.
     """
-    def mock_retrieve_data_succ(voc_id, uri):
+    def mock_retrieve_data_succ(voc_id, uri, validators=None):
         return True, {voc_id: uri}
 
-    def mock_retrieve_data_fail(voc_id, uri):
+    def mock_retrieve_data_fail(voc_id, uri, validators=None):
         return False, {voc_id: uri}
 
-    json_path = os.path.join(fncDir, "mock.json")
+    json_path = os.path.join(fncDir, "met.no", "Hello.json")
 
     # Check case where _retrieve_data is success
     with monkeypatch.context() as mp:
         mp.setattr(tstCache, "_retrieve_data", mock_retrieve_data_succ)
-        status = tstCache._create_cache(fncDir, json_path, "Hello", "World")
+        status = tstCache._create_cache("World", "https://met.no/Hello")
         assert status
         assert os.path.isfile(json_path)
         with open(json_path, mode="r", encoding="utf-8") as infile:
-            assert json.load(infile) == {"Hello": "World"}
+            assert json.load(infile) == {"World": "https://met.no/Hello"}
 
     os.unlink(json_path)
     # If _retrieve_data fails
     with monkeypatch.context() as mp:
         mp.setattr(tstCache, "_retrieve_data", mock_retrieve_data_fail)
-        status = tstCache._create_cache(fncDir, json_path, "Hello", "World")
+        status = tstCache._create_cache("World", "https://met.no/Hello")
         assert not os.path.isfile(json_path)
         assert not status
 
@@ -259,20 +268,532 @@ def testCoreCache_CreateCache(tstCache, monkeypatch, fncDir):
 
 @pytest.mark.core
 def testCoreCache_CheckTimestamp(tstCache, fncDir):
-    """Tests _check_timestamp method in Cache class when file is fresh
-    and when file is stale
+    """Tests _check_timestamp method in Cache class when entry is fresh
+    and when entry is stale
     """
-    old_file = os.path.join(fncDir, "old.json")
-    new_file = os.path.join(fncDir, "new.json")
-    writeFile(new_file, "mockinfo")
-    writeFile(old_file, "mockinfo")
-
-    # Manually set access and modified times of old_file
-    os.utime(old_file, (100, 100))
-
     # Check if old is older than 1 day
-    assert tstCache._check_timestamp(old_file, 86400) is True
-    # Check if newly created file within 1 day threshold
-    assert tstCache._check_timestamp(new_file, 86400) is False
+    assert tstCache._check_timestamp(100, 86400) is True
+    # Check if newly fetched within 1 day threshold
+    assert tstCache._check_timestamp(time.time(), 86400) is False
 
 # END Test testCoreCache_CheckTimestamp
+
+
+@pytest.mark.core
+def testCoreCache_ConditionalRequest(tstCache, monkeypatch, fncDir):
+    """Tests that stale entries are revalidated with the stored ETag
+    and Last-Modified values.
+    """
+    testUri = "https://vocab.met.no/mmd/Access_Constraint"
+    jsonFile = os.path.join(fncDir, "vocab.met.no", "mmd", "Access_Constraint.json")
+    metaFile = jsonFile + ".meta"
+    m_data = {"test": "test"}
+    m_headers = {"etag": "\"abc\"", "last-modified": "Tue, 19 Jan 2021 13:38:50 GMT"}
+    requests = []
+
+    def mockUrlopen(self, req, *a):
+        requests.append(req)
+        return MockResponse(200, json.dumps(m_data), m_headers)
+
+    def mockUrlopen304(self, req, *a):
+        requests.append(req)
+        return MockResponse(304, "")
+
+    def mockUrlopenErr304(self, req, *a):
+        requests.append(req)
+        raise urllib.error.HTTPError("url", 304, "Not Modified", {}, None)
+
+    # Initial download stores the validators
+    with monkeypatch.context() as mp:
+        mp.setattr(HTTPPool, "urlopen", mockUrlopen)
+        assert tstCache._get_data("mmd", testUri) == m_data
+        assert requests[-1].get_header("If-none-match") is None
+        with open(metaFile, mode="r", encoding="utf-8") as infile:
+            assert json.load(infile) == {
+                "etag": "\"abc\"", "last_modified": "Tue, 19 Jan 2021 13:38:50 GMT"
+            }
+
+    # Not modified only updates the timestamp
+    for mockFunc in (mockUrlopen304, mockUrlopenErr304):
+        os.utime(jsonFile, (100, 100))
+        with monkeypatch.context() as mp:
+            mp.setattr(HTTPPool, "urlopen", mockFunc)
+            assert tstCache._get_data("mmd", testUri) == m_data
+            assert requests[-1].get_header("If-none-match") == "\"abc\""
+            assert requests[-1].get_header("If-modified-since") == m_headers["last-modified"]
+            assert tstCache._check_timestamp(os.path.getmtime(jsonFile), 3600) is False
+
+    # A response without validators removes the old ones
+    os.utime(jsonFile, (100, 100))
+    with monkeypatch.context() as mp:
+        mp.setattr(HTTPPool, "urlopen", lambda *a: MockResponse(200, json.dumps(m_data)))
+        assert tstCache._get_data("mmd", testUri) == m_data
+        assert not os.path.isfile(metaFile)
+
+    # Broken meta file is ignored
+    writeFile(metaFile, "{broken")
+    assert tstCache.storage.load_validators("mmd", testUri) == {}
+
+# END Test testCoreCache_ConditionalRequest
+
+
+@pytest.mark.core
+def testCoreCache_AsyncGetVocab(tstCache, monkeypatch):
+    """Tests the asyncio wrapper around the cache, and that its
+    concurrency limit is respected.
+    """
+    state = {"running": 0, "peak": 0}
+
+    def mock_get_vocab(voc_id, uri):
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.02)
+        state["running"] -= 1
+        return {voc_id: uri}
+
+    uris = ["https://met.no/path/%d" % i for i in range(8)]
+
+    with monkeypatch.context() as mp:
+        mp.setattr(tstCache, "get_vocab", mock_get_vocab)
+        aCache = AsyncDataCache(cache=tstCache, limit=2)
+        assert aCache._limit == 2
+
+        data = asyncio.run(aCache.get_vocab("mmd", uris[0]))
+        assert data == {"mmd": uris[0]}
+
+        data = asyncio.run(aCache.get_many("mmd", uris))
+        assert data == [{"mmd": uri} for uri in uris]
+        assert state["peak"] <= 2
+
+    # Limit from the environment
+    with monkeypatch.context() as mp:
+        mp.setenv("METVOCAB_FETCH_WORKERS", "5")
+        assert AsyncDataCache(cache=tstCache)._limit == 5
+
+# END Test testCoreCache_AsyncGetVocab
+
+
+@pytest.mark.core
+def testCoreCache_MemoryCache(tstCache, monkeypatch, fncDir):
+    """Tests the in-memory cache in front of the disk cache."""
+    calls = []
+
+    def mock_get_data(voc_id, uri):
+        calls.append(uri)
+        jsonPath, jsonFile = tstCache.storage._entry_path(uri)
+        if not os.path.isfile(jsonFile):
+            os.makedirs(jsonPath, exist_ok=True)
+            writeFile(jsonFile, "{}")
+        return {voc_id: uri}
+
+    uriA = "https://met.no/path/a"
+    uriB = "https://met.no/path/b"
+    uriC = "https://met.no/path/c"
+
+    with monkeypatch.context() as mp:
+        mp.setattr(tstCache, "_get_data", mock_get_data)
+        tstCache._mem_size = 2
+
+        # Repeated lookups are served from memory
+        assert tstCache.get_vocab("mmd", uriA) == {"mmd": uriA}
+        assert tstCache.get_vocab("mmd", uriA) == {"mmd": uriA}
+        assert calls == [uriA]
+
+        # Each caller gets its own copy
+        data = tstCache.get_vocab("mmd", uriA)
+        data["mmd"] = "changed"
+        data["graph"] = [{"a": 1}]
+        other = tstCache.get_vocab("mmd", uriA)
+        assert other == {"mmd": uriA}
+        other["mmd"] = [1]
+        assert tstCache.get_vocab("mmd", uriA) == {"mmd": uriA}
+        assert calls == [uriA]
+
+        # Least recently used entry is evicted
+        tstCache.get_vocab("mmd", uriB)
+        tstCache.get_vocab("mmd", uriA)
+        tstCache.get_vocab("mmd", uriC)
+        assert calls == [uriA, uriB, uriC]
+        tstCache.get_vocab("mmd", uriA)
+        assert calls == [uriA, uriB, uriC]
+        tstCache.get_vocab("mmd", uriB)
+        assert calls == [uriA, uriB, uriC, uriB]
+
+        # Entries expire with the max age of the file
+        os.utime(tstCache.storage._entry_path(uriA)[1], (100, 100))
+        clear_memory_cache()
+        tstCache.get_vocab("mmd", uriA)
+        tstCache.get_vocab("mmd", uriA)
+        assert calls == [uriA, uriB, uriC, uriB, uriA, uriA]
+
+        # Disabled
+        calls.clear()
+        clear_memory_cache()
+        tstCache._mem_size = 0
+        tstCache.get_vocab("mmd", uriB)
+        tstCache.get_vocab("mmd", uriB)
+        assert calls == [uriB, uriB]
+
+    with monkeypatch.context() as mp:
+        mp.setenv("METVOCAB_MEMCACHE_SIZE", "10")
+        assert DataCache()._mem_size == 10
+
+# END Test testCoreCache_MemoryCache
+
+
+@pytest.mark.core
+def testCoreCache_AtomicWrite(tstCache, monkeypatch, fncDir):
+    """Tests that a failed write leaves the old cache file intact."""
+    jsonFile = os.path.join(fncDir, "atomic.json")
+    tstCache.storage._write_json(jsonFile, {"old": "data"})
+    assert os.listdir(fncDir) == ["atomic.json"]
+
+    def mock_dump(*a, **k):
+        raise OSError("Disk full")
+
+    with monkeypatch.context() as mp:
+        mp.setattr(json, "dump", mock_dump)
+        with pytest.raises(OSError):
+            tstCache.storage._write_json(jsonFile, {"new": "data"})
+
+    assert os.listdir(fncDir) == ["atomic.json"]
+    with open(jsonFile, mode="r", encoding="utf-8") as infile:
+        assert json.load(infile) == {"old": "data"}
+
+# END Test testCoreCache_AtomicWrite
+
+
+@pytest.mark.core
+def testCoreCache_LockEntry(tstCache, monkeypatch, fncDir):
+    """Tests that only one caller refreshes an entry at a time."""
+    fcntl = pytest.importorskip("fcntl")
+    testUri = "https://met.no/path1/path2"
+    jsonPath, jsonFile = tstCache.storage._entry_path(testUri)
+    calls = []
+
+    def mock_retrieve_data(voc_id, uri, validators=None):
+        calls.append(uri)
+        return True, {"new": "data"}
+
+    def lockEntry():
+        os.makedirs(jsonPath, exist_ok=True)
+        lockFile = open(jsonFile + ".lock", mode="a")
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        return lockFile
+
+    monkeypatch.setattr(tstCache, "_retrieve_data", mock_retrieve_data)
+
+    # Check the lock itself
+    with tstCache.storage.lock("mmd", testUri) as locked:
+        assert locked is True
+        with tstCache.storage.lock("mmd", testUri, blocking=False) as other:
+            assert other is False
+    with tstCache.storage.lock("mmd", testUri, blocking=False) as locked:
+        assert locked is True
+
+    # A missing entry waits for the other writer
+    lockFile = lockEntry()
+    result = {}
+    thread = threading.Thread(
+        target=lambda: result.update(data=tstCache._get_data("mmd", testUri))
+    )
+    thread.start()
+    thread.join(0.2)
+    assert thread.is_alive()
+    tstCache.storage._write_json(jsonFile, {"other": "writer"})
+    lockFile.close()
+    thread.join()
+    assert result["data"] == {"other": "writer"}
+    assert calls == []
+
+    # A stale entry being refreshed elsewhere serves the old data
+    os.utime(jsonFile, (100, 100))
+    lockFile = lockEntry()
+    assert tstCache._get_data("mmd", testUri) == {"other": "writer"}
+    assert calls == []
+    lockFile.close()
+
+    # A stale entry is refreshed when not locked
+    assert tstCache._get_data("mmd", testUri) == {"new": "data"}
+    assert calls == [testUri]
+
+    # An entry refreshed while waiting for the lock is not fetched again
+    os.utime(jsonFile, (100, 100))
+    with monkeypatch.context() as mp:
+        stale = iter([True, False])
+        mp.setattr(tstCache, "_check_timestamp", lambda *a: next(stale))
+        tstCache._get_data("mmd", testUri)
+        assert calls == [testUri]
+
+# END Test testCoreCache_LockEntry
+
+
+@pytest.mark.core
+def testCoreCache_Revalidate(tstCache, monkeypatch, fncDir, caplog):
+    """Tests the stale-while-revalidate mode."""
+    testUri = "https://met.no/path1/path2"
+    jsonPath, jsonFile = tstCache.storage._entry_path(testUri)
+    os.makedirs(jsonPath)
+    tstCache.storage._write_json(jsonFile, {"old": "data"})
+    started = threading.Event()
+    release = threading.Event()
+
+    def mock_retrieve_data(voc_id, uri, validators=None):
+        started.set()
+        release.wait(5)
+        return True, {"new": "data"}
+
+    def waitForRefresh():
+        for _ in range(100):
+            if not metvocab.cache._refreshing:
+                return
+            time.sleep(0.01)
+
+    monkeypatch.setattr(tstCache, "_retrieve_data", mock_retrieve_data)
+    tstCache._revalidate = True
+    tstCache._max_stale = 30*86400
+
+    # Stale data is returned while refreshing in the background
+    os.utime(jsonFile, (time.time() - 8*86400,)*2)
+    assert tstCache._get_data("mmd", testUri) == {"old": "data"}
+    assert started.wait(5)
+    assert tstCache._get_data("mmd", testUri) == {"old": "data"}
+    assert len(metvocab.cache._refreshing) == 1
+    release.set()
+    waitForRefresh()
+    assert tstCache._get_data("mmd", testUri) == {"new": "data"}
+
+    # Beyond the maximum staleness, the refresh is blocking
+    tstCache.storage._write_json(jsonFile, {"old": "data"})
+    os.utime(jsonFile, (time.time() - 31*86400,)*2)
+    assert tstCache._get_data("mmd", testUri) == {"new": "data"}
+
+    # Errors in the background are logged
+    def causeError(*a):
+        raise ValueError("Oops")
+
+    os.utime(jsonFile, (time.time() - 8*86400,)*2)
+    monkeypatch.setattr(tstCache, "_retrieve_data", causeError)
+    caplog.clear()
+    tstCache._get_data("mmd", testUri)
+    waitForRefresh()
+    assert "Background refresh of https://met.no/path1/path2 failed: Oops" in caplog.text
+
+    # Settings
+    with monkeypatch.context() as mp:
+        mp.setenv("METVOCAB_REVALIDATE", "yes")
+        mp.setenv("METVOCAB_MAXSTALE", "14")
+        dtCache = DataCache()
+        assert dtCache._revalidate is True
+        assert dtCache._max_stale == 14*86400
+        mp.setenv("METVOCAB_REVALIDATE", "0")
+        mp.setenv("METVOCAB_MAXSTALE", "1")
+        dtCache = DataCache()
+        assert dtCache._revalidate is False
+        assert dtCache._max_stale == dtCache._max_age
+
+# END Test testCoreCache_Revalidate
+
+
+@pytest.mark.core
+def testCoreCache_NegativeCache(tstCache, monkeypatch, fncDir):
+    """Tests that failed uris are not retried until the negative cache
+    time has passed.
+    """
+    testUri = "https://met.no/path1/path2"
+    calls = []
+
+    def mock_retrieve_data(voc_id, uri, validators=None):
+        calls.append(uri)
+        return False, {}
+
+    monkeypatch.setattr(tstCache, "_retrieve_data", mock_retrieve_data)
+
+    assert tstCache._get_data("mmd", testUri) is None
+    assert tstCache._get_data("mmd", testUri) is None
+    assert calls == [testUri]
+    assert testUri in get_api_status()["failed_uris"]
+
+    # Other vocabulary or api url is not blocked
+    assert tstCache._get_data("other", testUri) is None
+    assert len(calls) == 2
+    apiUrl = tstCache._api_url
+    tstCache._api_url = "https://other.met.no/api"
+    assert tstCache._get_data("mmd", testUri) is None
+    assert len(calls) == 3
+    tstCache._api_url = apiUrl
+    clear_negative_cache()
+    del calls[:]
+    assert tstCache._get_data("mmd", testUri) is None
+    assert calls == [testUri]
+
+    # Expired
+    key = (tstCache._api_url, "mmd", testUri)
+    metvocab.cache._failed_uris[key] = time.time() - 1
+    assert get_api_status()["failed_uris"] == {}
+    assert tstCache._get_data("mmd", testUri) is None
+    assert calls == [testUri, testUri]
+
+    # Cleared
+    clear_negative_cache()
+    assert tstCache._get_data("mmd", testUri) is None
+    assert len(calls) == 3
+
+    # Disabled
+    clear_negative_cache()
+    tstCache._negative_ttl = 0
+    assert tstCache._get_data("mmd", testUri) is None
+    assert tstCache._get_data("mmd", testUri) is None
+    assert len(calls) == 5
+
+    with monkeypatch.context() as mp:
+        mp.setenv("METVOCAB_NEGATIVE_TTL", "5")
+        assert DataCache()._negative_ttl == 5.0
+
+# END Test testCoreCache_NegativeCache
+
+
+@pytest.mark.core
+def testCoreCache_CircuitBreaker(tstCache, monkeypatch, caplog):
+    """Tests that the API calls are skipped while the circuit is open."""
+    testUri = "https://vocab.met.no/mmd/Access_Constraint"
+    calls = []
+
+    def mockUrlopen(self, req, *a):
+        calls.append(req)
+        raise urllib.error.URLError("Down")
+
+    def mockUrlopenErr(code):
+        def mockUrlopen(self, req, *a):
+            calls.append(req)
+            raise urllib.error.HTTPError("url", code, "oops!", {}, None)
+        return mockUrlopen
+
+    breaker = get_breaker()
+    monkeypatch.setattr(breaker, "_threshold", 3)
+    monkeypatch.setattr(breaker, "_reset_timeout", 60.0)
+
+    # Client errors do not count
+    with monkeypatch.context() as mp:
+        mp.setattr(HTTPPool, "urlopen", mockUrlopenErr(404))
+        for _ in range(4):
+            assert tstCache._retrieve_data("mmd", testUri) == (False, {})
+        assert breaker.state == "closed"
+
+    # Server errors and connection errors do
+    with monkeypatch.context() as mp:
+        mp.setattr(HTTPPool, "urlopen", mockUrlopenErr(503))
+        tstCache._retrieve_data("mmd", testUri)
+        mp.setattr(HTTPPool, "urlopen", mockUrlopen)
+        tstCache._retrieve_data("mmd", testUri)
+        assert breaker.state == "closed"
+        assert get_api_status()["failures"] == 2
+        tstCache._retrieve_data("mmd", testUri)
+        assert breaker.state == "open"
+        assert len(calls) == 7
+
+        caplog.clear()
+        assert tstCache._retrieve_data("mmd", testUri) == (False, None)
+        assert len(calls) == 7
+        assert "API is unavailable" in caplog.text
+
+        # Skipped calls are not negative cached
+        clear_negative_cache()
+        assert tstCache._get_data("mmd", testUri) is None
+        assert len(calls) == 7
+        assert get_api_status()["failed_uris"] == {}
+
+        status = get_api_status()
+        assert status["state"] == "open"
+        assert status["failures"] == 3
+        assert status["retry_at"] > time.time()
+
+    # After the reset timeout, a single trial is allowed
+    breaker._opened_at -= 61
+    assert breaker.state == "half-open"
+    assert breaker.allow() is True
+    assert breaker.allow() is False
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    breaker._opened_at -= 61
+    with monkeypatch.context() as mp:
+        mp.setattr(HTTPPool, "urlopen", lambda *a: MockResponse(200, "{}"))
+        assert tstCache._get_data("mmd", testUri) == {}
+    assert breaker.state == "closed"
+    assert breaker.status == {
+        "state": "closed", "failures": 0, "threshold": 3, "retry_at": None
+    }
+
+# END Test testCoreCache_CircuitBreaker
+
+
+@pytest.mark.core
+def testCoreCache_Retry(tstCache, monkeypatch, caplog):
+    """Tests retrying failed requests."""
+    testUri = "https://vocab.met.no/mmd/Access_Constraint"
+    responses = []
+    calls = []
+
+    def mockUrlopen(self, req, *a):
+        calls.append(time.monotonic())
+        resp = responses.pop(0)
+        if isinstance(resp, Exception):
+            raise resp
+        return resp
+
+    def httpError(code, headers=None):
+        return urllib.error.HTTPError("url", code, "oops!", headers or {}, None)
+
+    monkeypatch.setattr(HTTPPool, "urlopen", mockUrlopen)
+    set_retry_policy(RetryPolicy(attempts=3, backoff=0.01, max_backoff=0.05, deadline=5))
+
+    # Transient errors are retried
+    responses[:] = [httpError(503), urllib.error.URLError("Down"), MockResponse(200, "{}")]
+    caplog.clear()
+    assert tstCache._retrieve_data("mmd", testUri) == (True, {})
+    assert len(calls) == 3
+    assert "retrying in" in caplog.text
+
+    # Client errors are not
+    calls.clear()
+    responses[:] = [httpError(404), MockResponse(200, "{}")]
+    assert tstCache._retrieve_data("mmd", testUri) == (False, {})
+    assert len(calls) == 1
+
+    # Give up after the maximum number of attempts
+    calls.clear()
+    responses[:] = [httpError(500), httpError(502), httpError(504), MockResponse(200, "{}")]
+    assert tstCache._retrieve_data("mmd", testUri) == (False, {})
+    assert len(calls) == 3
+
+    # Retry-After is honoured
+    calls.clear()
+    responses[:] = [httpError(429, {"Retry-After": "0.2"}), MockResponse(200, "{}")]
+    assert tstCache._retrieve_data("mmd", testUri) == (True, {})
+    assert calls[1] - calls[0] >= 0.2
+
+    # Retry-After beyond the deadline gives up at once
+    calls.clear()
+    responses[:] = [httpError(429, {"Retry-After": "120"}), MockResponse(200, "{}")]
+    assert tstCache._retrieve_data("mmd", testUri) == (False, {})
+    assert len(calls) == 1
+
+    # A wait set by another request holds back new requests
+    calls.clear()
+    policy = RetryPolicy(attempts=1, deadline=5)
+    set_retry_policy(policy)
+    policy.defer(0.2)
+    start = time.monotonic()
+    responses[:] = [MockResponse(200, "{}")]
+    assert tstCache._retrieve_data("mmd", testUri) == (True, {})
+    assert calls[0] - start >= 0.15
+
+    # The shared wait may exceed the deadline
+    set_retry_policy(RetryPolicy(attempts=1, deadline=0.1))
+    metvocab.transport.get_retry_policy().defer(10)
+    caplog.clear()
+    assert tstCache._retrieve_data("mmd", testUri) == (False, {})
+    assert "Retry deadline exceeded" in caplog.text
+
+# END Test testCoreCache_Retry
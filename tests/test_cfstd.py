@@ -18,12 +18,14 @@ limitations under the License.
 """
 
 import os
+import json
 import pytest
 
 import metvocab.cfstd
 
-from tools import writeFile
+from tools import readJson, writeFile, causeOSError
 from metvocab import CFStandard
+from metvocab.cfstd import SNAPSHOT_FILE, CFEntry
 
 
 @pytest.mark.core
@@ -76,8 +78,56 @@ def testCoreCFStandard_InitVocab(monkeypatch, fncDir):
 
 
 @pytest.mark.core
-def testCoreCFStandard_CheckStandardName():
+def testCoreCFStandard_ParseFile(fncDir):
+    """Tests the streaming parser on a small file"""
+    mockFile = os.path.join(fncDir, "cf-standard-name-table.xml")
+    writeFile(mockFile, (
+        "<?xml version=\"1.0\"?>\n"
+        "<standard_name_table>\n"
+        "<version_number>99</version_number>\n"
+        "<last_modified>2030-01-01T00:00:00Z</last_modified>\n"
+        "<entry id=\"name_one\">\n"
+        "<canonical_units>K</canonical_units>\n"
+        "<description>Not an <entry id=\"nested\"/> entry</description>\n"
+        "</entry>\n"
+        "<entry id=\"name_two\"><description>Two</description></entry>\n"
+        "<entry/>\n"
+        "<alias id=\"alias_one\"><entry_id>name_one</entry_id></alias>\n"
+        "</standard_name_table>"
+    ))
+
+    cfstd = CFStandard()
+    cfstd._parse_file(mockFile)
+    assert cfstd._standard_names == {"name_one", "name_two"}
+    assert cfstd._alias_names == {"alias_one"}
+    assert cfstd._alias_map == {"alias_one": "name_one"}
+    assert cfstd._entry_fields == {}
+
+    cfstd = CFStandard()
+    cfstd._parse_file(mockFile, rich=True)
+    assert cfstd._standard_names == {"name_one", "name_two"}
+    assert cfstd._entry_fields == {"name_one": ("K", None, None), "name_two": (None, None, None)}
+    assert cfstd.cf_version == "99"
+    assert cfstd.cf_modified == "2030-01-01T00:00:00Z"
+
+    # Empty root is accepted, but gives no names
+    writeFile(mockFile, "<?xml version=\"1.0\"?>\n<standard_name_table/>")
+    cfstd = CFStandard()
+    cfstd._parse_file(mockFile)
+    assert cfstd._standard_names == set()
+
+    # No matching tags at all
+    writeFile(mockFile, "<?xml version=\"1.0\"?>\n<whatever/>")
+    with pytest.raises(LookupError):
+        cfstd._parse_file(mockFile)
+
+# END Test testCoreCFStandard_ParseFile
+
+
+@pytest.mark.core
+def testCoreCFStandard_CheckStandardName(monkeypatch, fncDir):
     """Tests checking standard name from vocabulary"""
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
 
     cfstd = CFStandard()
     cfstd.init_vocab()
@@ -104,3 +154,336 @@ def testCoreCFStandard_CheckStandardName():
     assert cfstd.check_standard_name("longwave_radiance", include_alias=True) is True
 
 # END Test testCoreCFStandard_CheckStandardName
+
+
+@pytest.mark.core
+def testCoreCFStandard_ResolveStandardName(monkeypatch, fncDir):
+    """Tests resolving aliases to their current standard names"""
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
+    cfstd = CFStandard()
+    cfstd.init_vocab()
+    assert cfstd.is_initialised is True
+
+    # Standard names are returned unchanged
+    assert cfstd.resolve_standard_name("air_temperature") == "air_temperature"
+
+    # Aliases are replaced
+    assert cfstd.resolve_standard_name("swell_wave_period") == "sea_surface_swell_wave_period"
+    assert cfstd.resolve_standard_name("mass_fraction_of_o3_in_air") == \
+        "mass_fraction_of_ozone_in_air"
+
+    # Invalid names
+    assert cfstd.resolve_standard_name("something_i_made_up") is None
+    assert cfstd.resolve_standard_name(12345) is None
+    assert cfstd.resolve_standard_name(None) is None
+
+    # Batch
+    assert cfstd.resolve_many([
+        "air_temperature", "swell_wave_period", "something_i_made_up", None, ["list"]
+    ]) == [
+        "air_temperature", "sea_surface_swell_wave_period", None, None, None
+    ]
+    assert cfstd.resolve_many(iter(["longwave_radiance"])) == [
+        cfstd.resolve_standard_name("longwave_radiance")
+    ]
+    assert cfstd.resolve_many([]) == []
+
+    # Every alias resolves to a standard name
+    for alias in cfstd._alias_names:
+        assert cfstd.check_standard_name(cfstd.resolve_standard_name(alias))
+
+# END Test testCoreCFStandard_ResolveStandardName
+
+
+@pytest.mark.core
+def testCoreCFStandard_CheckMany(monkeypatch, fncDir):
+    """Tests the batch lookup functions"""
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
+    cfstd = CFStandard()
+    cfstd.init_vocab()
+
+    values = ["air_temperature", "swell_wave_period", "something_i_made_up", None]
+    assert cfstd.check_many(values) == [True, False, False, False]
+    assert cfstd.check_many(values, include_alias=True) == [True, True, False, False]
+    assert cfstd.filter_valid(values) == ["air_temperature"]
+    assert cfstd.filter_valid(values, include_alias=True) == [
+        "air_temperature", "swell_wave_period"
+    ]
+    assert cfstd.find_invalid(values) == ["swell_wave_period", "something_i_made_up", None]
+    assert cfstd.find_invalid(values, include_alias=True) == ["something_i_made_up", None]
+
+    # The combined set is rebuilt on init
+    assert cfstd._all_names is not None
+    cfstd.init_vocab()
+    assert cfstd._all_names is None
+
+# END Test testCoreCFStandard_CheckMany
+
+
+@pytest.mark.core
+def testCoreCFStandard_Search(monkeypatch, fncDir):
+    """Tests the prefix and fuzzy search"""
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
+    cfstd = CFStandard()
+    cfstd.init_vocab()
+
+    # Prefix
+    names = cfstd.find_by_prefix("sea_water_")
+    assert names == sorted(names)
+    assert "sea_water_temperature" in names
+    assert all(name.startswith("sea_water_") for name in names)
+    assert len(names) == len([n for n in cfstd._standard_names if n.startswith("sea_water_")])
+    assert cfstd.find_by_prefix("Sea Water ") == names
+    assert cfstd.find_by_prefix("sea_water_", limit=3) == names[:3]
+    assert cfstd.find_by_prefix("swell_wave_p") == []
+    assert cfstd.find_by_prefix("swell_wave_p", include_alias=True) == ["swell_wave_period"]
+    assert cfstd.find_by_prefix(None) == []
+
+    # Suggestions
+    assert cfstd.suggest_standard_name("air_temperatur") == ["air_temperature"]
+    assert cfstd.suggest_standard_name("air temperature")[0] == "air_temperature"
+    assert cfstd.suggest_standard_name("sea_surface_temprature") == ["sea_surface_temperature"]
+    assert cfstd.suggest_standard_name("mass_fraction_of_o3_in_ai") == []
+    assert cfstd.suggest_standard_name("mass_fraction_of_o3_in_ai", include_alias=True) == [
+        "mass_fraction_of_o3_in_air"
+    ]
+    assert cfstd.suggest_standard_name("something_i_made_up") == []
+    assert cfstd.suggest_standard_name(12345) == []
+
+    # The indexes are rebuilt on init
+    assert len(cfstd._search_indexes) == 2
+    cfstd.init_vocab()
+    assert cfstd._search_indexes == {}
+
+# END Test testCoreCFStandard_Search
+
+
+@pytest.mark.core
+def testCoreCFStandard_FindByTokens(monkeypatch, fncDir):
+    """Tests the token queries against a scan of all names"""
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
+    cfstd = CFStandard()
+    cfstd.init_vocab()
+
+    def scan(names, *terms):
+        return sorted(n for n in names if all(f"_{t}_" in f"_{n}_" for t in terms))
+
+    names = cfstd.find_by_tokens(["sea_water", "temperature"])
+    assert "sea_water_temperature" in names
+    assert names == scan(cfstd._standard_names, "sea_water", "temperature")
+    assert cfstd.find_by_tokens("sea_water temperature") == names
+    assert cfstd.find_by_tokens("in_sea_water") == scan(cfstd._standard_names, "in_sea_water")
+
+    any_names = cfstd.find_by_tokens(["eastward", "northward"], match="any")
+    eastward = scan(cfstd._standard_names, "eastward")
+    northward = scan(cfstd._standard_names, "northward")
+    assert any_names == sorted(set(eastward) | set(northward))
+
+    # Aliases
+    assert "swell_wave_period" not in cfstd.find_by_tokens("swell period")
+    assert "swell_wave_period" in cfstd.find_by_tokens("swell period", include_alias=True)
+
+    assert cfstd.find_by_tokens("something_i_made_up") == []
+    with pytest.raises(ValueError):
+        cfstd.find_by_tokens("sea", match="none")
+
+    # The indexes are rebuilt on init
+    assert len(cfstd._token_indexes) == 2
+    cfstd.init_vocab()
+    assert cfstd._token_indexes == {}
+
+# END Test testCoreCFStandard_FindByTokens
+
+
+@pytest.mark.core
+def testCoreCFStandard_Snapshot(monkeypatch, fncDir, caplog):
+    """Tests loading the vocabulary from a precompiled snapshot."""
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
+    snapFile = os.path.join(fncDir, SNAPSHOT_FILE)
+
+    # Without snapshot
+    cfstd = CFStandard()
+    cfstd.init_vocab(use_snapshot=False)
+    assert cfstd.is_initialised is True
+    assert not os.path.isfile(snapFile)
+    names = cfstd._standard_names
+    aliases = cfstd._alias_names
+
+    # First run parses the XML and saves the snapshot
+    cfstd = CFStandard()
+    cfstd.init_vocab()
+    assert os.path.isfile(snapFile)
+    snapshot = readJson(snapFile)
+    assert snapshot["version"] == metvocab.cfstd.SNAPSHOT_VERSION
+    assert snapshot["standard_names"] == sorted(names)
+
+    # Second run loads the snapshot
+    cfstd = CFStandard()
+    with monkeypatch.context() as mp:
+        mp.setattr(CFStandard, "_parse_file", causeOSError)
+        cfstd.init_vocab()
+    assert cfstd.is_initialised is True
+    assert cfstd._standard_names == names
+    assert cfstd._alias_names == aliases
+    assert cfstd._alias_map["swell_wave_period"] == "sea_surface_swell_wave_period"
+    assert cfstd.cf_version == "77"
+    assert cfstd.cf_modified == "2021-01-19T13:38:50Z"
+
+    # The rich index fields are only saved in rich mode
+    assert snapshot["entry_fields"] is None
+    with monkeypatch.context() as mp:
+        mp.setattr(CFStandard, "_parse_file", causeOSError)
+        with pytest.raises(OSError):
+            cfstd.init_vocab(rich=True)
+    cfstd.init_vocab(rich=True)
+    snapshot = readJson(snapFile)
+    assert snapshot["entry_fields"]["air_temperature"] == ["K", "11 E130", "ta"]
+    with monkeypatch.context() as mp:
+        mp.setattr(CFStandard, "_parse_file", causeOSError)
+        cfstd.init_vocab(rich=True)
+        assert cfstd.get_canonical_units("air_temperature") == "K"
+        cfstd.init_vocab()
+        assert cfstd.is_rich is False
+
+    # A changed XML file is parsed again
+    with monkeypatch.context() as mp:
+        mp.setattr(CFStandard, "_file_checksum", lambda *a: "changed")
+        mp.setattr(CFStandard, "_parse_file", causeOSError)
+        with pytest.raises(OSError):
+            cfstd.init_vocab()
+
+    # A broken snapshot is ignored and replaced
+    writeFile(snapFile, "not a snapshot")
+    caplog.clear()
+    cfstd = CFStandard()
+    cfstd.init_vocab()
+    assert cfstd.is_initialised is True
+    assert "Could not read CF Standards snapshot" in caplog.text
+    assert cfstd._load_snapshot(snapFile, cfstd._file_checksum(
+        os.path.join(metvocab.cfstd.PKG_PATH, "data", "cf-standard-name-table.xml")
+    )) is True
+
+    # Only plain strings are accepted
+    checksum = snapshot["checksum"]
+    for key, value in [
+        ("standard_names", [1]), ("alias_map", {"a": ["b"]}), ("entry_fields", {"a": [1, 2]}),
+        ("cf_version", {"a": 1}),
+    ]:
+        writeFile(snapFile, json.dumps(dict(snapshot, **{key: value})))
+        caplog.clear()
+        assert cfstd._load_snapshot(snapFile, checksum, rich=True) is False
+        assert "Could not read CF Standards snapshot" in caplog.text
+
+    # Saving fails
+    with monkeypatch.context() as mp:
+        mp.setattr("tempfile.mkstemp", causeOSError)
+        caplog.clear()
+        cfstd._save_snapshot(snapFile, "checksum")
+        assert "Could not save CF Standards snapshot" in caplog.text
+
+# END Test testCoreCFStandard_Snapshot
+
+
+@pytest.mark.core
+def testCoreCFStandard_UnusableCache(monkeypatch, fncDir, caplog):
+    """Tests that the vocabulary is parsed from the XML file when the
+    cache folder cannot be used, whatever the other cache settings.
+    """
+    badPath = os.path.join(fncDir, "file")
+    writeFile(badPath, "not a folder")
+    monkeypatch.setenv("METVOCAB_CACHEPATH", os.path.join(badPath, "cache"))
+    monkeypatch.setenv("METVOCAB_BACKEND", "nope")
+    monkeypatch.setenv("METVOCAB_ENCODING", "nope")
+    monkeypatch.setenv("METVOCAB_BUNDLE", os.path.join(fncDir, "missing.bundle"))
+
+    caplog.clear()
+    cfstd = CFStandard()
+    cfstd.init_vocab()
+    assert cfstd.is_initialised is True
+    assert cfstd.check_standard_name("air_temperature") is True
+    assert "Could not save CF Standards snapshot" in caplog.text
+
+    # No cache folder can be found
+    with monkeypatch.context() as mp:
+        mp.setattr(metvocab.cfstd, "find_cache_path", causeOSError)
+        caplog.clear()
+        cfstd = CFStandard()
+        cfstd.init_vocab(rich=True)
+        assert cfstd.is_initialised is True
+        assert cfstd.get_canonical_units("air_temperature") == "K"
+        assert "Not using a CF Standards snapshot" in caplog.text
+
+# END Test testCoreCFStandard_UnusableCache
+
+
+@pytest.mark.core
+def testCoreCFStandard_RichIndex(monkeypatch, fncDir):
+    """Tests the rich entry index"""
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
+    cfstd = CFStandard()
+    cfstd.init_vocab()
+    assert cfstd.is_rich is False
+    assert cfstd._entry_fields == {}
+    assert cfstd.get_entry("air_temperature") is None
+    assert cfstd.get_canonical_units("air_temperature") is None
+    assert cfstd.find_by_grib("11") == set()
+
+    cfstd.init_vocab(rich=True)
+    assert cfstd.is_initialised is True
+    assert cfstd.is_rich is True
+    assert cfstd._entry_fields == {}
+    assert len(cfstd._entries) == len(cfstd._standard_names)
+
+    # Entry records
+    entry = cfstd.get_entry("air_temperature")
+    assert isinstance(entry, CFEntry)
+    assert entry.name == "air_temperature"
+    assert entry.canonical_units == "K"
+    assert entry.grib == "11 E130"
+    assert entry.grib_codes == ["11", "E130"]
+    assert entry.amip == "ta"
+    assert repr(entry) == (
+        "CFEntry(name='air_temperature', canonical_units='K', grib='11 E130', amip='ta')"
+    )
+    assert not hasattr(entry, "__dict__")
+
+    entry = cfstd.get_entry("aerodynamic_particle_diameter")
+    assert entry.grib is None
+    assert entry.grib_codes == []
+    assert entry.amip is None
+
+    assert cfstd.get_entry("something_i_made_up") is None
+    assert cfstd.get_canonical_units("air_temperature") == "K"
+    assert cfstd.get_canonical_units("swell_wave_period") == "s"
+    assert cfstd.get_canonical_units(None) is None
+
+    # Reverse indexes
+    assert cfstd.find_by_grib("11") == {"air_temperature"}
+    assert cfstd.find_by_grib(11) == {"air_temperature"}
+    assert cfstd.find_by_grib("E130") == {"air_temperature"}
+    assert cfstd.find_by_amip("ta") == {"air_temperature"}
+    assert cfstd.find_by_amip("nope") == set()
+    cfstd._amip_index["42"] = {"made_up"}
+    assert cfstd.find_by_amip(42) == {"made_up"}
+    assert "air_temperature" in cfstd.find_by_units("K")
+    assert "aerodynamic_particle_diameter" in cfstd.find_by_units("m")
+    assert cfstd.find_by_units("furlongs") == set()
+
+    # Returned sets are copies
+    cfstd.find_by_units("K").clear()
+    assert "air_temperature" in cfstd.find_by_units("K")
+
+    # Lazy descriptions, only the recent ones are kept
+    metvocab.cfstd._read_description.cache_clear()
+    assert cfstd.get_description("air_temperature").startswith("Air temperature is")
+    assert cfstd.get_description("swell_wave_period") == \
+        cfstd.get_description("sea_surface_swell_wave_period")
+    assert cfstd.get_description("something_i_made_up") is None
+    info = metvocab.cfstd._read_description.cache_info()
+    assert (info.hits, info.misses) == (1, 2)
+    assert info.maxsize == metvocab.cfstd.DESCRIPTION_CACHE_SIZE
+
+    # Not initialised
+    assert CFStandard().get_description("air_temperature") is None
+
+# END Test testCoreCFStandard_RichIndex
@@ -0,0 +1,216 @@
+"""
+MetVocab : Cache Entry Encoding Tests
+=====================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import pytest
+
+import metvocab.codec
+
+from tools import readFile, readJson
+
+from metvocab.cache import DataCache
+from metvocab.codec import (
+    CODECS, COMPRESSIONS, EntryCodec, decode_entry, is_encoded, context_hash
+)
+from metvocab.storage import FileStorage, SQLiteStorage, open_storage
+
+URI = "https://vocab.met.no/mmd/Access_Constraint"
+
+
+@pytest.mark.core
+@pytest.mark.parametrize("codec", sorted(CODECS))
+@pytest.mark.parametrize("compression", sorted(COMPRESSIONS))
+def testCoreCodec_RoundTrip(filesDir, codec, compression):
+    """Test encoding and decoding with all available settings."""
+    data = readJson(os.path.join(filesDir, "Access_Constraint.json"))
+    entryCodec = EntryCodec(codec=codec, compression=compression)
+    assert entryCodec.spec == (codec, compression, True)
+
+    blob, context = entryCodec.encode(data)
+    assert is_encoded(blob)
+    assert blob.startswith(f"MVC1 {codec} {compression} ".encode("ascii"))
+    assert context[0] == context_hash(data["@context"])
+    assert is_encoded(context[1])
+
+    # The context is looked up when it is not in memory
+    metvocab.codec._contexts.clear()
+    contexts = {context[0]: context[1]}
+    decoded = decode_entry(blob, contexts.get)
+    assert decoded == data
+    assert list(decoded) == list(data)
+
+    # Data without a context
+    blob, context = entryCodec.encode({"a": [1, 2]})
+    assert context is None
+    assert decode_entry(blob, None) == {"a": [1, 2]}
+
+# END Test testCoreCodec_RoundTrip
+
+
+@pytest.mark.core
+def testCoreCodec_Errors(filesDir):
+    """Test the error handling of the codec."""
+    data = readJson(os.path.join(filesDir, "Access_Constraint.json"))
+
+    with pytest.raises(ValueError):
+        EntryCodec(codec="nope")
+    with pytest.raises(ValueError):
+        EntryCodec(compression="nope")
+    with pytest.raises(ValueError):
+        decode_entry(b"MVC1 broken\n", None)
+    with pytest.raises(ValueError):
+        decode_entry(b"MVC1 nope none -\n{}", None)
+    assert not is_encoded(b"{}")
+    assert not is_encoded("MVC1 json none -\n{}")
+
+    # Truncated payload
+    blob, _ = EntryCodec(codec="json", compression="gzip").encode({"a": [1, 2]})
+    with pytest.raises(ValueError):
+        decode_entry(blob[:-8], None)
+
+    # Missing context
+    blob, _ = EntryCodec().encode(data)
+    metvocab.codec._contexts.clear()
+    with pytest.raises(ValueError):
+        decode_entry(blob, lambda h: None)
+
+    # Context sharing can be turned off
+    blob, context = EntryCodec(shared_context=False).encode(data)
+    assert context is None
+    assert decode_entry(blob, None) == data
+
+# END Test testCoreCodec_Errors
+
+
+@pytest.mark.core
+@pytest.mark.parametrize("backend", ["files", "sqlite"])
+def testCoreCodec_Storage(fncDir, filesDir, backend):
+    """Test encoded entries in each storage backend."""
+    data = readJson(os.path.join(filesDir, "Access_Constraint.json"))
+    other = dict(data, graph=[])
+    storage = open_storage(backend, fncDir, EntryCodec(compression="gzip"))
+    assert storage is not open_storage(backend, fncDir)
+
+    storage.store("mmd", URI, data, {})
+    storage.store("mmd", URI + "2", other, {})
+    metvocab.codec._contexts.clear()
+    assert storage.load("mmd", URI) == data
+    assert storage.load("mmd", URI + "2") == other
+
+    # The context object is shared between entries
+    assert storage.load("mmd", URI)["@context"] is storage.load("mmd", URI + "2")["@context"]
+
+    uris = [uri for _, uri, _ in storage.entries()]
+    assert uris == [URI, URI + "2"]
+
+    if isinstance(storage, FileStorage):
+        jsonFile = storage._entry_path(URI)[1]
+        assert jsonFile.endswith("Access_Constraint.mvc")
+        plainSize = len(readFile(os.path.join(filesDir, "Access_Constraint.json")))
+        assert os.path.getsize(jsonFile) < plainSize/2
+        assert len(os.listdir(os.path.join(fncDir, ".contexts"))) == 1
+    else:
+        assert isinstance(storage, SQLiteStorage)
+        count = storage._connect().execute("SELECT COUNT(*) FROM contexts").fetchone()[0]
+        assert count == 1
+
+        # Plain entries in the same database are still readable
+        plain = open_storage(backend, fncDir)
+        plain.store("mmd", URI + "3", data, {})
+        assert storage.load("mmd", URI + "3") == data
+        assert plain.load("mmd", URI) == data
+
+# END Test testCoreCodec_Storage
+
+
+@pytest.mark.core
+def testCoreCodec_DataCache(fncDir, filesDir, monkeypatch):
+    """Test the encoding settings of the data cache."""
+    data = readJson(os.path.join(filesDir, "Access_Constraint.json"))
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
+
+    assert DataCache().storage.codec is None
+
+    monkeypatch.setenv("METVOCAB_ENCODING", "compact")
+    monkeypatch.setenv("METVOCAB_CODEC", "json")
+    monkeypatch.setenv("METVOCAB_COMPRESSION", "gzip")
+    dtCache = DataCache()
+    assert dtCache.storage.codec.spec == ("json", "gzip", True)
+    monkeypatch.setattr(dtCache, "_retrieve_data", lambda *a: (True, data))
+    assert dtCache._get_data("mmd", URI) == data
+    assert os.path.isfile(os.path.join(fncDir, "vocab.met.no", "mmd", "Access_Constraint.mvc"))
+
+    monkeypatch.setenv("METVOCAB_ENCODING", "nope")
+    with pytest.raises(ValueError):
+        DataCache()
+
+# END Test testCoreCodec_DataCache
+
+
+@pytest.mark.core
+@pytest.mark.parametrize("backend", ["files", "sqlite"])
+def testCoreCodec_Unreadable(fncDir, filesDir, monkeypatch, caplog, backend):
+    """Test that entries that cannot be decoded are fetched again."""
+    data = readJson(os.path.join(filesDir, "Access_Constraint.json"))
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
+    monkeypatch.setenv("METVOCAB_BACKEND", backend)
+    monkeypatch.setenv("METVOCAB_ENCODING", "compact")
+    monkeypatch.setenv("METVOCAB_CODEC", "json")
+    monkeypatch.setenv("METVOCAB_COMPRESSION", "gzip")
+    calls = []
+
+    def mock_retrieve_data(voc_id, uri, validators=None):
+        calls.append(uri)
+        if validators:
+            return True, None
+        return True, data
+
+    dtCache = DataCache()
+    storage = dtCache.storage
+    monkeypatch.setattr(dtCache, "_retrieve_data", mock_retrieve_data)
+    assert dtCache._get_data("mmd", URI) == data
+
+    # Missing shared context
+    metvocab.codec._contexts.clear()
+    if isinstance(storage, FileStorage):
+        ctxDir = os.path.join(fncDir, ".contexts")
+        for name in os.listdir(ctxDir):
+            os.unlink(os.path.join(ctxDir, name))
+    else:
+        with storage._connect() as conn:
+            conn.execute("DELETE FROM contexts")
+    caplog.clear()
+    assert storage.load("mmd", URI) is None
+    assert "Could not read the cache entry of" in caplog.text
+
+    # The cache fetches it again, without the stored validators
+    assert dtCache._get_data("mmd", URI) == data
+    assert calls == [URI, URI]
+
+    # A format that is not available here
+    blob, _ = EntryCodec(codec="json", compression="none").encode({"a": 1})
+    blob = blob.replace(b" json ", b" nope ", 1)
+    with monkeypatch.context() as mp:
+        mp.setattr(storage, "_encode", lambda d: blob)
+        storage.store("mmd", URI, {}, {"etag": "\"abc\""})
+    assert storage.load("mmd", URI) is None
+    assert dtCache._get_data("mmd", URI) == data
+    assert calls == [URI, URI, URI]
+
+# END Test testCoreCodec_Unreadable
@@ -19,6 +19,7 @@ limitations under the License.
 
 import os
 import pytest
+import asyncio
 
 from tools import readJson
 from metvocab.cache import DataCache
@@ -103,7 +104,7 @@ def testCoreMMDGroup_Init(filesDir, monkeypatch):
 
 
 @pytest.mark.core
-def testCoreMMDGroup_Search(filesDir):
+def testCoreMMDGroup_Search(filesDir, monkeypatch):
     """Tests search in group against local files """
     group_data = readJson(os.path.join(filesDir, "Instrument.json"))
     modis_data = readJson(os.path.join(filesDir, "Instrument", "MODIS.json"))
@@ -118,8 +119,10 @@ def testCoreMMDGroup_Search(filesDir):
             return olci_data
         return {}
 
-    group = MMDGroup("mmd", "https://vocab.met.no/mmd/Instrument")
-    group.init_vocab()
+    with monkeypatch.context() as mp:
+        mp.setattr(DataCache, "get_vocab", mock_get_vocab)
+        group = MMDGroup("mmd", "https://vocab.met.no/mmd/Instrument")
+        group.init_vocab()
 
     modis_dict = {
         "Short_Name": "MODIS",
@@ -152,7 +155,7 @@ def testCoreMMDGroup_Search(filesDir):
 
 
 @pytest.mark.core
-def testCoreMMDGroup_SearchLowercase(filesDir):
+def testCoreMMDGroup_SearchLowercase(filesDir, monkeypatch):
     """Tests search in group against local files """
     group_data = readJson(os.path.join(filesDir, "Instrument.json"))
     modis_data = readJson(os.path.join(filesDir, "Instrument", "MODIS.json"))
@@ -167,8 +170,10 @@ def testCoreMMDGroup_SearchLowercase(filesDir):
             return olci_data
         return {}
 
-    group = MMDGroup("mmd", "https://vocab.met.no/mmd/Instrument")
-    group.init_vocab()
+    with monkeypatch.context() as mp:
+        mp.setattr(DataCache, "get_vocab", mock_get_vocab)
+        group = MMDGroup("mmd", "https://vocab.met.no/mmd/Instrument")
+        group.init_vocab()
 
     modis_dict = {
         "Short_Name": "MODIS",
@@ -206,6 +211,90 @@ def testCoreMMDGroup_SearchLowercase(filesDir):
 # END Test testCoreMMDGroup_SearchLowercase
 
 
+@pytest.mark.core
+def testCoreMMDGroup_SearchIndex(recwarn):
+    """Tests the label index used by search"""
+    group = MMDGroup("mmd", "https://vocab.met.no/mmd/Instrument")
+    concepts = [
+        {"uri": "https://vocab.met.no/mmd/A", "prefLabel": {"value": "A"}, "altLabel": "Alpha"},
+        {"uri": "https://vocab.met.no/mmd/B", "prefLabel": {"value": "B"}, "altLabel": "alpha"},
+        {"uri": "https://vocab.met.no/mmd/C", "prefLabel": {"value": "A"}},
+        {"uri": "https://vocab.met.no/mmd/D"},
+    ]
+    group._set_concepts([c["uri"] for c in concepts], concepts)
+    assert group.is_initialised is True
+
+    # First matching concept wins
+    assert group.search("A")["resource"] == "https://vocab.met.no/mmd/A"
+    assert group.search("alpha")["resource"] == "https://vocab.met.no/mmd/B"
+    assert group.search_lowercase("ALPHA")["resource"] == "https://vocab.met.no/mmd/A"
+    assert group.search("B") == {
+        "Short_Name": "B",
+        "short_name": "B",
+        "Long_Name": "alpha",
+        "long_name": "alpha",
+        "Resource": "https://vocab.met.no/mmd/B",
+        "resource": "https://vocab.met.no/mmd/B"
+    }
+
+    # Results are copies
+    group.search("A").clear()
+    assert group.search("A")["short_name"] == "A"
+
+    # Non-string names
+    assert group.search(None) == {}
+    assert group.search(["A"]) == {}
+
+    # The deprecation warning is only emitted once
+    assert group.search("MockSat") == {}
+    assert group.search_lowercase("mocksat") == {}
+    assert group.search("MockSat") == {}
+    assert len(recwarn) == 1
+
+# END Test testCoreMMDGroup_SearchIndex
+
+
+@pytest.mark.core
+def testCoreMMDGroup_SearchPrefix(recwarn):
+    """Tests the prefix and fuzzy search"""
+    group = MMDGroup("mmd", "https://vocab.met.no/mmd/Instrument")
+    assert group.search_prefix("A") == []
+    assert group.suggest("A") == []
+
+    concepts = [
+        {"uri": "https://vocab.met.no/mmd/A", "prefLabel": {"value": "MODIS"},
+         "altLabel": "Moderate Imager"},
+        {"uri": "https://vocab.met.no/mmd/B", "prefLabel": {"value": "MWR"},
+         "altLabel": "Microwave Radiometer"},
+        {"uri": "https://vocab.met.no/mmd/C", "prefLabel": {"value": "OLCI"}},
+    ]
+    group._set_concepts([c["uri"] for c in concepts], concepts)
+
+    # Each concept is returned once, ordered by the first matching label
+    result = group.search_prefix("mo")
+    assert [r["resource"] for r in result] == ["https://vocab.met.no/mmd/A"]
+    assert result[0] == group.search("MODIS")
+    result = group.search_prefix("M")
+    assert [r["short_name"] for r in result] == ["MWR", "MODIS"]
+    assert [r["short_name"] for r in group.search_prefix("M", limit=1)] == ["MWR"]
+    assert group.search_prefix("X") == []
+    assert group.search_prefix(None) == []
+
+    # Closest match first
+    assert [r["short_name"] for r in group.suggest("MODUS")] == ["MODIS"]
+    assert [r["short_name"] for r in group.suggest("olc")] == ["OLCI"]
+    assert [r["short_name"] for r in group.suggest("microwave radiometr")] == ["MWR"]
+    assert [r["short_name"] for r in group.suggest("MWI", max_distance=1)] == ["MWR"]
+    assert group.suggest("MWI", max_distance=0) == []
+
+    # Results are copies
+    group.search_prefix("MODIS")[0].clear()
+    assert group.search_prefix("MODIS")[0]["short_name"] == "MODIS"
+    assert len(recwarn) == 0
+
+# END Test testCoreMMDGroup_SearchPrefix
+
+
 @pytest.mark.core
 def testCoreMMDGroup_GetLabel(monkeypatch):
     """Test helper function for getting labels"""
@@ -289,3 +378,55 @@ def testCoreMMDGroup_GetResource(monkeypatch):
     assert group._get_resource({"resource": ["hello"]}, "resource") == ""
 
 # END Test testCoreMMDGroup_GetResource
+
+
+@pytest.mark.core
+def testCoreMMDGroup_InitWorkers(filesDir, monkeypatch):
+    """Tests that concurrent and async member fetching give the same
+    concepts, in member order, as serial fetching.
+    """
+    group_data = readJson(os.path.join(filesDir, "Instrument.json"))
+    modis_data = readJson(os.path.join(filesDir, "Instrument", "MODIS.json"))
+    olci_data = readJson(os.path.join(filesDir, "Instrument", "OLCI.json"))
+
+    def mock_get_vocab(self, voc_id, uri):
+        if uri == "https://vocab.met.no/mmd/Instrument":
+            return group_data
+        elif uri == "https://vocab.met.no/mmd/Instrument/MODIS":
+            return modis_data
+        elif uri == "https://vocab.met.no/mmd/Instrument/OLCI":
+            return olci_data
+        return {}
+
+    # Worker count from the environment
+    with monkeypatch.context() as mp:
+        mp.setenv("METVOCAB_FETCH_WORKERS", "3")
+        assert MMDGroup("mmd", "https://vocab.met.no/mmd/Instrument")._workers == 3
+        mp.setenv("METVOCAB_FETCH_WORKERS", "0")
+        assert MMDGroup("mmd", "https://vocab.met.no/mmd/Instrument")._workers == 1
+
+    with monkeypatch.context() as mp:
+        mp.setattr(DataCache, "get_vocab", mock_get_vocab)
+
+        serial = MMDGroup("mmd", "https://vocab.met.no/mmd/Instrument", workers=1)
+        serial.init_vocab()
+        assert serial.is_initialised is True
+
+        parallel = MMDGroup("mmd", "https://vocab.met.no/mmd/Instrument", workers=4)
+        parallel.init_vocab()
+        assert parallel.is_initialised is True
+
+        asynced = MMDGroup("mmd", "https://vocab.met.no/mmd/Instrument", workers=4)
+        asyncio.run(asynced.init_vocab_async())
+        assert asynced.is_initialised is True
+
+    assert list(asynced._concepts) == list(serial._concepts)
+    assert asynced._concepts == serial._concepts
+
+    assert list(parallel._concepts) == list(serial._concepts)
+    assert parallel._concepts == serial._concepts
+
+    modis = parallel._concepts["https://vocab.met.no/mmd/Instrument/MODIS"]
+    assert parallel._get_label(modis, "prefLabel") == "MODIS"
+
+# END Test testCoreMMDGroup_InitWorkers
@@ -19,6 +19,7 @@ limitations under the License.
 
 import os
 import pytest
+import asyncio
 
 from tools import readJson
 from metvocab import MMDVocab
@@ -62,6 +63,14 @@ def testCoreMMDVocab_InitVocab(monkeypatch, filesDir):
 
     # Check invalid json?
 
+    # Async initialisation
+    lookup = MMDVocab("mmd", "https://vocab.met.no/mmd/Access_Constraint")
+    with monkeypatch.context() as mp:
+        mp.setattr(lookup._cache, "get_vocab", lambda *a: data)
+        asyncio.run(lookup.init_vocab_async())
+        assert lookup.is_initialised
+        assert lookup.check_concept_value("Open")
+
 # END Test testCoreMMDVocab_InitVocab
 
 
@@ -80,6 +89,20 @@ def testCoreMMDVocab_CheckConceptValue():
 # END Test testCoreMMDVocab_CheckConceptValue
 
 
+@pytest.mark.core
+def testCoreMMDVocab_CheckMany():
+    """Tests the batch lookup functions in lookup class"""
+    lookup = MMDVocab("mmd", "https://vocab.met.no/mmd/Access_Constraint")
+    lookup._concept_values = set(["Open", "Registered users only (automated approval)"])
+
+    values = ["Open", "Closed", 2, "Open"]
+    assert lookup.check_many(values) == [True, False, False, True]
+    assert lookup.filter_valid(values) == ["Open", "Open"]
+    assert lookup.find_invalid(values) == ["Closed", 2]
+
+# END Test testCoreMMDVocab_CheckMany
+
+
 @pytest.mark.core
 def testMMDVocab_CheckIsConcept():
     """Tests check_is_concept function in lookup class"""
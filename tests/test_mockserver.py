@@ -0,0 +1,174 @@
+"""
+MetVocab : Mock Vocabulary Server Tests
+=======================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+import pytest
+
+from tools import readJson
+
+from metvocab.cli import main
+from metvocab.cache import DataCache
+from metvocab.mmdgroup import MMDGroup
+from metvocab.mockserver import MockServer
+from metvocab.transport import get_breaker
+
+ACCESS_URI = "https://vocab.met.no/mmd/Access_Constraint"
+INSTRUMENT_URI = "https://vocab.met.no/mmd/Instrument"
+
+
+@pytest.fixture(scope="function")
+def mockServer(fncDir, filesDir, monkeypatch):
+    """A running mock server with the test files, and a cache pointing
+    to it.
+    """
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
+    monkeypatch.delenv("METVOCAB_BACKEND", raising=False)
+
+    server = MockServer(seed=42)
+    assert server.url is None
+    assert server.add_fixtures(filesDir) == 4
+    with server:
+        monkeypatch.setenv("METVOCAB_API_URL", server.url + "/")
+        yield server
+
+
+@pytest.mark.core
+def testCoreMockServer_Data(mockServer, filesDir):
+    """Test serving entries and groups from fixtures."""
+    cache = DataCache()
+    assert cache._api_url == mockServer.url
+    assert cache.get_vocab("mmd", ACCESS_URI) == readJson(f"{filesDir}/Access_Constraint.json")
+    assert cache.get_vocab("mmd", INSTRUMENT_URI + "/OLCI")["graph"]
+    assert cache.get_vocab("mmd", INSTRUMENT_URI + "/Nope") == {}
+    assert cache.get_vocab("other", "https://vocab.met.no/other/Access_Constraint") == {}
+    assert cache.get_groups("mmd") == [ACCESS_URI, INSTRUMENT_URI]
+    assert cache.get_groups("other") is None
+    assert mockServer.stats == {"requests": 6, 200: 3, 404: 3}
+    assert mockServer.list_uris("mmd") == [
+        ACCESS_URI, INSTRUMENT_URI, INSTRUMENT_URI + "/MODIS", INSTRUMENT_URI + "/OLCI"
+    ]
+
+    # Other paths
+    status, _ = cache._api_request(mockServer.url + "/mmd/concepts")
+    assert status is False
+    status, _ = cache._api_request(mockServer.url.replace("/v1", "/v2") + "/mmd/data")
+    assert status is False
+
+# END Test testCoreMockServer_Data
+
+
+@pytest.mark.core
+def testCoreMockServer_Synthetic(mockServer):
+    """Test generated groups."""
+    groups = mockServer.add_synthetic(groups=2, members=50, prefix="Gen")
+    assert groups == ["https://vocab.met.no/mmd/Gen1", "https://vocab.met.no/mmd/Gen2"]
+    assert DataCache().get_groups("mmd") == [ACCESS_URI] + groups + [INSTRUMENT_URI]
+
+    group = MMDGroup("mmd", groups[1], workers=4)
+    group.init_vocab()
+    assert len(group._concepts) == 50
+    assert group.search("Gen2-00007")["resource"] == groups[1] + "/C00007"
+    assert group.search("Gen 2 concept 50")["short_name"] == "Gen2-00050"
+
+    mockServer.remove_entry("mmd", groups[0])
+    assert DataCache().get_groups("mmd") == [ACCESS_URI] + groups[1:] + [INSTRUMENT_URI]
+
+# END Test testCoreMockServer_Synthetic
+
+
+@pytest.mark.core
+def testCoreMockServer_Conditional(mockServer):
+    """Test ETag and Last-Modified validation."""
+    cache = DataCache()
+    validators = {}
+    status, data = cache._retrieve_data("mmd", ACCESS_URI, validators)
+    assert status is True
+    assert data["graph"]
+    assert validators["etag"].startswith('"')
+    assert validators["last_modified"].endswith("GMT")
+
+    # Unchanged
+    assert cache._retrieve_data("mmd", ACCESS_URI, dict(validators)) == (True, None)
+    assert cache._retrieve_data(
+        "mmd", ACCESS_URI, {"last_modified": validators["last_modified"]}
+    ) == (True, None)
+    assert mockServer.stats[304] == 2
+
+    # Changed
+    mockServer.add_entry("mmd", ACCESS_URI, {"graph": []})
+    newValidators = dict(validators)
+    assert cache._retrieve_data("mmd", ACCESS_URI, newValidators) == (True, {"graph": []})
+    assert newValidators["etag"] != validators["etag"]
+
+    # Adding the same data again does not change the validators
+    mockServer.add_entry("mmd", ACCESS_URI, {"graph": []})
+    assert cache._retrieve_data("mmd", ACCESS_URI, dict(newValidators)) == (True, None)
+
+# END Test testCoreMockServer_Conditional
+
+
+@pytest.mark.core
+def testCoreMockServer_Faults(mockServer):
+    """Test injected latency, errors and rate limits."""
+    cache = DataCache()
+
+    mockServer.latency = 0.1
+    start = time.monotonic()
+    assert cache._retrieve_data("mmd", ACCESS_URI)[0] is True
+    assert time.monotonic() - start >= 0.1
+    mockServer.latency = 0.0
+
+    mockServer.error_rate = 1.0
+    mockServer.error_codes = (503,)
+    assert cache._retrieve_data("mmd", ACCESS_URI) == (False, {})
+    assert mockServer.stats[503] == 1
+    mockServer.error_rate = 0.0
+    get_breaker().reset()
+
+    mockServer.rate_limit = 2
+    results = [cache._retrieve_data("mmd", ACCESS_URI)[0] for _ in range(4)]
+    assert results == [True, True, False, False]
+    assert mockServer.stats[429] == 2
+    time.sleep(0.6)
+    assert cache._retrieve_data("mmd", ACCESS_URI)[0] is True
+
+# END Test testCoreMockServer_Faults
+
+
+@pytest.mark.core
+def testCoreMockServer_Cli(filesDir, monkeypatch, capsys):
+    """Test the mockserver command."""
+    started = []
+
+    def mockServeForever(self):
+        self.start()
+        started.append(self.stats)
+        self.stop()
+
+    monkeypatch.setattr(MockServer, "serve_forever", mockServeForever)
+    assert main([
+        "mockserver", "--port", "0", "--fixtures", filesDir, "--groups", "2", "--members", "10",
+        "--latency", "0.01", "--error-rate", "0.1", "--rate-limit", "100",
+    ]) == 0
+    out = capsys.readouterr().out
+    assert "Serving 26 entries on http://127.0.0.1:" in out
+    assert "METVOCAB_API_URL=http://127.0.0.1:" in out
+    assert started == [{}]
+
+# END Test testCoreMockServer_Cli
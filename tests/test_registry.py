@@ -0,0 +1,254 @@
+"""
+MetVocab : Vocabulary Registry Tests
+====================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import pytest
+import threading
+
+import metvocab
+
+from tools import readJson
+
+from metvocab.cache import DataCache
+from metvocab.cfstd import CFStandard
+from metvocab.mmdgroup import MMDGroup
+from metvocab.mmdvocab import MMDVocab
+from metvocab.registry import VocabRegistry
+
+ACCESS_URI = "https://vocab.met.no/mmd/Access_Constraint"
+
+
+@pytest.fixture(scope="function")
+def mockVocab(filesDir, fncDir, monkeypatch):
+    """Mock the cache to return the local Access_Constraint file, and
+    count the calls.
+    """
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
+    data = readJson(os.path.join(filesDir, "Access_Constraint.json"))
+    calls = []
+
+    def mock_get_vocab(self, voc_id, uri):
+        calls.append(uri)
+        return data if uri == ACCESS_URI else {}
+
+    monkeypatch.setattr(DataCache, "get_vocab", mock_get_vocab)
+    return calls
+
+
+def joinRefresh(registry):
+    """Wait for any running background refresh."""
+    for thread in list(registry._refreshing.values()):
+        thread.join()
+
+
+@pytest.mark.core
+def testCoreRegistry_Shared(mockVocab):
+    """Test that instances are shared and only initialised once."""
+    registry = VocabRegistry()
+
+    vocab = registry.get_vocab("mmd", ACCESS_URI)
+    assert vocab.is_initialised is True
+    assert registry.get_vocab("mmd", ACCESS_URI) is vocab
+    assert mockVocab == [ACCESS_URI]
+
+    group = registry.get_group("mmd", ACCESS_URI)
+    assert registry.get_group("mmd", ACCESS_URI) is group
+    assert group is not vocab
+
+    cfstd = registry.get_cfstd()
+    assert cfstd.is_initialised is True
+    assert registry.get_cfstd() is cfstd
+
+    registry.clear()
+    assert registry.get_vocab("mmd", ACCESS_URI) is not vocab
+
+    # Module level registry
+    assert metvocab.get_vocab("mmd", ACCESS_URI) is metvocab.get_vocab("mmd", ACCESS_URI)
+    assert metvocab.get_group("mmd", ACCESS_URI) is metvocab.get_group("mmd", ACCESS_URI)
+    assert metvocab.get_cfstd() is metvocab.get_cfstd()
+
+# END Test testCoreRegistry_Shared
+
+
+@pytest.mark.core
+def testCoreRegistry_Threads(mockVocab):
+    """Test that concurrent lookups create a single instance."""
+    registry = VocabRegistry()
+    results = []
+
+    def lookup():
+        results.append(registry.get_vocab("mmd", ACCESS_URI))
+
+    threads = [threading.Thread(target=lookup) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 8
+    assert all(result is results[0] for result in results)
+    assert mockVocab == [ACCESS_URI]
+
+# END Test testCoreRegistry_Threads
+
+
+@pytest.mark.core
+def testCoreRegistry_Refresh(mockVocab, monkeypatch, caplog):
+    """Test the background refresh of expired instances."""
+    registry = VocabRegistry(max_age=3600)
+    vocab = registry.get_vocab("mmd", ACCESS_URI)
+    cfstd = registry.get_cfstd()
+
+    # Expire the entries
+    for key, (loaded, instance) in list(registry._entries.items()):
+        registry._entries[key] = (loaded - 7200, instance)
+
+    # The old instance is returned while refreshing
+    assert registry.get_vocab("mmd", ACCESS_URI) is vocab
+    joinRefresh(registry)
+    newVocab = registry.get_vocab("mmd", ACCESS_URI)
+    assert newVocab is not vocab
+    assert newVocab.is_initialised is True
+    assert len(mockVocab) == 2
+
+    # CF data is not refreshed
+    assert registry.get_cfstd() is cfstd
+    assert registry._refreshing == {}
+
+    # A failed refresh keeps the old instance
+    key = ("MMDVocab", "mmd", ACCESS_URI)
+    registry._entries[key] = (0.0, newVocab)
+    monkeypatch.setattr(DataCache, "get_vocab", lambda *a: {})
+    caplog.clear()
+    assert registry.get_vocab("mmd", ACCESS_URI) is newVocab
+    joinRefresh(registry)
+    assert registry.get_vocab("mmd", ACCESS_URI) is newVocab
+    assert "Could not refresh MMDVocab" in caplog.text
+    assert registry._entries[key][0] > 0.0
+
+    # An exception is logged
+    registry._entries[key] = (0.0, newVocab)
+
+    def causeError(*a):
+        raise ValueError("Oops")
+
+    monkeypatch.setattr(DataCache, "get_vocab", causeError)
+    caplog.clear()
+    assert registry.get_vocab("mmd", ACCESS_URI) is newVocab
+    joinRefresh(registry)
+    assert "Refreshing MMDVocab failed: Oops" in caplog.text
+    assert registry._refreshing == {}
+
+    # Max age from the cache settings
+    monkeypatch.setenv("METVOCAB_MAXAGE", "2")
+    assert VocabRegistry()._get_max_age() == 2*86400
+
+# END Test testCoreRegistry_Refresh
+
+
+@pytest.mark.core
+def testCoreRegistry_Retry(mockVocab, monkeypatch, caplog):
+    """Test that instances that could not be initialised are retried."""
+    registry = VocabRegistry(max_age=3600)
+    key = ("MMDVocab", "mmd", ACCESS_URI)
+    working = DataCache.get_vocab
+    monkeypatch.setattr(DataCache, "get_vocab", lambda *a: {})
+
+    # The failed instance is returned, but stored as expired
+    caplog.clear()
+    vocab = registry.get_vocab("mmd", ACCESS_URI)
+    assert vocab.is_initialised is False
+    assert registry._entries[key][0] == 0.0
+    assert "Could not initialise MMDVocab" in caplog.text
+
+    # A failed refresh of a failed instance stays expired
+    assert registry.get_vocab("mmd", ACCESS_URI) is vocab
+    joinRefresh(registry)
+    failed = registry.get_vocab("mmd", ACCESS_URI)
+    joinRefresh(registry)
+    assert failed.is_initialised is False
+    assert registry._entries[key][0] == 0.0
+
+    # When the API recovers, the next lookup refreshes it
+    monkeypatch.setattr(DataCache, "get_vocab", working)
+    registry.get_vocab("mmd", ACCESS_URI)
+    joinRefresh(registry)
+    newVocab = registry.get_vocab("mmd", ACCESS_URI)
+    assert newVocab.is_initialised is True
+    assert registry._entries[key][0] > 0.0
+
+    # Also for instances that are never refreshed
+    registry._entries[("CFStandard",)] = (0.0, registry.get_cfstd())
+    registry.get_cfstd()
+    joinRefresh(registry)
+    assert registry._entries[("CFStandard",)][0] > 0.0
+
+    registry.clear()
+    assert registry._entries == {}
+    assert registry._key_locks == {}
+
+# END Test testCoreRegistry_Retry
+
+
+@pytest.mark.core
+def testCoreRegistry_InitShared(filesDir, fncDir, monkeypatch):
+    """Test that a shared instance is never seen empty while init_vocab
+    is called on it again.
+    """
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
+    groupUri = "https://vocab.met.no/mmd/Instrument"
+    files = {
+        ACCESS_URI: os.path.join(filesDir, "Access_Constraint.json"),
+        groupUri: os.path.join(filesDir, "Instrument.json"),
+        groupUri + "/MODIS": os.path.join(filesDir, "Instrument", "MODIS.json"),
+    }
+    monkeypatch.setattr(
+        DataCache, "get_vocab",
+        lambda self, voc_id, uri: readJson(files[uri]) if uri in files else {}
+    )
+
+    registry = VocabRegistry()
+    vocab = registry.get_vocab("mmd", ACCESS_URI)
+    group = registry.get_group("mmd", groupUri)
+    cfstd = registry.get_cfstd()
+    seen = []
+
+    def check(method):
+        def wrapper(*args):
+            seen.append((
+                vocab.check_concept_value("Open"),
+                group.search("MODIS") != {},
+                cfstd.check_standard_name("air_temperature"),
+            ))
+            return method(*args)
+        return wrapper
+
+    # Check the shared instances in the middle of initialising them
+    monkeypatch.setattr(MMDVocab, "_check_is_concept", check(MMDVocab._check_is_concept))
+    monkeypatch.setattr(MMDGroup, "_get_label", check(MMDGroup._get_label))
+    monkeypatch.setattr(CFStandard, "_file_checksum", check(CFStandard._file_checksum))
+
+    vocab.init_vocab()
+    group.init_vocab()
+    cfstd.init_vocab(rich=True)
+    assert len(seen) > 3
+    assert all(result == (True, True, True) for result in seen)
+    assert cfstd.get_canonical_units("air_temperature") == "K"
+
+# END Test testCoreRegistry_InitShared
@@ -0,0 +1,149 @@
+"""
+MetVocab : Label Search Index Tests
+===================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import pytest
+
+from metvocab.search import SearchIndex, TokenIndex, intersect, _common_prefix
+
+
+def levenshtein(a, b):
+    """Plain reference implementation of the edit distance."""
+    row = list(range(len(b) + 1))
+    for i, a_char in enumerate(a, 1):
+        new = [i]
+        for j, b_char in enumerate(b, 1):
+            new.append(min(new[j - 1] + 1, row[j] + 1, row[j - 1] + (a_char != b_char)))
+        row = new
+    return row[-1]
+
+
+@pytest.mark.core
+def testCoreSearch_Prefix():
+    """Test the prefix search."""
+    index = SearchIndex([
+        ("MODIS", "modis"), ("Moderate Imager", "modis"), ("MWR", "mwr"),
+        ("OLCI", "olci"), (None, "none"), ("mod", "mod"),
+    ])
+    assert len(index) == 5
+    assert index.prefix("mod") == ["mod", "modis"]
+    assert index.prefix("MODI") == ["modis"]
+    assert index.prefix("m") == ["mod", "modis", "mwr"]
+    assert index.prefix("m", limit=2) == ["mod", "modis"]
+    assert index.prefix("") == ["mod", "modis", "mwr", "olci"]
+    assert index.prefix("x") == []
+    assert index.prefix("z") == []
+    assert index.prefix(None) == []
+    assert SearchIndex().prefix("a") == []
+
+    # Equal values are only returned once
+    modis = {"short_name": "MODIS", "resource": "modis"}
+    index = SearchIndex([
+        ("MODIS", "".join(["mo", "dis"])), ("Moderate Imager", "modis"),
+        ("MODIS", modis), ("Moderate", dict(modis)), ("Mode", {"a": [1]}),
+    ])
+    assert index.prefix("mod") == [{"a": [1]}, modis, "modis"]
+
+# END Test testCoreSearch_Prefix
+
+
+@pytest.mark.core
+def testCoreSearch_Suggest():
+    """Test the fuzzy search against a plain edit distance."""
+    words = [
+        "air_temperature", "air_pressure", "sea_surface_temperature", "sea_water_temperature",
+        "sea_water_salinity", "surface_temperature", "temperature", "tempera", "a", "ab", "",
+        "air_temperature", "eastward_wind", "northward_wind", "wind_speed",
+    ]
+    index = SearchIndex((word, word) for word in words)
+    queries = [
+        "air_temperatur", "Air_Temperature", "sea_water_temprature", "wind", "windspeed",
+        "", "b", "temperature", "xyz", "northwardwind",
+    ]
+    for query in queries:
+        for max_distance in range(4):
+            expected = sorted(
+                (levenshtein(query.lower(), word), word) for word in set(words)
+                if levenshtein(query.lower(), word) <= max_distance
+            )
+            result = index.suggest(query, max_distance=max_distance, limit=None)
+            assert result == [word for _, word in expected], (query, max_distance)
+
+    assert index.suggest("air_temperatur")[0] == "air_temperature"
+    assert index.suggest("ai", limit=2) == ["a", "ab"]
+    assert index.suggest(None) == []
+    assert SearchIndex().suggest("a") == []
+
+    assert _common_prefix("abc", "abd") == 2
+    assert _common_prefix("", "abd") == 0
+    assert _common_prefix("ab", "ab") == 2
+
+# END Test testCoreSearch_Suggest
+
+
+@pytest.mark.core
+def testCoreSearch_Tokens():
+    """Test the token index queries."""
+    names = [
+        "sea_water_temperature", "sea_surface_temperature", "air_temperature",
+        "sea_water_salinity", "water_sea_temperature", "surface_air_pressure", None,
+        "sea_water_temperature",
+    ]
+    index = TokenIndex(names)
+    assert len(index) == 6
+    assert index.count("sea") == 4
+    assert index.count("Temperature") == 4
+    assert index.count("nope") == 0
+
+    # AND
+    assert index.query(["sea", "temperature"]) == [
+        "sea_surface_temperature", "sea_water_temperature", "water_sea_temperature"
+    ]
+    assert index.query("sea_water temperature") == ["sea_water_temperature"]
+    assert index.query(["SEA_WATER"]) == ["sea_water_salinity", "sea_water_temperature"]
+    assert index.query(["water_temperature"]) == ["sea_water_temperature"]
+    assert index.query(["sea", "nope"]) == []
+    assert index.query("sea_nope") == []
+
+    # OR
+    assert index.query("salinity pressure", match="any") == [
+        "sea_water_salinity", "surface_air_pressure"
+    ]
+    assert index.query(["air", "nope"], match="any") == [
+        "air_temperature", "surface_air_pressure"
+    ]
+
+    # Empty and invalid queries
+    assert index.query("") == []
+    assert index.query(["_"]) == []
+    assert index.query([None]) == []
+    with pytest.raises(ValueError):
+        index.query("sea", match="some")
+
+    # Other separators
+    assert TokenIndex(["a-b-c", "b-c"], separator="-").query("b-c a") == ["a-b-c"]
+
+    # Intersections
+    assert intersect([]) == []
+    assert intersect([[1, 2, 3]]) == [1, 2, 3]
+    assert intersect([[1, 3, 5, 7, 9], [3, 4, 9], [0, 3, 9, 10]]) == [3, 9]
+    assert intersect([[1, 2], [3, 4]]) == []
+    assert intersect([[5], [1, 2, 3]]) == []
+    assert intersect([[2, 4], [], [2]]) == []
+
+# END Test testCoreSearch_Tokens
@@ -0,0 +1,336 @@
+"""
+MetVocab : Cache Storage Tests
+==============================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import pytest
+import sqlite3
+import threading
+
+from tools import causeOSError, readFile, writeFile
+
+from metvocab.cache import DataCache
+import metvocab.storage
+
+from metvocab.codec import EntryCodec
+from metvocab.storage import (
+    CacheStorage, FileStorage, SQLiteStorage, open_storage, SQLITE_FILE
+)
+
+URI_A = "https://vocab.met.no/mmd/Access_Constraint"
+URI_B = "https://vocab.met.no/mmd/Platform"
+
+
+@pytest.fixture(scope="function", params=["files", "sqlite"])
+def tstStorage(request, fncDir):
+    """A storage of each backend in a temporary folder."""
+    return open_storage(request.param, fncDir)
+
+
+@pytest.mark.core
+def testCoreStorage_Entries(tstStorage):
+    """Test storing, loading and touching entries."""
+    assert tstStorage.fetched("mmd", URI_A) is None
+    assert tstStorage.load("mmd", URI_A) is None
+    assert tstStorage.load_validators("mmd", URI_A) == {}
+
+    before = time.time()
+    tstStorage.store("mmd", URI_A, {"a": 1}, {"etag": "\"abc\""})
+    tstStorage.store("mmd", URI_B, {"b": 2}, {})
+    assert tstStorage.fetched("mmd", URI_A) >= before - 1
+    assert tstStorage.load("mmd", URI_A) == {"a": 1}
+    assert tstStorage.load("mmd", URI_B) == {"b": 2}
+    assert tstStorage.load_validators("mmd", URI_A) == {"etag": "\"abc\""}
+    assert tstStorage.load_validators("mmd", URI_B) == {}
+
+    # Replacing an entry without validators removes the old ones
+    tstStorage.store("mmd", URI_A, {"a": 3}, {})
+    assert tstStorage.load("mmd", URI_A) == {"a": 3}
+    assert tstStorage.load_validators("mmd", URI_A) == {}
+
+    uris = [uri for _, uri, _ in tstStorage.entries()]
+    assert uris == [URI_A, URI_B]
+
+    with pytest.raises(ValueError):
+        tstStorage.fetched("mmd", "https://met.no")
+
+# END Test testCoreStorage_Entries
+
+
+@pytest.mark.core
+def testCoreStorage_Expire(tstStorage, monkeypatch):
+    """Test removing old entries."""
+    tstStorage.store("mmd", URI_B, {"b": 2}, {})
+    with monkeypatch.context() as mp:
+        mp.setattr(time, "time", lambda: 100.0)
+        tstStorage.store("mmd", URI_A, {"a": 1}, {})
+        if isinstance(tstStorage, FileStorage):
+            os.utime(tstStorage._entry_path(URI_A)[1], (100, 100))
+
+    assert tstStorage.expire(86400) == 1
+    assert tstStorage.fetched("mmd", URI_A) is None
+    assert tstStorage.load("mmd", URI_B) == {"b": 2}
+    assert tstStorage.expire(86400) == 0
+
+    # Touching an old entry keeps it
+    with monkeypatch.context() as mp:
+        mp.setattr(time, "time", lambda: 100.0)
+        tstStorage.store("mmd", URI_A, {"a": 1}, {})
+    if isinstance(tstStorage, FileStorage):
+        os.utime(tstStorage._entry_path(URI_A)[1], (100, 100))
+    tstStorage.touch("mmd", URI_A)
+    assert tstStorage.expire(86400) == 0
+
+# END Test testCoreStorage_Expire
+
+
+@pytest.mark.core
+def testCoreStorage_Lock(tstStorage):
+    """Test the entry lock of each backend."""
+    pytest.importorskip("fcntl")
+    with tstStorage.lock("mmd", URI_A) as locked:
+        assert locked is True
+        with tstStorage.lock("mmd", URI_A, blocking=False) as other:
+            assert other is False
+        with tstStorage.lock("mmd", URI_B, blocking=False) as other:
+            assert other is True
+    with tstStorage.lock("mmd", URI_A, blocking=False) as locked:
+        assert locked is True
+
+# END Test testCoreStorage_Lock
+
+
+@pytest.mark.core
+def testCoreStorage_LockFiles(tstStorage, fncDir, monkeypatch):
+    """Test that unused lock files of missing entries are removed, and
+    that an entry is not locked if the lock file cannot be made.
+    """
+    pytest.importorskip("fcntl")
+    uriC = "https://vocab.met.no/mmd/Instrument"
+    tstStorage.store("mmd", URI_A, {"a": 1}, {})
+    for uri in (URI_A, URI_B, uriC):
+        with tstStorage.lock("mmd", uri):
+            pass
+    lockA, lockB, lockC = [tstStorage._lock_file("mmd", uri) for uri in (URI_A, URI_B, uriC)]
+    assert all(os.path.isfile(lock) for lock in (lockA, lockB, lockC))
+
+    # Only the unused lock file of a missing entry is removed
+    with tstStorage.lock("mmd", uriC) as locked:
+        assert locked is True
+        assert tstStorage.expire(86400) == 0
+        assert os.path.isfile(lockA)
+        assert not os.path.isfile(lockB)
+        assert os.path.isfile(lockC)
+    tstStorage.expire(86400)
+    assert not os.path.isfile(lockC)
+
+    # A removed lock file is made again
+    with tstStorage.lock("mmd", URI_B) as locked:
+        assert locked is True
+        assert os.path.isfile(lockB)
+
+    # The lock file cannot be made
+    badFile = os.path.join(fncDir, "file")
+    writeFile(badFile, "")
+    monkeypatch.setattr(tstStorage, "_lock_file", lambda *a: os.path.join(badFile, "x.lock"))
+    with tstStorage.lock("mmd", URI_A) as locked:
+        assert locked is False
+    with tstStorage.lock("mmd", URI_A, blocking=False) as locked:
+        assert locked is False
+
+    # A stale entry is then used as it is
+    calls = []
+    dtCache = DataCache(storage=tstStorage)
+    monkeypatch.setattr(dtCache, "_retrieve_data", lambda *a: calls.append(a) or (True, {}))
+    monkeypatch.setattr(dtCache, "_check_timestamp", lambda *a: True)
+    assert dtCache._get_data("mmd", URI_A) == {"a": 1}
+    assert calls == []
+
+# END Test testCoreStorage_LockFiles
+
+
+@pytest.mark.core
+def testCoreStorage_SQLite(fncDir):
+    """Test the SQLite specific behaviour."""
+    storage = open_storage("sqlite", fncDir)
+    assert isinstance(storage, SQLiteStorage)
+    assert storage.location == os.path.join(fncDir, SQLITE_FILE)
+    assert open_storage("sqlite", fncDir) is storage
+
+    conn = sqlite3.connect(storage.location)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    indexes = [row[1] for row in conn.execute("PRAGMA index_list(entries)")]
+    assert "entries_fetched" in indexes
+    conn.close()
+
+    # The vocabulary id is part of the key
+    storage.store("mmd", URI_A, {"a": 1}, {})
+    assert storage.load("other", URI_A) is None
+
+    # Each thread has its own connection
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(data=storage.load("mmd", URI_A)))
+    thread.start()
+    thread.join()
+    assert result["data"] == {"a": 1}
+
+    storage.close()
+    assert storage.load("mmd", URI_A) == {"a": 1}
+
+    with pytest.raises(ValueError):
+        open_storage("nope", fncDir)
+
+# END Test testCoreStorage_SQLite
+
+
+@pytest.mark.core
+def testCoreStorage_Replaced(fncDir):
+    """Test that the SQLite storage reconnects when the database file
+    is removed or replaced.
+    """
+    storage = open_storage("sqlite", fncDir)
+    storage.store("mmd", URI_A, {"a": 1}, {})
+    assert storage.load("mmd", URI_A) == {"a": 1}
+
+    # Replaced by a new database at the same path
+    for name in os.listdir(fncDir):
+        if name.startswith(SQLITE_FILE):
+            os.unlink(os.path.join(fncDir, name))
+    other = SQLiteStorage(storage.location)
+    other.store("mmd", URI_B, {"b": 2}, {})
+    assert open_storage("sqlite", fncDir) is storage
+    assert storage.load("mmd", URI_A) is None
+    assert storage.load("mmd", URI_B) == {"b": 2}
+    other.close()
+
+    # Removed, a new database is created on the next use
+    storage.close()
+    for name in os.listdir(fncDir):
+        if name.startswith(SQLITE_FILE):
+            os.unlink(os.path.join(fncDir, name))
+    storage.load("mmd", URI_B)
+    assert storage.fetched("mmd", URI_B) is None
+    storage.store("mmd", URI_A, {"a": 3}, {})
+    assert SQLiteStorage(storage.location).load("mmd", URI_A) == {"a": 3}
+
+# END Test testCoreStorage_Replaced
+
+
+@pytest.mark.core
+def testCoreStorage_Interface(fncDir):
+    """Test that incomplete backends cannot be created."""
+    with pytest.raises(TypeError):
+        CacheStorage()
+
+    class PartialStorage(CacheStorage):
+        def load(self, voc_id, uri):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialStorage()
+
+    # All abstract methods implemented
+    names = ["fetched", "load_validators", "store", "touch", "entries", "expire", "_lock_file"]
+    methods = {name: PartialStorage.load for name in names}
+    methods["location"] = fncDir
+    storage = type("CompleteStorage", (PartialStorage,), methods)()
+    assert storage.location == fncDir
+    assert storage.codec is None
+
+# END Test testCoreStorage_Interface
+
+
+@pytest.mark.core
+def testCoreStorage_Permissions(fncDir, monkeypatch):
+    """Test that cache files are readable by others, as with open()."""
+    monkeypatch.setattr(metvocab.storage, "_umask", 0o022)
+    storage = FileStorage(fncDir, codec=EntryCodec(compression="gzip"))
+    storage.store("mmd", URI_A, {"@context": {"a": "b"}, "graph": []}, {"etag": "\"abc\""})
+
+    paths = []
+    for root, _, files in os.walk(fncDir):
+        paths.extend(os.path.join(root, name) for name in files)
+    assert len(paths) == 3
+    assert {os.stat(path).st_mode & 0o777 for path in paths} == {0o644}
+
+    monkeypatch.setattr(metvocab.storage, "_umask", 0o077)
+    storage.store("mmd", URI_B, {}, {})
+    mmdDir = os.path.join(fncDir, "vocab.met.no", "mmd")
+    platform = [name for name in os.listdir(mmdDir) if name.startswith("Platform")]
+    assert os.stat(os.path.join(mmdDir, platform[0])).st_mode & 0o777 == 0o600
+
+    # The umask is read without changing it
+    umask = os.umask(0o027)
+    try:
+        monkeypatch.setattr(metvocab.storage, "_umask", None)
+        with monkeypatch.context() as mp:
+            mp.setattr(os, "umask", causeOSError)
+            hasUmask = os.path.isfile("/proc/self/status") and \
+                "Umask:" in readFile("/proc/self/status")
+            expected = 0o027 if hasUmask else metvocab.storage.DEFAULT_UMASK
+            assert metvocab.storage._get_umask() == expected
+    finally:
+        os.umask(umask)
+
+# END Test testCoreStorage_Permissions
+
+
+@pytest.mark.core
+def testCoreStorage_DataCache(fncDir, monkeypatch):
+    """Test the data cache with the SQLite backend."""
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
+    monkeypatch.setenv("METVOCAB_BACKEND", "sqlite")
+    calls = []
+
+    def mock_retrieve_data(voc_id, uri, validators=None):
+        calls.append(uri)
+        if validators:
+            return True, None
+        validators["etag"] = "\"abc\""
+        return True, {voc_id: uri}
+
+    dtCache = DataCache()
+    assert isinstance(dtCache.storage, SQLiteStorage)
+    monkeypatch.setattr(dtCache, "_retrieve_data", mock_retrieve_data)
+
+    assert dtCache.get_vocab("mmd", URI_A) == {"mmd": URI_A}
+    assert dtCache._get_data("mmd", URI_A) == {"mmd": URI_A}
+    assert calls == [URI_A]
+    assert SQLITE_FILE in os.listdir(fncDir)
+    assert "vocab.met.no" not in os.listdir(fncDir)
+
+    # A stale entry is revalidated
+    with monkeypatch.context() as mp:
+        mp.setattr(dtCache, "_check_timestamp", lambda *a: True)
+        assert dtCache._get_data("mmd", URI_A) == {"mmd": URI_A}
+        assert calls == [URI_A, URI_A]
+
+    # Bulk expiry
+    assert dtCache.expire() == 0
+    now = time.time()
+    with monkeypatch.context() as mp:
+        mp.setattr(time, "time", lambda: now + 10)
+        assert dtCache.expire(5) == 1
+    assert dtCache.storage.fetched("mmd", URI_A) is None
+
+    # A storage can be passed in
+    storage = FileStorage(fncDir)
+    assert DataCache(storage=storage).storage is storage
+
+# END Test testCoreStorage_DataCache
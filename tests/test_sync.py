@@ -0,0 +1,146 @@
+"""
+MetVocab : Cache Synchronisation Tests
+======================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import json
+import pytest
+import subprocess
+
+from tools import readJson
+
+from metvocab.cli import main
+from metvocab.cache import DataCache, clear_memory_cache, clear_negative_cache
+from metvocab.sync import sync, group_uri
+
+INSTRUMENT_URI = "https://vocab.met.no/mmd/Instrument"
+
+
+@pytest.fixture(scope="function")
+def mockApi(fncDir, filesDir, monkeypatch):
+    """Serve the Instrument group and two of its members from the test
+    files, and count the API calls.
+    """
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
+    files = {
+        INSTRUMENT_URI: os.path.join(filesDir, "Instrument.json"),
+        INSTRUMENT_URI + "/MODIS": os.path.join(filesDir, "Instrument", "MODIS.json"),
+        INSTRUMENT_URI + "/OLCI": os.path.join(filesDir, "Instrument", "OLCI.json"),
+    }
+    calls = []
+
+    def mock_retrieve_data(self, voc_id, uri, validators=None):
+        calls.append(uri)
+        if uri in files:
+            return True, readJson(files[uri])
+        return False, {}
+
+    def mock_get_groups(self, voc_id):
+        return [INSTRUMENT_URI]
+
+    monkeypatch.setattr(DataCache, "_retrieve_data", mock_retrieve_data)
+    monkeypatch.setattr(DataCache, "get_groups", mock_get_groups)
+
+    return calls
+
+
+@pytest.mark.core
+def testCoreSync_Sync(mockApi):
+    """Test downloading a group and its members."""
+    members = DataCache().get_vocab("mmd", INSTRUMENT_URI)["graph"][1]["skos:member"]
+    nMembers = len(members)
+    clear_memory_cache()
+    DataCache().storage.expire(-1)
+    mockApi.clear()
+
+    report = sync("mmd", groups=["Instrument"], workers=4)
+    assert report.downloaded == 3
+    assert report.cached == 0
+    assert len(report.failed) == nMembers - 2
+    assert report.total == nMembers + 1
+    assert report.rate > 0.0
+    assert INSTRUMENT_URI + "/MODIS" not in report.failed
+    assert len(mockApi) == nMembers + 1
+    assert "Synced %d entries (3 downloaded, 0 cached" % (nMembers + 1) in str(report)
+
+    # Everything cached is not downloaded again
+    mockApi.clear()
+    clear_negative_cache()
+    report = sync("mmd", all_groups=True, uris=[INSTRUMENT_URI + "/OLCI"])
+    assert report.downloaded == 0
+    assert report.cached == 3
+    assert INSTRUMENT_URI not in mockApi
+    assert INSTRUMENT_URI + "/OLCI" not in mockApi
+
+    data = report.as_dict()
+    assert data["cached"] == 3
+    assert data["total"] == report.total
+    assert sorted(data) == ["cached", "downloaded", "elapsed", "failed", "rate", "total"]
+
+    # Group names
+    assert group_uri("mmd", "Platform") == "https://vocab.met.no/mmd/Platform"
+    assert group_uri("mmd", INSTRUMENT_URI) == INSTRUMENT_URI
+
+# END Test testCoreSync_Sync
+
+
+@pytest.mark.core
+def testCoreSync_GroupsFailed(mockApi, monkeypatch):
+    """Test that a failed group listing is reported."""
+    monkeypatch.setattr(DataCache, "get_groups", lambda *a: None)
+    report = sync("mmd", all_groups=True)
+    assert report.failed == ["mmd"]
+
+# END Test testCoreSync_GroupsFailed
+
+
+@pytest.mark.core
+def testCoreSync_Cli(mockApi, capsys):
+    """Test the sync command."""
+    uri = INSTRUMENT_URI + "/MODIS"
+    assert main(["sync", "--uri", uri]) == 0
+    assert "Synced 1 entries (1 downloaded, 0 cached, 0 failed)" in capsys.readouterr().out
+
+    assert main(["sync", "--uri", uri, "--cf", "--json"]) == 0
+    result = json.loads(capsys.readouterr().out)
+    assert result["cached"] == 1
+    assert result["cf_snapshot"] is True
+
+    assert main(["sync", "--uri", INSTRUMENT_URI + "/MWR"]) == 1
+
+    with pytest.raises(SystemExit):
+        main(["sync"])
+    with pytest.raises(SystemExit):
+        main(["--version"])
+    assert main([]) == 2
+
+# END Test testCoreSync_Cli
+
+
+@pytest.mark.core
+def testCoreSync_Module(rootDir):
+    """Test running the package as a module."""
+    result = subprocess.run(
+        [sys.executable, "-m", "metvocab", "--version"], cwd=rootDir,
+        capture_output=True, text=True
+    )
+    assert result.returncode == 0
+    assert result.stdout.startswith("metvocab ")
+
+# END Test testCoreSync_Module
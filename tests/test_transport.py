@@ -0,0 +1,325 @@
+"""
+MetVocab : HTTP Transport Tests
+===============================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import time
+import base64
+import pytest
+import threading
+import http.client
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metvocab.transport
+
+from metvocab.transport import (
+    HTTPPool, CircuitBreaker, RetryPolicy, get_pool, set_pool, get_retry_policy, set_retry_policy
+)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Keep-alive request handler returning the request path as JSON."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.startswith("/moved"):
+            self.send_response(301)
+            self.send_header("Location", "/target")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path.startswith("/missing"):
+            self.send_error(404, "Not Found")
+            return
+        data = {"path": self.path}
+        if "Proxy-Authorization" in self.headers:
+            data["auth"] = self.headers["Proxy-Authorization"]
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path.startswith("/drop"):
+            # Close without telling the client
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="function")
+def httpServer():
+    """A local keep-alive HTTP server running in a thread."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%d" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.core
+def testCoreTransport_Pool(httpServer):
+    """Test that connections are reused between requests."""
+    pool = HTTPPool(size=2, timeout=5, connect_timeout=2)
+    assert pool.size == 2
+    assert pool.timeout == 5.0
+    assert pool.connect_timeout == 2.0
+
+    for i in range(5):
+        resp = pool.urlopen(urllib.request.Request(f"{httpServer}/data?uri={i}"))
+        assert resp.status == 200
+        assert resp.code == 200
+        assert json.loads(resp.read()) == {"path": f"/data?uri={i}"}
+        assert resp.getheader("Content-Type") == "application/json"
+
+    assert pool.stats == {"opened": 1, "reused": 4, "idle": 1}
+
+    pool.clear()
+    assert pool.stats["idle"] == 0
+
+    # A new connection is opened after clearing
+    pool.urlopen(urllib.request.Request(f"{httpServer}/data"))
+    assert pool.stats["opened"] == 2
+
+# END Test testCoreTransport_Pool
+
+
+@pytest.mark.core
+def testCoreTransport_Errors(httpServer):
+    """Test redirects and error handling."""
+    pool = HTTPPool(size=1, timeout=5)
+
+    # Redirect
+    resp = pool.urlopen(urllib.request.Request(f"{httpServer}/moved"))
+    assert resp.status == 200
+    assert resp.url == f"{httpServer}/target"
+    assert json.loads(resp.read()) == {"path": "/target"}
+
+    # HTTP Error
+    with pytest.raises(urllib.error.HTTPError) as err:
+        pool.urlopen(urllib.request.Request(f"{httpServer}/missing"))
+    assert err.value.code == 404
+    assert b"Not Found" in err.value.read()
+
+    # Unknown scheme
+    with pytest.raises(urllib.error.URLError):
+        pool.urlopen(urllib.request.Request("ftp://127.0.0.1/data"))
+
+    # Connection refused
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    port = server.server_address[1]
+    server.server_close()
+    with pytest.raises(urllib.error.URLError):
+        pool.urlopen(urllib.request.Request(f"http://127.0.0.1:{port}/data"))
+
+# END Test testCoreTransport_Errors
+
+
+@pytest.mark.core
+def testCoreTransport_Proxy(httpServer, monkeypatch):
+    """Test that the proxies in the environment are used."""
+    for name in ("http_proxy", "https_proxy", "no_proxy", "all_proxy"):
+        monkeypatch.delenv(name, raising=False)
+        monkeypatch.delenv(name.upper(), raising=False)
+    pool = HTTPPool(size=1, timeout=5)
+    proxyUrl = httpServer.replace("http://", "http://user:p%40ss@")
+
+    # Plain http is forwarded with the full url
+    monkeypatch.setenv("http_proxy", proxyUrl)
+    resp = pool.urlopen(urllib.request.Request("http://vocab.example.invalid/data?uri=1"))
+    assert json.loads(resp.read()) == {
+        "path": "http://vocab.example.invalid/data?uri=1",
+        "auth": "Basic " + base64.b64encode(b"user:p@ss").decode("ascii"),
+    }
+
+    # Bypassed hosts are connected to directly
+    monkeypatch.setenv("no_proxy", "127.0.0.1")
+    resp = pool.urlopen(urllib.request.Request(f"{httpServer}/data"))
+    assert json.loads(resp.read()) == {"path": "/data"}
+    assert pool.stats["opened"] == 2
+
+    # Https is tunnelled through the proxy
+    monkeypatch.setenv("https_proxy", "proxy.example.invalid:3128")
+    proxy = pool._get_proxy(urllib.parse.urlsplit("https://vocab.met.no/rest"))
+    assert proxy == "http://proxy.example.invalid:3128"
+    conn, _ = pool._acquire(("https", "vocab.met.no", None, proxy), 5)
+    assert isinstance(conn, http.client.HTTPSConnection)
+    assert (conn.host, conn.port) == ("proxy.example.invalid", 3128)
+    assert conn._tunnel_host == "vocab.met.no"
+
+# END Test testCoreTransport_Proxy
+
+
+@pytest.mark.core
+def testCoreTransport_StaleConnection(httpServer):
+    """Test that an idle connection closed by the server is replaced."""
+    pool = HTTPPool(size=1, timeout=5)
+    pool.urlopen(urllib.request.Request(f"{httpServer}/drop"))
+    assert pool.stats["idle"] == 1
+
+    resp = pool.urlopen(urllib.request.Request(f"{httpServer}/data"))
+    assert resp.status == 200
+    assert pool.stats["opened"] == 2
+
+# END Test testCoreTransport_StaleConnection
+
+
+@pytest.mark.core
+def testCoreTransport_Fork(httpServer):
+    """Test that idle connections are not reused after a fork."""
+    pool = HTTPPool(size=1, timeout=5)
+    pool.urlopen(urllib.request.Request(f"{httpServer}/data"))
+    assert pool.stats["idle"] == 1
+
+    # Pretend to be the child of the process that made the pool
+    pool._pid = -1
+    assert pool.stats["idle"] == 0
+    assert pool._pid > 0
+
+    pool._pid = -1
+    resp = pool.urlopen(urllib.request.Request(f"{httpServer}/data"))
+    assert resp.status == 200
+    assert pool.stats == {"opened": 2, "reused": 0, "idle": 1}
+
+# END Test testCoreTransport_Fork
+
+
+@pytest.mark.core
+def testCoreTransport_GlobalPool(monkeypatch):
+    """Test the process-wide pool accessors."""
+    with monkeypatch.context() as mp:
+        mp.setattr(metvocab.transport, "_pool", None)
+        pool = get_pool()
+        assert isinstance(pool, HTTPPool)
+        assert get_pool() is pool
+
+        other = HTTPPool()
+        set_pool(other)
+        assert get_pool() is other
+
+        set_pool(None)
+        assert isinstance(get_pool(), HTTPPool)
+        assert get_pool() is not other
+
+# END Test testCoreTransport_GlobalPool
+
+
+@pytest.mark.core
+def testCoreTransport_ReadTimeout():
+    """Test that a server that never answers times out."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    port = server.server_address[1]
+    pool = HTTPPool(size=1, timeout=0.2, connect_timeout=1)
+    try:
+        # The server accepts the connection but is never serving
+        with pytest.raises(urllib.error.URLError) as err:
+            pool.urlopen(urllib.request.Request(f"http://127.0.0.1:{port}/data"))
+        assert "timed out" in str(err.value)
+    finally:
+        server.server_close()
+
+# END Test testCoreTransport_ReadTimeout
+
+
+@pytest.mark.core
+def testCoreTransport_CircuitBreaker(monkeypatch):
+    """Test the circuit breaker states."""
+    breaker = CircuitBreaker(threshold=2, reset_timeout=10)
+    assert breaker.state == "closed"
+    assert breaker.allow() is True
+
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.allow() is False
+
+    breaker.reset()
+    assert breaker.state == "closed"
+    assert breaker.status["failures"] == 0
+
+    with monkeypatch.context() as mp:
+        mp.setenv("METVOCAB_BREAKER_THRESHOLD", "7")
+        mp.setenv("METVOCAB_BREAKER_RESET", "30")
+        breaker = CircuitBreaker()
+        assert breaker.status["threshold"] == 7
+        assert breaker._reset_timeout == 30.0
+
+# END Test testCoreTransport_CircuitBreaker
+
+
+@pytest.mark.core
+def testCoreTransport_RetryPolicy(monkeypatch):
+    """Test the retry delay calculation."""
+    policy = RetryPolicy(attempts=4, backoff=1.0, max_backoff=3.0, deadline=100)
+    assert policy.attempts == 4
+    assert policy.deadline == 100.0
+    start = time.monotonic()
+    err503 = urllib.error.HTTPError("url", 503, "Unavailable", {}, None)
+
+    # Exponential backoff with jitter, capped
+    with monkeypatch.context() as mp:
+        mp.setattr("random.uniform", lambda a, b: b)
+        assert policy.next_delay(1, err503, start) == 1.0
+        assert policy.next_delay(2, err503, start) == 2.0
+        assert policy.next_delay(3, err503, start) == 3.0
+        assert policy.next_delay(4, err503, start) is None
+
+    for _ in range(20):
+        assert 0.0 <= policy.next_delay(2, err503, start) <= 2.0
+
+    # Retryable errors
+    assert policy.is_retryable(urllib.error.URLError("Down")) is True
+    assert policy.is_retryable(err503) is True
+    assert policy.is_retryable(urllib.error.HTTPError("url", 404, "", {}, None)) is False
+    assert policy.is_retryable(ValueError("Nope")) is False
+    assert policy.next_delay(1, ValueError("Nope"), start) is None
+
+    # Retry-After in seconds and as a date
+    with monkeypatch.context() as mp:
+        mp.setattr("random.uniform", lambda a, b: 0.0)
+        err = urllib.error.HTTPError("url", 429, "", {"Retry-After": "7"}, None)
+        assert policy.next_delay(1, err, start) == 7.0
+        when = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 30))
+        err = urllib.error.HTTPError("url", 503, "", {"Retry-After": when}, None)
+        assert 25.0 < policy.next_delay(1, err, start) <= 30.0
+        err = urllib.error.HTTPError("url", 503, "", {"Retry-After": "soon"}, None)
+        assert policy.next_delay(1, err, start) == 0.0
+        err = urllib.error.HTTPError("url", 503, "", {"Retry-After": "1000"}, None)
+        assert policy.next_delay(1, err, start) is None
+
+    # Global policy
+    with monkeypatch.context() as mp:
+        mp.setenv("METVOCAB_RETRIES", "5")
+        mp.setenv("METVOCAB_RETRY_DEADLINE", "10")
+        mp.setattr(metvocab.transport, "_retry_policy", None)
+        set_retry_policy(RetryPolicy())
+        assert get_retry_policy().attempts == 5
+        assert get_retry_policy().deadline == 10.0
+
+# END Test testCoreTransport_RetryPolicy
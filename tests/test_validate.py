@@ -0,0 +1,307 @@
+"""
+MetVocab : Bulk Attribute Validation Tests
+==========================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import io
+import os
+import json
+import pytest
+
+from tools import readJson, writeFile
+
+from metvocab.cli import main
+from metvocab.cache import DataCache
+from metvocab.mockserver import MockServer
+from metvocab.transport import get_pool
+from metvocab.cfstd import SNAPSHOT_FILE
+from metvocab.validate import (
+    FileResult, find_files, parse_cdl, parse_json, validate_file, validate_files
+)
+
+ACCESS_URI = "https://vocab.met.no/mmd/Access_Constraint"
+MMD_FIELDS = {"access_constraint": ACCESS_URI}
+
+CDL_TEXT = """netcdf test {
+dimensions:
+\ttime = UNLIMITED ; // (4 currently)
+variables:
+\tdouble time(time) ;
+\t\ttime:standard_name = "time" ;
+\t\ttime:units = "seconds since 1970-01-01" ;
+\tfloat air(time) ;
+\t\tair:standard_name = "air_temperature status_flag" ;
+\t\tair:_FillValue = -999.f ;
+\t\tair:valid_range = 0.f, 400.f ;
+\t\tair:comment = "a \\"quoted\\" ; text" ;
+\tfloat sst(time) ;
+\t\tsst:standard_name = "sea_surface_temprature" ;
+\tfloat swell(time) ;
+\t\tswell:standard_name = "swell_wave_period" ;
+
+// global attributes:
+\t\t:title = "Test" ;
+\t\t:summary = "Line one\\n",
+\t\t\t"line two" ;
+\t\t:access_constraint = "Open, Closed" ;
+}
+"""
+
+
+@pytest.fixture(scope="function")
+def mockVocab(fncDir, filesDir, monkeypatch):
+    """Serve the Access_Constraint vocabulary from the test files, with
+    a clean cache folder.
+    """
+    data = readJson(os.path.join(filesDir, "Access_Constraint.json"))
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
+    monkeypatch.setattr(
+        DataCache, "get_vocab", lambda self, voc_id, uri: data if uri == ACCESS_URI else {}
+    )
+    return fncDir
+
+
+@pytest.fixture(scope="function")
+def mockServer(fncDir, filesDir, monkeypatch):
+    """Serve the test files from a mock server, with a clean cache
+    folder. Unlike mockVocab, this also works in spawned worker
+    processes.
+    """
+    monkeypatch.setenv("METVOCAB_CACHEPATH", fncDir)
+    monkeypatch.delenv("METVOCAB_BACKEND", raising=False)
+
+    server = MockServer()
+    server.add_fixtures(filesDir)
+    with server:
+        monkeypatch.setenv("METVOCAB_API_URL", server.url)
+        yield server
+
+
+@pytest.mark.core
+def testCoreValidate_ParseCdl():
+    """Test parsing the attributes of a CDL text."""
+    global_attrs, variables = parse_cdl(CDL_TEXT)
+    assert global_attrs == {
+        "title": "Test",
+        "summary": "Line one\nline two",
+        "access_constraint": "Open, Closed",
+    }
+    assert sorted(variables) == ["air", "sst", "swell", "time"]
+    assert variables["time"] == {"standard_name": "time", "units": "seconds since 1970-01-01"}
+    assert variables["air"]["standard_name"] == "air_temperature status_flag"
+    assert variables["air"]["_FillValue"] == "-999.f"
+    assert variables["air"]["valid_range"] == "0.f, 400.f"
+    assert variables["air"]["comment"] == "a \"quoted\" ; text"
+    assert parse_cdl("") == ({}, {})
+
+# END Test testCoreValidate_ParseCdl
+
+
+@pytest.mark.core
+def testCoreValidate_ParseJson():
+    """Test parsing a JSON attribute dump."""
+    global_attrs, variables = parse_json({
+        "attributes": {"title": "Test"},
+        "variables": {
+            "air": {"attributes": {"standard_name": "air_temperature"}},
+            "sst": {"standard_name": "sea_surface_temperature"},
+            "bad": [1, 2],
+        },
+    })
+    assert global_attrs == {"title": "Test"}
+    assert variables == {
+        "air": {"standard_name": "air_temperature"},
+        "sst": {"standard_name": "sea_surface_temperature"},
+    }
+    assert parse_json({}) == ({}, {})
+    with pytest.raises(ValueError):
+        parse_json([])
+    with pytest.raises(ValueError):
+        parse_json({"attributes": "nope"})
+    with pytest.raises(ValueError):
+        parse_json({"variables": ["air", "sst"]})
+    with pytest.raises(ValueError):
+        parse_json({"variables": "air"})
+
+# END Test testCoreValidate_ParseJson
+
+
+@pytest.mark.core
+def testCoreValidate_MalformedJson(mockVocab):
+    """Test that malformed JSON dumps are reported, not raised."""
+    paths = []
+    for i, data in enumerate([[1, 2], "text", {"variables": [1]}, {"variables": "air"}]):
+        paths.append(os.path.join(mockVocab, f"bad{i}.json"))
+        writeFile(paths[-1], json.dumps(data))
+    for result in validate_files(paths, workers=1, mmd_fields=MMD_FIELDS):
+        assert result.ok is False
+        assert result.errors[0].startswith("could not read the file")
+
+    # Values that are not strings are invalid
+    jsonFile = os.path.join(mockVocab, "values.json")
+    writeFile(jsonFile, json.dumps({
+        "attributes": {"access_constraint": ["Open"]},
+        "variables": {"air": {"standard_name": ["air_temperature"]}, "sst": {"standard_name": 1}},
+    }))
+    result = validate_file(jsonFile, mmd_fields=MMD_FIELDS)
+    assert result.checked == 3
+    assert result.errors == [
+        "air: standard_name is not a string",
+        "sst: standard_name is not a string",
+        "access_constraint: the value is not a string",
+    ]
+
+# END Test testCoreValidate_MalformedJson
+
+
+@pytest.mark.core
+def testCoreValidate_ValidateFile(mockVocab):
+    """Test validating single files."""
+    cdlFile = os.path.join(mockVocab, "test.cdl")
+    writeFile(cdlFile, CDL_TEXT)
+    result = validate_file(cdlFile, mmd_fields=MMD_FIELDS)
+    assert isinstance(result, FileResult)
+    assert result.ok is False
+    assert result.checked == 5
+    assert result.errors == [
+        "sst: invalid standard_name 'sea_surface_temprature', "
+        "did you mean 'sea_surface_temperature'?",
+        "access_constraint: invalid value 'Closed'",
+    ]
+    assert result.warnings == [
+        "swell: standard_name 'swell_wave_period' is an alias of 'sea_surface_swell_wave_period'"
+    ]
+    assert str(result).startswith(f"{cdlFile}: INVALID\n  error: sst:")
+    assert result.as_dict()["checked"] == 5
+
+    # JSON
+    jsonFile = os.path.join(mockVocab, "test.json")
+    writeFile(jsonFile, json.dumps({
+        "attributes": {"access_constraint": "Open"},
+        "variables": {"air": {"attributes": {"standard_name": "air_temperature"}}},
+    }))
+    result = validate_file(jsonFile, mmd_fields=MMD_FIELDS)
+    assert result.ok is True
+    assert result.checked == 2
+    assert str(result) == f"{jsonFile}: OK"
+
+    # Unreadable files
+    writeFile(jsonFile, "{")
+    assert validate_file(jsonFile).errors[0].startswith("could not read the file")
+    assert validate_file(os.path.join(mockVocab, "missing.cdl")).ok is False
+
+    # A vocabulary that cannot be loaded
+    result = validate_file(cdlFile, mmd_fields={"title": "https://vocab.met.no/mmd/Nope"})
+    assert result.warnings[-1] == "title: the vocabulary https://vocab.met.no/mmd/Nope " \
+        "could not be loaded"
+
+# END Test testCoreValidate_ValidateFile
+
+
+@pytest.mark.core
+@pytest.mark.parametrize("workers", [1, 2])
+def testCoreValidate_ValidateFiles(mockServer, fncDir, workers):
+    """Test validating many files, in order, in worker processes."""
+    mockVocab = os.path.join(fncDir, "files")
+    os.mkdir(mockVocab)
+    paths = []
+    for i in range(25):
+        path = os.path.join(mockVocab, f"file{i:02d}.cdl")
+        name = "air_temperature" if i % 5 else "air_temperatur"
+        writeFile(path, f':access_constraint = "Open" ;\nx:standard_name = "{name}" ;\n')
+        paths.append(path)
+
+    results = list(validate_files(
+        iter(paths), workers=workers, mmd_fields=MMD_FIELDS, chunksize=3
+    ))
+    assert [r.path for r in results] == paths
+    assert [r.ok for r in results] == [bool(i % 5) for i in range(25)]
+    assert all(r.checked == 2 for r in results)
+
+    # The CF snapshot is built before the workers start
+    assert os.path.isfile(os.path.join(fncDir, SNAPSHOT_FILE))
+
+    # Directories are searched for CDL and JSON files
+    writeFile(os.path.join(mockVocab, "notes.txt"), "")
+    os.mkdir(os.path.join(mockVocab, "sub"))
+    writeFile(os.path.join(mockVocab, "sub", "a.json"), "{}")
+    found = list(find_files([mockVocab, "other.txt"]))
+    assert found == paths + [os.path.join(mockVocab, "sub", "a.json"), "other.txt"]
+
+# END Test testCoreValidate_ValidateFiles
+
+
+@pytest.mark.core
+def testCoreValidate_WorkersAfterRequest(mockServer, fncDir):
+    """Test validating in worker processes after this process has open
+    connections in the pool.
+    """
+    assert DataCache().get_vocab("mmd", ACCESS_URI)["graph"]
+    assert get_pool().stats["idle"] > 0
+    requests = mockServer.stats["requests"]
+
+    paths = []
+    for i in range(8):
+        path = os.path.join(fncDir, f"file{i}.cdl")
+        writeFile(path, ':access_constraint = "Open" ;\nx:standard_name = "air_temperature" ;\n')
+        paths.append(path)
+
+    results = list(validate_files(paths, workers=2, mmd_fields=MMD_FIELDS, chunksize=2))
+    assert [r.path for r in results] == paths
+    assert all(r.ok and r.checked == 2 for r in results)
+
+    # The workers read the cache, and the pool of this process still works
+    assert mockServer.stats["requests"] == requests
+    assert DataCache().get_vocab("mmd", "https://vocab.met.no/mmd/Instrument")["graph"]
+    assert mockServer.stats["requests"] == requests + 1
+
+# END Test testCoreValidate_WorkersAfterRequest
+
+
+@pytest.mark.core
+def testCoreValidate_Cli(mockVocab, monkeypatch, capsys):
+    """Test the validate command."""
+    goodFile = os.path.join(mockVocab, "good.cdl")
+    badFile = os.path.join(mockVocab, "bad.cdl")
+    writeFile(goodFile, 'x:standard_name = "air_temperature" ;\n')
+    writeFile(badFile, 'x:standard_name = "air_temperatur" ;\n:access_constraint = "No" ;\n')
+
+    assert main(["validate", goodFile, "--workers", "1"]) == 0
+    assert capsys.readouterr().out == "Validated 1 files, 0 invalid\n"
+
+    assert main(["validate", mockVocab, "--workers", "1", "--no-mmd"]) == 1
+    out = capsys.readouterr().out
+    assert f"{badFile}: INVALID" in out
+    assert "access_constraint" not in out
+    assert "Validated 2 files, 1 invalid" in out
+
+    listFile = os.path.join(mockVocab, "files.txt")
+    writeFile(listFile, f"{goodFile}\n\n{badFile}\n")
+    assert main(["validate", "--files-from", listFile, "--workers", "1", "--json"]) == 1
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [line["path"] for line in lines] == [goodFile, badFile]
+    assert lines[1]["ok"] is False
+    assert len(lines[1]["errors"]) == 2
+
+    monkeypatch.setattr("sys.stdin", io.StringIO(goodFile + "\n"))
+    assert main(["validate", "--files-from", "-", "--workers", "1"]) == 0
+    assert "Validated 1 files" in capsys.readouterr().out
+
+    with pytest.raises(SystemExit):
+        main(["validate"])
+
+# END Test testCoreValidate_Cli